@@ -0,0 +1,15 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Run all the benchmarks: python -m benchmarks -o results.json"""
+
+from . import (  # noqa: F401
+    bench_buffer, bench_curses, bench_reverse, bench_sidetable, bench_workers)
+from .runner import main
+
+
+main()
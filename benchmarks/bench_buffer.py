@@ -0,0 +1,54 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Handing the payload of a C type over to a consumer of buffers
+
+`ffruit.Blob` keeps its payload in a `bytearray` without exposing it.
+The `copy` case hands it over through `Blob.tobytes()`, the `cursed`
+one through a `__buffer__` returning the payload and `native` gets a
+view of the payload itself. The consumer is `memoryview`, so only the
+hand-off is measured.
+"""
+
+from contextlib import contextmanager
+
+from forbiddenfruit import curse, reverse
+from tests.unit.ffruit import Blob
+
+from .runner import benchmark
+
+
+def payload(self, flags):
+    return self.payload
+
+
+def buffer_group(size, label):
+    group = 'buffer/{0}'.format(label)
+    blob = Blob(bytearray(size))
+
+    @benchmark(group, 'native')
+    @contextmanager
+    def native():
+        yield 'memoryview(payload)', {'payload': blob.payload}
+
+    @benchmark(group, 'copy')
+    @contextmanager
+    def copy():
+        yield 'memoryview(blob.tobytes())', {'blob': blob}
+
+    @benchmark(group, 'cursed', engines=True)
+    @contextmanager
+    def cursed():
+        curse(Blob, '__buffer__', payload)
+        try:
+            yield 'memoryview(blob)', {'blob': blob}
+        finally:
+            reverse(Blob, '__buffer__')
+
+
+for size, label in ((4096, '4KiB'), (2 ** 20, '1MiB')):
+    buffer_group(size, label)
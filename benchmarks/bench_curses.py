@@ -0,0 +1,620 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Per-call overhead of cursed attributes
+
+Each group has a `native` case, served by a C implementation, a `python`
+case where the same thing is defined on a regular python class and a
+`cursed` case where it's cursed onto the `ffruit.Dummy` C type.
+"""
+
+from contextlib import contextmanager
+
+from forbiddenfruit import (
+    cursed, curse, curse_many, reverse, snapshot, restore)
+from tests.unit.ffruit import Dummy
+
+from .runner import benchmark
+
+
+def method(self):
+    return self
+
+
+def binary(self, other):
+    return self
+
+
+def predicate(self):
+    return True
+
+
+def item(self, index):
+    return index
+
+
+def store(self, key, value):
+    pass
+
+
+def length(self):
+    return 3
+
+
+def text(self):
+    return 'dummy'
+
+
+def digest(self):
+    return 42
+
+
+class Python(object):
+    __add__ = binary
+    __neg__ = method
+    __bool__ = predicate
+    __getitem__ = item
+    __setitem__ = store
+    __len__ = length
+    __str__ = text
+    __hash__ = digest
+
+    method = method
+    classmethod = classmethod(method)
+
+
+@contextmanager
+def cursed_dummy(attr, value):
+    with cursed(Dummy, attr, value):
+        yield Dummy()
+
+
+# methods
+
+@benchmark('method', 'native')
+@contextmanager
+def method_native():
+    yield 'obj.my_method()', {'obj': Dummy()}
+
+
+@benchmark('method', 'python')
+@contextmanager
+def method_python():
+    yield 'obj.method()', {'obj': Python()}
+
+
+@benchmark('method', 'cursed')
+@contextmanager
+def method_cursed():
+    with cursed_dummy('cursed_method', method) as obj:
+        yield 'obj.cursed_method()', {'obj': obj}
+
+
+@benchmark('method', 'instrumented')
+@contextmanager
+def method_instrumented():
+    curse(Dummy, 'cursed_method', method, instrument=True)
+    try:
+        yield 'obj.cursed_method()', {'obj': Dummy()}
+    finally:
+        reverse(Dummy, 'cursed_method')
+
+
+@benchmark('classmethod', 'native')
+@contextmanager
+def classmethod_native():
+    yield 'dict.fromkeys(())', {}
+
+
+@benchmark('classmethod', 'python')
+@contextmanager
+def classmethod_python():
+    yield 'Python.classmethod()', {'Python': Python}
+
+
+@benchmark('classmethod', 'cursed')
+@contextmanager
+def classmethod_cursed():
+    with cursed_dummy('cursed_classmethod', classmethod(method)):
+        yield 'Dummy.cursed_classmethod()', {'Dummy': Dummy}
+
+
+# number and sequence dunders
+
+def dunder_group(slot, attr, func, stmt, native):
+    """Register the native, python and cursed cases of a dunder"""
+
+    @benchmark(slot, 'native')
+    @contextmanager
+    def native_case():
+        yield stmt, {'obj': native}
+
+    @benchmark(slot, 'python')
+    @contextmanager
+    def python_case():
+        yield stmt, {'obj': Python()}
+
+    @benchmark(slot, 'cursed', engines=True)
+    @contextmanager
+    def cursed_case():
+        with cursed_dummy(attr, func) as obj:
+            yield stmt, {'obj': obj}
+
+
+dunder_group('nb_add', '__add__', binary, 'obj + obj', 1)
+dunder_group('nb_negative', '__neg__', method, '-obj', 1)
+
+
+@benchmark('nb_negative', 'instrumented', engines=True)
+@contextmanager
+def nb_negative_instrumented():
+    curse(Dummy, '__neg__', method, instrument=True)
+    try:
+        yield '-obj', {'obj': Dummy()}
+    finally:
+        reverse(Dummy, '__neg__')
+
+dunder_group('nb_bool', '__bool__', predicate, 'not obj', 1)
+dunder_group('sq_item', '__getitem__', item, 'obj[1]', [1, 2, 3])
+dunder_group('sq_length', '__len__', length, 'len(obj)', [1, 2, 3])
+dunder_group('mp_subscript', '__getitem__', item, 'obj["key"]', {'key': 1})
+dunder_group('mp_ass_subscript', '__setitem__', store, 'obj["key"] = 1', {})
+dunder_group('mp_length', '__len__', length, 'len(obj)', {'key': 1})
+
+
+# type slots, the native case runs on an uncursed Dummy
+
+def type_slot_group(slot, attr, func, stmt):
+    @benchmark(slot, 'native')
+    @contextmanager
+    def native_case():
+        yield stmt, {'obj': Dummy()}
+
+    @benchmark(slot, 'python')
+    @contextmanager
+    def python_case():
+        yield stmt, {'obj': Python()}
+
+    @benchmark(slot, 'cursed', engines=True)
+    @contextmanager
+    def cursed_case():
+        with cursed_dummy(attr, func) as obj:
+            yield stmt, {'obj': obj}
+
+
+type_slot_group('tp_str', '__str__', text, 'str(obj)')
+type_slot_group('tp_hash', '__hash__', digest, 'hash(obj)')
+
+
+@benchmark('tp_new', 'native')
+@contextmanager
+def tp_new_native():
+    yield 'Dummy()', {'Dummy': Dummy}
+
+
+@benchmark('tp_new', 'cursed', engines=True)
+@contextmanager
+def tp_new_cursed():
+    def new(cls, args, kwargs):
+        return None
+    with cursed(Dummy, '__new__', new):
+        yield 'Dummy()', {'Dummy': Dummy}
+
+
+# constructors with arguments, `test_dunder_new` on a C type
+
+def spread_new(cls, x, y):
+    return x
+
+
+def classic_new(cls, args, kwargs):
+    return args[0]
+
+
+@contextmanager
+def cursed_new(func, vectorcall):
+    curse(Dummy, '__new__', func, vectorcall=vectorcall)
+    try:
+        yield 'Dummy(1, 2)', {'Dummy': Dummy}
+    finally:
+        reverse(Dummy, '__new__')
+
+
+@benchmark('tp_new/args', 'python')
+@contextmanager
+def tp_new_args_python():
+    class Python(object):
+        __new__ = spread_new
+    yield 'Python(1, 2)', {'Python': Python}
+
+
+@benchmark('tp_new/args', 'cursed', engines=True)
+def tp_new_args_cursed():
+    return cursed_new(classic_new, False)
+
+
+@benchmark('tp_new/args', 'vectorcall', engines=True)
+def tp_new_args_vectorcall():
+    return cursed_new(spread_new, True)
+
+
+@benchmark('tp_call', 'cursed', engines=True)
+@contextmanager
+def tp_call_cursed():
+    with cursed_dummy('__call__', lambda self, args, kwargs: self) as obj:
+        yield 'obj(1, 2)', {'obj': obj}
+
+
+@benchmark('tp_call', 'vectorcall', engines=True)
+@contextmanager
+def tp_call_vectorcall():
+    curse(Dummy, '__call__', lambda self, x, y: self, vectorcall=True)
+    try:
+        yield 'obj(1, 2)', {'obj': Dummy()}
+    finally:
+        reverse(Dummy, '__call__')
+
+
+# iterating a thousand items, `tp_iter` hands out a generator and
+# `tp_iternext` is called by `zip()` for each item
+
+ITEMS = 1000
+
+
+def items(self):
+    return (i for i in range(ITEMS))
+
+
+def iterator(self):
+    return self
+
+
+def next_item(self):
+    return 1
+
+
+class PythonIterator(object):
+    __iter__ = iterator
+    __next__ = next_item
+
+
+@benchmark('tp_iter', 'native', number=1000)
+@contextmanager
+def tp_iter_native():
+    yield 'for _ in obj: pass', {'obj': range(ITEMS)}
+
+
+@benchmark('tp_iter', 'python', number=1000)
+@contextmanager
+def tp_iter_python():
+    class Python(object):
+        __iter__ = items
+    yield 'for _ in obj: pass', {'obj': Python()}
+
+
+@benchmark('tp_iter', 'cursed', engines=True, number=1000)
+@contextmanager
+def tp_iter_cursed():
+    with cursed_dummy('__iter__', items) as obj:
+        yield 'for _ in obj: pass', {'obj': obj}
+
+
+ZIPPED = 'for _ in zip(range(ITEMS), obj): pass'
+
+
+@benchmark('tp_iternext', 'native', number=1000)
+@contextmanager
+def tp_iternext_native():
+    from itertools import repeat
+    yield ZIPPED, {'obj': repeat(1), 'ITEMS': ITEMS}
+
+
+@benchmark('tp_iternext', 'python', number=1000)
+@contextmanager
+def tp_iternext_python():
+    yield ZIPPED, {'obj': PythonIterator(), 'ITEMS': ITEMS}
+
+
+@benchmark('tp_iternext', 'cursed', engines=True, number=1000)
+@contextmanager
+def tp_iternext_cursed():
+    curse_many(Dummy, {'__iter__': iterator, '__next__': next_item})
+    try:
+        yield ZIPPED, {'obj': Dummy(), 'ITEMS': ITEMS}
+    finally:
+        reverse(Dummy, '__next__')
+        reverse(Dummy, '__iter__')
+
+
+# `async for` over a thousand items within an asyncio event loop, the
+# native case is an async generator. `__anext__` returns a coroutine
+# for each item, like the ones of python classes.
+
+ASYNC_STMT = 'loop.run_until_complete(consume(obj))'
+
+# items left for the `async for` loops running
+pending = []
+
+
+async def consume(obj):
+    pending.append(iter(range(ITEMS)))
+    async for _ in obj:
+        pass
+    pending.pop()
+
+
+async def next_pending():
+    for item in pending[-1]:
+        return item
+    raise StopAsyncIteration
+
+
+def anext_item(self):
+    return next_pending()
+
+
+async def generate():
+    for item in range(ITEMS):
+        yield item
+
+
+@contextmanager
+def event_loop(obj):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        yield ASYNC_STMT, {'loop': loop, 'consume': consume, 'obj': obj}
+    finally:
+        loop.close()
+
+
+@benchmark('async_for', 'native', number=1000)
+def async_for_native():
+    class Generated(object):
+        def __aiter__(self):
+            return generate()
+    return event_loop(Generated())
+
+
+@benchmark('async_for', 'python', number=1000)
+def async_for_python():
+    class Wrapper(object):
+        __slots__ = ('obj',)
+        __aiter__ = iterator
+        __anext__ = anext_item
+
+        def __init__(self, obj):
+            self.obj = obj
+    return event_loop(Wrapper(Dummy()))
+
+
+@benchmark('async_for', 'cursed', engines=True, number=1000)
+@contextmanager
+def async_for_cursed():
+    curse_many(Dummy, {'__aiter__': iterator, '__anext__': anext_item})
+    try:
+        with event_loop(Dummy()) as case:
+            yield case
+    finally:
+        reverse(Dummy, '__anext__')
+        reverse(Dummy, '__aiter__')
+
+
+# sorting a million numbers in random order. `list.sort()` has its own
+# comparisons for floats, other types get their `tp_richcompare` called
+# straight, like `complex` with a cursed `__lt__`, which keeps the native
+# `==` and `!=`
+
+SORTED_SIZE = 1000000
+
+
+def shuffled(kind):
+    import random
+    numbers = list(map(kind, range(SORTED_SIZE)))
+    random.Random(42).shuffle(numbers)
+    return numbers
+
+
+def less_real(self, other):
+    return self.real < other.real
+
+
+class Real(object):
+    __slots__ = ('real',)
+    __lt__ = less_real
+
+    def __init__(self, real):
+        self.real = real
+
+
+@benchmark('sorted', 'native', number=1, memory=False)
+@contextmanager
+def sorted_native():
+    yield 'sorted(numbers)', {'numbers': shuffled(float)}
+
+
+@benchmark('sorted', 'python', number=1, memory=False)
+@contextmanager
+def sorted_python():
+    yield 'sorted(numbers)', {'numbers': shuffled(Real)}
+
+
+@benchmark('sorted', 'cursed', engines=True, number=1, memory=False)
+@contextmanager
+def sorted_cursed():
+    with cursed(complex, '__lt__', less_real):
+        yield 'sorted(numbers)', {'numbers': shuffled(complex)}
+
+
+# installing and removing curses
+
+@benchmark('roundtrip', 'curse-reverse', number=10000)
+@contextmanager
+def roundtrip_curse():
+    yield ('curse(Dummy, "roundtrip", 1); reverse(Dummy, "roundtrip")',
+           {'curse': curse, 'reverse': reverse, 'Dummy': Dummy})
+
+
+@benchmark('roundtrip', 'cursed', number=10000)
+@contextmanager
+def roundtrip_cursed():
+    yield ('with cursed(Dummy, "roundtrip", 1): pass',
+           {'cursed': cursed, 'Dummy': Dummy})
+
+
+@benchmark('roundtrip', 'dunder', engines=True, number=10000)
+@contextmanager
+def roundtrip_dunder():
+    yield ('curse(Dummy, "__neg__", method); reverse(Dummy, "__neg__")',
+           {'curse': curse, 'reverse': reverse, 'Dummy': Dummy,
+            'method': method})
+
+
+@benchmark('roundtrip', 'scoped', number=10000)
+@contextmanager
+def roundtrip_scoped():
+    yield ('with cursed(Dummy, "roundtrip", 1, scoped=True): pass',
+           {'cursed': cursed, 'Dummy': Dummy})
+
+
+@benchmark('method', 'scoped')
+@contextmanager
+def method_scoped():
+    with cursed(Dummy, 'scoped_method', method, scoped=True):
+        yield 'obj.scoped_method()', {'obj': Dummy()}
+
+
+# listing attributes
+
+@benchmark('dir', 'type')
+@contextmanager
+def dir_type():
+    with cursed(Dummy, 'hidden', 1, hide_from_dir=True):
+        yield 'dir(Dummy)', {'Dummy': Dummy}
+
+
+@benchmark('dir', 'instance')
+@contextmanager
+def dir_instance():
+    with cursed(Dummy, 'hidden', 1, hide_from_dir=True):
+        yield 'dir(obj)', {'obj': Dummy()}
+
+
+# every slot kind cursed and reversed in one go
+bulk_dunders = {
+    '__add__': binary, '__sub__': binary, '__mul__': binary,
+    '__neg__': method, '__pos__': method, '__invert__': method,
+    '__bool__': predicate, '__getitem__': item, '__len__': length,
+    '__str__': text, '__hash__': digest,
+}
+
+
+def bulk_roundtrip():
+    curse_many(Dummy, bulk_dunders)
+    for attr in bulk_dunders:
+        reverse(Dummy, attr)
+
+
+@benchmark('roundtrip', 'dunder-bulk', engines=True, number=1000)
+@contextmanager
+def roundtrip_dunder_bulk():
+    yield 'bulk_roundtrip()', {'bulk_roundtrip': bulk_roundtrip}
+
+
+# manifests of many curses, against cursing them one by one
+manifest_entries = [
+    ('str', 'manifest_{0}'.format(i), 'posixpath:basename')
+    for i in range(200)]
+
+
+def curse_entries():
+    from posixpath import basename
+    for _, attr, _ in manifest_entries:
+        curse(str, attr, basename)
+    for _, attr, _ in manifest_entries:
+        reverse(str, attr)
+
+
+@benchmark('manifest', 'curse', number=100)
+@contextmanager
+def manifest_curse():
+    yield 'curse_entries()', {'curse_entries': curse_entries}
+
+
+@benchmark('manifest', 'eager', number=100)
+@contextmanager
+def manifest_eager():
+    from forbiddenfruit.manifest import apply_manifest
+    yield ('apply_manifest(entries, lazy=False).reverse()',
+           {'apply_manifest': apply_manifest, 'entries': manifest_entries})
+
+
+@benchmark('manifest', 'lazy', number=100)
+@contextmanager
+def manifest_lazy():
+    from forbiddenfruit.manifest import apply_manifest
+    yield ('apply_manifest(entries).reverse()',
+           {'apply_manifest': apply_manifest, 'entries': manifest_entries})
+
+
+# a dunder cursed over a tree of subclasses, in one go or type by type
+dummy_tree = [Dummy]
+for _ in range(50):
+    dummy_tree.append(type('DummyChild', (dummy_tree[-1],), {}))
+
+
+def curse_tree():
+    for klass in dummy_tree:
+        curse(klass, '__neg__', method)
+    for klass in dummy_tree:
+        reverse(klass, '__neg__')
+
+
+@benchmark('propagate', 'per-type', engines=True, number=200)
+@contextmanager
+def propagate_per_type():
+    yield 'curse_tree()', {'curse_tree': curse_tree}
+
+
+@benchmark('propagate', 'propagate', engines=True, number=200)
+@contextmanager
+def propagate_tree():
+    yield ('curse(Dummy, "__neg__", method, propagate=True); '
+           'reverse(Dummy, "__neg__")',
+           {'curse': curse, 'reverse': reverse, 'Dummy': Dummy,
+            'method': method})
+
+
+# tearing down the curses of a test, one by one or from a snapshot
+teardown_attrs = dict(('teardown_{0}'.format(i), i) for i in range(20))
+
+
+def teardown_reverse():
+    curse_many(Dummy, teardown_attrs)
+    curse(Dummy, '__neg__', method)
+    for attr in teardown_attrs:
+        reverse(Dummy, attr)
+    reverse(Dummy, '__neg__')
+
+
+def teardown_restore():
+    saved = snapshot(Dummy)
+    curse_many(Dummy, teardown_attrs)
+    curse(Dummy, '__neg__', method)
+    restore(saved)
+
+
+@benchmark('teardown', 'reverse', number=1000)
+@contextmanager
+def teardown_per_attr():
+    yield 'teardown_reverse()', {'teardown_reverse': teardown_reverse}
+
+
+@benchmark('teardown', 'restore', number=1000)
+@contextmanager
+def teardown_snapshot():
+    yield 'teardown_restore()', {'teardown_restore': teardown_restore}
@@ -0,0 +1,56 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Throughput of native slots after their curses are reversed
+
+`operator.add(int, int)` is measured before `int.__add__` is ever cursed, while it's
+cursed and after it got cursed and reversed a thousand times. The first
+and the last cases should match. `operator.add` is used because the
+specializing interpreter of newer pythons adds ints without looking at
+`nb_add` at all.
+"""
+
+from operator import add as int_add
+from contextlib import contextmanager
+
+from forbiddenfruit import curse, reverse
+
+from .runner import benchmark
+
+
+def add(self, other):
+    # Everything adding ints runs through here while it's cursed,
+    # including forbiddenfruit itself
+    return int.__add__(self, other)
+
+
+NAMESPACE = {'a': 1, 'b': 2, 'add': int_add}
+
+
+@benchmark('reverse/int.__add__', 'never-cursed')
+@contextmanager
+def never_cursed():
+    yield 'add(a, b)', NAMESPACE
+
+
+@benchmark('reverse/int.__add__', 'cursed', engines=True)
+@contextmanager
+def while_cursed():
+    curse(int, '__add__', add)
+    try:
+        yield 'add(a, b)', NAMESPACE
+    finally:
+        reverse(int, '__add__')
+
+
+@benchmark('reverse/int.__add__', 'reversed', engines=True)
+@contextmanager
+def after_reverse():
+    for _ in range(1000):
+        curse(int, '__add__', add)
+        reverse(int, '__add__')
+    yield 'add(a, b)', NAMESPACE
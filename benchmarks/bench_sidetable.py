@@ -0,0 +1,103 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Memory and lookup latency of side tables holding a million entries
+
+A million strings get a provenance tag, either through a property cursed
+with `cursed_property()` or by wrapping each string in a `str` subclass
+carrying the tag, with an instance dict or with `__slots__`. Filling is
+measured once per run, the bytes per call are what a million entries
+take.
+"""
+
+from contextlib import contextmanager
+
+from forbiddenfruit import reverse
+from forbiddenfruit.sidetable import SideTable, cursed_property
+
+from .runner import benchmark
+
+
+TAGGED = 1000000
+
+
+class TaggedStr(str):
+    pass
+
+
+class SlottedStr(str):
+    __slots__ = ('origin',)
+
+
+def strings():
+    return [str(number) * 3 for number in range(TAGGED)]
+
+
+def fill_table(objects):
+    table = SideTable()
+    for obj in objects:
+        table.set(obj, 'input')
+
+
+def fill_wrappers(wrapper, objects):
+    wrapped = []
+    for obj in objects:
+        obj = wrapper(obj)
+        obj.origin = 'input'
+        wrapped.append(obj)
+
+
+@benchmark('sidetable/1M-entries', 'side-table', number=1)
+@contextmanager
+def side_table_memory():
+    yield 'fill(objects)', {'fill': fill_table, 'objects': strings()}
+
+
+@benchmark('sidetable/1M-entries', 'wrapper', number=1)
+@contextmanager
+def wrapper_memory():
+    yield 'fill(TaggedStr, objects)', {
+        'fill': fill_wrappers, 'TaggedStr': TaggedStr, 'objects': strings()}
+
+
+@benchmark('sidetable/1M-entries', 'slotted-wrapper', number=1)
+@contextmanager
+def slotted_wrapper_memory():
+    yield 'fill(SlottedStr, objects)', {
+        'fill': fill_wrappers, 'SlottedStr': SlottedStr, 'objects': strings()}
+
+
+@benchmark('sidetable/lookup', 'cursed-property')
+@contextmanager
+def property_lookup():
+    objects = strings()
+    cursed_property(str, 'origin')
+    try:
+        for obj in objects:
+            obj.origin = 'input'
+        yield 'obj.origin', {'obj': objects[TAGGED // 2]}
+    finally:
+        reverse(str, 'origin')
+
+
+@benchmark('sidetable/lookup', 'get')
+@contextmanager
+def get_lookup():
+    objects = strings()
+    table = SideTable()
+    for obj in objects:
+        table.set(obj, 'input')
+    yield 'get(obj)', {'get': table.get, 'obj': objects[TAGGED // 2]}
+
+
+@benchmark('sidetable/lookup', 'wrapper')
+@contextmanager
+def wrapper_lookup():
+    # instance attributes don't depend on how many wrappers there are
+    obj = TaggedStr('input')
+    obj.origin = 'input'
+    yield 'obj.origin', {'obj': obj}
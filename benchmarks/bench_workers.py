@@ -0,0 +1,122 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Start up time of spawned workers replicating the curses of the parent
+
+A pool of 1, 8 and 32 workers is started, handed one task per worker and
+joined, with no curses and then with the ones of `WORKER_CURSES` sent
+over by `pool_options()`. Measured once per run, spawning processes is
+slow enough.
+"""
+
+from multiprocessing import get_context
+from contextlib import contextmanager
+
+from forbiddenfruit import curse, restore, snapshot
+from forbiddenfruit.pool import pool_options
+from tests.unit.ffruit import Dummy
+
+from .runner import benchmark
+
+
+def slugify(self):
+    return '-'.join(self.lower().split())
+
+
+def shout(self):
+    return self.upper() + '!'
+
+
+def words(self):
+    return self.split()
+
+
+def halve(self):
+    return self // 2
+
+
+def digits(self):
+    return len(str(self))
+
+
+def first(self):
+    return self[0] if self else None
+
+
+def last(self):
+    return self[-1] if self else None
+
+
+def pick(self, *keys):
+    return dict((key, self[key]) for key in keys if key in self)
+
+
+def negative(self):
+    return 'negative'
+
+
+def total(self, other):
+    return 'total'
+
+
+# what a project cursing builtins could have installed at startup
+WORKER_CURSES = [
+    (str, 'slugify', slugify, {'memoize': 1024}),
+    (str, 'shout', shout, {}),
+    (str, 'words', words, {'instrument': True}),
+    (int, 'halve', halve, {}),
+    (int, 'digits', digits, {}),
+    (float, 'halve', halve, {}),
+    (list, 'first', first, {}),
+    (list, 'last', last, {}),
+    (tuple, 'first', first, {}),
+    (tuple, 'last', last, {}),
+    (dict, 'pick', pick, {}),
+    (str, 'version', '1.0', {}),
+    (Dummy, '__neg__', negative, {}),
+    (Dummy, '__add__', total, {}),
+]
+
+
+def task(_):
+    return 'a b'.slugify()
+
+
+def start_workers(processes, options):
+    with get_context('spawn').Pool(processes, **options) as pool:
+        pool.map(task if options else abs, range(processes))
+        pool.close()
+        pool.join()
+
+
+def workers_group(processes):
+    group = 'workers/{0}'.format(processes)
+
+    @benchmark(group, 'bare', number=1, memory=False)
+    @contextmanager
+    def bare():
+        yield 'start_workers(processes, {})', {
+            'start_workers': start_workers, 'processes': processes}
+
+    @benchmark(group, 'replicated', number=1, memory=False)
+    @contextmanager
+    def replicated():
+        saved = [snapshot(klass) for klass in (str, int, float, list, tuple,
+                                               dict, Dummy)]
+        try:
+            for klass, attr, value, options in WORKER_CURSES:
+                curse(klass, attr, value, **options)
+            yield 'start_workers(processes, options)', {
+                'start_workers': start_workers, 'processes': processes,
+                'options': pool_options()}
+        finally:
+            for state in saved:
+                restore(state)
+
+
+for processes in (1, 8, 32):
+    workers_group(processes)
@@ -0,0 +1,116 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Import time of forbiddenfruit: python -m benchmarks.importtime
+
+Each case runs in a fresh interpreter started with `-X importtime` and
+reports the best cumulative and self times of the `forbiddenfruit`
+import, in microseconds, along with the modules it pulled in. Byte code
+caches are written to a temporary directory and warmed up first, so the
+numbers don't include compiling the sources.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+
+# statement run after `import forbiddenfruit` for each case
+CASES = [
+    ('import', ''),
+    ('curse', 'forbiddenfruit.curse(str, "attr", 1)'),
+    ('hide_from_dir', 'forbiddenfruit.curse(str, "attr", 1, hide_from_dir=True)'),
+    ('dunder', 'forbiddenfruit.curse(str, "__neg__", lambda self: self)'),
+]
+
+
+def parse(stderr):
+    """Read `-X importtime` lines into (name, depth, self_us, cumulative_us)
+
+    Modules are listed after the ones they import, `depth` is zero for
+    the ones imported straight from the command.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), depth, int(own), int(cumulative)))
+    return modules
+
+
+def run_case(stmt, cache, root):
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')]))
+    code = 'import forbiddenfruit\n' + stmt
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env, universal_newlines=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return parse(process.stderr)
+
+
+def measure(stmt, runs, cache, root):
+    run_case(stmt, cache, root)
+    best = None
+    for _ in range(runs):
+        modules = run_case(stmt, cache, root)
+        names = [name for name, _, _, _ in modules]
+        index = names.index('forbiddenfruit')
+        start = index
+        while start and modules[start - 1][1] > 0:
+            start -= 1
+        own, cumulative = modules[index][2:]
+        if best is None or cumulative < best['cumulative_us']:
+            best = {
+                'cumulative_us': cumulative,
+                'self_us': own,
+                'imports': names[start:index],
+                # anything imported by the statement after the import
+                'deferred': names[index + 1:],
+            }
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the import time of forbiddenfruit')
+    parser.add_argument('-r', '--runs', type=int, default=20,
+                        help='interpreters started per case')
+    parser.add_argument('-o', '--output', default='-',
+                        help='where to write the JSON report')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    with tempfile.TemporaryDirectory() as cache:
+        for name, stmt in CASES:
+            result = measure(stmt, args.runs, cache, root)
+            result['name'] = name
+            results.append(result)
+            sys.stderr.write('importtime/{0:<35} {1:>8} us {2:>8} us\n'.format(
+                name, result['cumulative_us'], result['self_us']))
+
+    document = json.dumps({
+        'python': sys.version.split()[0],
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output == '-':
+        sys.stdout.write(document + '\n')
+    else:
+        with open(args.output, 'w') as output:
+            output.write(document + '\n')
+
+
+if __name__ == '__main__':
+    main()
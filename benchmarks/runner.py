@@ -0,0 +1,201 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Tiny benchmark runner
+
+Benchmarks are context managers registered with `@benchmark`. They set
+things up, yield a `(statement, namespace)` pair to be timed by `timeit`
+and clean up after themselves once the measurement is done:
+
+    @benchmark('dunder', 'nb_add')
+    @contextmanager
+    def nb_add():
+        with cursed(FunctionType, '__add__', lambda a, b: a):
+            yield 'f + 1', {'f': lambda: None}
+
+Benchmarks cursing dunder methods can be registered with `engines=True`
+to get measured once with the native trampolines and once with the ctypes
+callbacks. Long running ones can skip tracking memory with `memory=False`.
+"""
+
+import gc
+import sys
+import json
+import timeit
+import platform
+import argparse
+import tracemalloc
+
+import forbiddenfruit
+
+
+# every registered benchmark, in declaration order
+registry = []
+
+
+class Benchmark(object):
+    def __init__(self, group, name, factory, engines=False, number=None,
+                 memory=True):
+        self.group = group
+        self.name = name
+        self.factory = factory
+        self.engines = engines
+        self.number = number
+        self.memory = memory
+
+    @property
+    def key(self):
+        return '{0}/{1}'.format(self.group, self.name)
+
+
+def benchmark(group, name, engines=False, number=None, memory=True):
+    """Register the decorated context manager as a benchmark"""
+    def wrapper(factory):
+        registry.append(
+            Benchmark(group, name, factory, engines, number, memory))
+        return factory
+    return wrapper
+
+
+class engine(object):
+    """Select the engine used to install cursed dunder slots"""
+
+    speedups = forbiddenfruit._speedups
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if self.name == 'ctypes':
+            forbiddenfruit._speedups = None
+        return self
+
+    def __exit__(self, *exc):
+        forbiddenfruit._speedups = self.speedups
+
+
+def engines_for(bench):
+    if not bench.engines:
+        return [None]
+    if engine.speedups is None:
+        return ['ctypes']
+    return ['native', 'ctypes']
+
+
+def call_bytes(timer, empty, calls=20):
+    """Bytes allocated while running the statement of `timer` once
+
+    That's the peak of traced memory over a single run, less what an
+    empty statement takes, so it counts temporary objects like argument
+    tuples even though they're freed before the run is over.
+    """
+    def single(timer):
+        best = None
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            timer.timeit(1)
+            peak = tracemalloc.get_traced_memory()[1] - before
+            best = peak if best is None else min(best, peak)
+        return best
+    return max(single(timer) - single(empty), 0)
+
+
+def measure(stmt, namespace, number, repeat, memory=True):
+    """Time `stmt` and track the memory it allocates
+
+    Returns the best time per call out of `repeat` runs, the peak of
+    memory traced while running it, the bytes a single call allocates
+    and the number of memory blocks still allocated per call afterwards,
+    which should be zero unless something leaks. The memory figures are
+    None without `memory`.
+    """
+    timer = timeit.Timer(stmt, globals=namespace)
+    timer.timeit(min(number, 1000))
+    best = min(timer.repeat(repeat, number)) / number
+    if not memory:
+        return {
+            'ns_per_call': best * 1e9,
+            'peak_bytes': None,
+            'bytes_per_call': None,
+            'blocks_per_call': None,
+        }
+
+    sample = min(number, 10000)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        timer.timeit(sample)
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, 'reset_peak'):
+            allocated = call_bytes(timer, timeit.Timer('pass'))
+        else:
+            # python < 3.9
+            allocated = None
+    finally:
+        tracemalloc.stop()
+    gc.collect()
+    leaked = sys.getallocatedblocks() - blocks
+
+    return {
+        'ns_per_call': best * 1e9,
+        'peak_bytes': peak,
+        'bytes_per_call': allocated,
+        'blocks_per_call': float(leaked) / sample,
+    }
+
+
+def run(benchmarks, number, repeat, out=sys.stderr):
+    results = []
+    for bench in benchmarks:
+        for engine_name in engines_for(bench):
+            with engine(engine_name or 'native'):
+                with bench.factory() as (stmt, namespace):
+                    result = measure(stmt, namespace, bench.number or number,
+                                     repeat, bench.memory)
+            result.update(group=bench.group, name=bench.name,
+                          engine=engine_name)
+            results.append(result)
+            out.write('{0:<45} {1:>8} {2:>12.1f} ns {3!s:>10} B {4!s:>6} B/call\n'.format(
+                bench.key, engine_name or '-', result['ns_per_call'],
+                result['peak_bytes'], result['bytes_per_call']))
+    return results
+
+
+def report(results):
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'forbiddenfruit': forbiddenfruit.__version__,
+        'speedups': engine.speedups is not None,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the overhead of cursed attributes')
+    parser.add_argument('-n', '--number', type=int, default=100000,
+                        help='calls per timing run')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='timing runs, the best one is reported')
+    parser.add_argument('-k', '--filter', default='',
+                        help='only run benchmarks containing this string')
+    parser.add_argument('-o', '--output', default='-',
+                        help='where to write the JSON report')
+    args = parser.parse_args(argv)
+
+    selected = [b for b in registry if args.filter in b.key]
+    results = run(selected, args.number, args.repeat)
+    document = json.dumps(report(results), indent=2, sort_keys=True)
+    if args.output == '-':
+        sys.stdout.write(document + '\n')
+    else:
+        with open(args.output, 'w') as output:
+            output.write(document + '\n')
@@ -41,58 +41,94 @@
 # SOFTWARE.
 
 import gc
+import os
 import sys
-from types import FunctionType
+from types import FunctionType, MethodType
 import ctypes
-import inspect
-from functools import wraps
-from collections import defaultdict
+from functools import wraps, update_wrapper
+from collections import namedtuple, OrderedDict
 from contextlib import contextmanager
 
+try:
+    from _thread import RLock, _local
+except ImportError:
+    # Python 2 has no RLock in `thread`, python 3 skips importing
+    # `threading` at import time
+    from threading import RLock, local as _local
+
 try:
     import __builtin__
 except ImportError:
     # Python 3 support
     import builtins as __builtin__
 
-__version__ = '0.1.4'
-
-__all__ = 'curse', 'curses', 'reverse'
-
-
-Py_ssize_t = ctypes.c_int64 if ctypes.sizeof(ctypes.c_void_p) == 8 else ctypes.c_int32
-
-
-# dictionary holding references to the allocated function resolution
-# arrays to type objects
-tp_as_dict = {}
-# container to cfunc callbacks
-tp_func_dict = {}
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python < 3.7, no scoped curses
+    ContextVar = None
 
+try:
+    from contextlib import ContextDecorator
+except ImportError:
+    # Python 2, scoped curses aren't supported there anyway
+    ContextDecorator = object
 
-class PyObject(ctypes.Structure):
-    def incref(self):
-        self.ob_refcnt += 1
+from forbiddenfruit import _layout
+from forbiddenfruit._layout import (  # noqa: F401 re-exported
+    Py_ssize_t, PyObject_p, Inquiry_p, UnaryFunc_p, BinaryFunc_p,
+    TernaryFunc_p, LenFunc_p, SSizeArgFunc_p, SSizeObjArgProc_p,
+    ObjObjProc_p, ObjObjArgProc_p, IterNextFunc_p, FILE_p, PyFile, PyObject, PyNumberMethods,
+    PySequenceMethods, PyMappingMethods, PyTypeObject, PyAsyncMethods,
+    PyBufferProcs, Py_buffer)
 
-    def decref(self):
-        self.ob_refcnt -= 1
+try:
+    from forbiddenfruit import _speedups
+except ImportError:
+    # The compiled trampolines are optional, cursed dunders fall back
+    # to ctypes callbacks when they're not available
+    _speedups = None
 
-class PyFile(ctypes.Structure):
-    pass
+# addresses of the native trampolines, they live as long as the process
+_native_trampolines = frozenset(
+    _speedups.trampolines.values() if _speedups is not None else ())
 
-PyObject_p = ctypes.py_object
-Inquiry_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p)
-# return type is void* to allow ctypes to convert python integers to
-# plain PyObject*
-UnaryFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p)
-BinaryFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, PyObject_p)
-TernaryFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, PyObject_p, PyObject_p)
-LenFunc_p = ctypes.CFUNCTYPE(Py_ssize_t, PyObject_p)
-SSizeArgFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, Py_ssize_t)
-SSizeObjArgProc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, Py_ssize_t, PyObject_p)
-ObjObjProc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, PyObject_p)
+__version__ = '0.1.4'
 
-FILE_p = ctypes.POINTER(PyFile)
+__all__ = ('curse', 'curses', 'reverse', 'curse_many', 'batch', 'call_stats',
+           'reset_call_stats', 'curse_on_import', 'snapshot', 'restore',
+           'active_curses')
+
+
+# serializes everything changing type objects and the state below, so
+# each curse and reverse looks atomic to other threads. Calling cursed
+# attributes never takes it.
+_lock = RLock()
+# original function pointers of cursed slots, keyed by (klass, slot)
+tp_orig_dict = {}
+# dunders cursed into each (klass, slot), the comparisons share theirs
+_slot_users = {}
+# dispatchers of scoped curses installed once per (klass, attr)
+_dispatchers = {}
+# {(klass, attr): value} of the scoped curses active in the current
+# context, each thread and asyncio task gets its own
+_scoped_curses = ContextVar('forbiddenfruit_scoped_curses', default=None) \
+    if ContextVar is not None else None
+# memoized values of curses made with `memoize=`, by (klass, attr)
+_memoized = {}
+# call statistics of curses made with `instrument=True`, by (klass, attr)
+_instrumented = {}
+# {(klass, attr): (value, options)} of the curses in place, in the order
+# they were made, with the value and the `curse()` options as given
+_active = OrderedDict()
+# (klass, attr) of the curses of plain attributes, their originals are
+# kept as `_c_<attr>`
+_cursed_attrs = set()
+# {(klass, attr): (value, vectorcall, propagate)} of the cursed dunders
+_dunder_curses = {}
+# type dicts touched while a `batch()` is open, they get their method
+# caches invalidated once when the batch is done
+_batch_types = None
 
 
 def get_not_implemented():
@@ -112,124 +148,6 @@ def get_not_implemented():
 # address of the _Py_NotImplementedStruct singleton
 NotImplementedRet = get_not_implemented()
 
-class PyNumberMethods(ctypes.Structure):
-    _fields_ = [
-    ('nb_add', BinaryFunc_p),
-    ('nb_subtract', BinaryFunc_p),
-    ('nb_multiply', BinaryFunc_p),
-    ('nb_remainder', BinaryFunc_p),
-    ('nb_divmod', BinaryFunc_p),
-    ('nb_power', BinaryFunc_p),
-    ('nb_negative', UnaryFunc_p),
-    ('nb_positive', UnaryFunc_p),
-    ('nb_absolute', UnaryFunc_p),
-    ('nb_bool', Inquiry_p),
-    ('nb_invert', UnaryFunc_p),
-    ('nb_lshift', BinaryFunc_p),
-    ('nb_rshift', BinaryFunc_p),
-    ('nb_and', BinaryFunc_p),
-    ('nb_xor', BinaryFunc_p),
-    ('nb_or', BinaryFunc_p),
-    ('nb_int', UnaryFunc_p),
-    ('nb_reserved', ctypes.c_void_p),
-    ('nb_float', UnaryFunc_p),
-
-    ('nb_inplace_add', BinaryFunc_p),
-    ('nb_inplace_subtract', BinaryFunc_p),
-    ('nb_inplace_multiply', BinaryFunc_p),
-    ('nb_inplace_remainder', BinaryFunc_p),
-    ('nb_inplace_power', TernaryFunc_p),
-    ('nb_inplace_lshift', BinaryFunc_p),
-    ('nb_inplace_rshift', BinaryFunc_p),
-    ('nb_inplace_and', BinaryFunc_p),
-    ('nb_inplace_xor', BinaryFunc_p),
-    ('nb_inplace_or', BinaryFunc_p),
-
-    ('nb_floor_divide', BinaryFunc_p),
-    ('nb_true_divide', BinaryFunc_p),
-    ('nb_inplace_floor_divide', BinaryFunc_p),
-    ('nb_inplace_true_divide', BinaryFunc_p),
-
-    ('nb_index', BinaryFunc_p),
-
-    ('nb_matrix_multiply', BinaryFunc_p),
-    ('nb_inplace_matrix_multiply', BinaryFunc_p),
-    ]
-
-class PySequenceMethods(ctypes.Structure):
-    _fields_ = [
-        ('sq_length', LenFunc_p),
-        ('sq_concat', BinaryFunc_p),
-        ('sq_repeat', SSizeArgFunc_p),
-        ('sq_item', SSizeArgFunc_p),
-        ('was_sq_slice', ctypes.c_void_p),
-        ('sq_ass_item', SSizeObjArgProc_p),
-        ('was_sq_ass_slice', ctypes.c_void_p),
-        ('sq_contains', ObjObjProc_p),
-        ('sq_inplace_concat', BinaryFunc_p),
-        ('sq_inplace_repeat', SSizeArgFunc_p),
-    ]
-
-class PyMappingMethods(ctypes.Structure):
-    pass
-
-class PyTypeObject(ctypes.Structure):
-    pass
-
-class PyAsyncMethods(ctypes.Structure):
-    pass
-
-
-PyObject._fields_ = [
-    ('ob_refcnt', Py_ssize_t),
-    ('ob_type', ctypes.POINTER(PyTypeObject)),
-]
-
-PyTypeObject._fields_ = [
-    # varhead
-    ('ob_base', PyObject),
-    ('ob_size', Py_ssize_t),
-    # declaration
-    ('tp_name', ctypes.c_char_p),
-    ('tp_basicsize', Py_ssize_t),
-    ('tp_itemsize', Py_ssize_t),
-    ('tp_dealloc', ctypes.CFUNCTYPE(None, PyObject_p)),
-    ('printfunc', ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, FILE_p, ctypes.c_int)),
-    ('getattrfunc', ctypes.CFUNCTYPE(PyObject_p, PyObject_p, ctypes.c_char_p)),
-    ('setattrfunc', ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, ctypes.c_char_p, PyObject_p)),
-    ('tp_as_async', ctypes.CFUNCTYPE(PyAsyncMethods)),
-    ('tp_repr', ctypes.CFUNCTYPE(PyObject_p, PyObject_p)),
-    ('tp_as_number', ctypes.POINTER(PyNumberMethods)),
-    ('tp_as_sequence', ctypes.POINTER(PySequenceMethods)),
-    ('tp_as_mapping', ctypes.POINTER(PyMappingMethods)),
-    ('tp_hash', ctypes.CFUNCTYPE(ctypes.c_int64, PyObject_p)),
-    ('tp_call', ctypes.CFUNCTYPE(PyObject_p, PyObject_p, PyObject_p, PyObject_p)),
-    ('tp_str', ctypes.CFUNCTYPE(PyObject_p, PyObject_p)),
-    ('tp_getattro', ctypes.c_void_p),  # Type not declared yet
-    ('tp_setattro', ctypes.c_void_p),  # Type not declared yet
-    ('tp_as_buffer', ctypes.c_void_p),  # Type not declared yet
-    ('tp_flags', ctypes.c_void_p),  # Type not declared yet
-    ('tp_doc', ctypes.c_void_p),  # Type not declared yet
-    ('tp_traverse', ctypes.c_void_p),  # Type not declared yet
-    ('tp_clear', ctypes.c_void_p),  # Type not declared yet
-    ('tp_richcompare', ctypes.c_void_p),  # Type not declared yet
-    ('tp_weaklistoffset', ctypes.c_void_p),  # Type not declared yet
-    ('tp_iter', ctypes.c_void_p),  # Type not declared yet
-    ('iternextfunc', ctypes.c_void_p),  # Type not declared yet
-    ('tp_methods', ctypes.c_void_p),  # Type not declared yet
-    ('tp_members', ctypes.c_void_p),  # Type not declared yet
-    ('tp_getset', ctypes.c_void_p),  # Type not declared yet
-    ('tp_base', ctypes.c_void_p),  # Type not declared yet
-    ('tp_dict', ctypes.c_void_p),  # Type not declared yet
-    ('tp_descr_get', ctypes.c_void_p),  # Type not declared yet
-    ('tp_descr_set', ctypes.c_void_p),  # Type not declared yet
-    ('tp_dictoffset', ctypes.c_void_p),  # Type not declared yet
-    ('tp_init', ctypes.c_void_p),  # Type not declared yet
-    ('tp_alloc', ctypes.c_void_p),  # Type not declared yet
-    ('tp_new', ctypes.CFUNCTYPE(PyObject_p, PyObject_p, PyObject_p, ctypes.c_void_p)),
-    # More struct fields follow but aren't declared here yet ...
-]
-
 
 # redundant dict of pointee types, because ctypes doesn't allow us
 # to extract the pointee type from the pointer
@@ -238,6 +156,7 @@ PyTypeObject_as_types_dict = {
     'tp_as_number': PyNumberMethods,
     'tp_as_sequence': PySequenceMethods,
     'tp_as_mapping': PyMappingMethods,
+    'tp_as_buffer': PyBufferProcs,
 }
 
 
@@ -247,20 +166,117 @@ def patchable_builtin(klass):
     return refs[0]
 
 
+def _synchronized(func):
+    """Run `func` holding the lock shared by all curses"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _type_dict(klass):
+    """Same as `patchable_builtin()` but resolved once per batch"""
+    if _batch_types is None:
+        return patchable_builtin(klass)
+    if klass not in _batch_types:
+        _batch_types[klass] = patchable_builtin(klass)
+    return _batch_types[klass]
+
+
+def _type_modified(klass):
+    """Invalidate the method cache of `klass` or defer it to the batch"""
+    if _batch_types is None:
+        ctypes.pythonapi.PyType_Modified(ctypes.py_object(klass))
+    elif klass not in _batch_types:
+        _batch_types[klass] = patchable_builtin(klass)
+
+
+# types whose dicts can only change through forbiddenfruit
+Py_TPFLAGS_HEAPTYPE = 1 << 9
+Py_TPFLAGS_IMMUTABLETYPE = 1 << 8
+
+
+def _mutable_type(klass):
+    """Tell if the dict of `klass` can change without us knowing"""
+    flags = klass.__flags__
+    return bool(flags & Py_TPFLAGS_HEAPTYPE) and \
+        not flags & Py_TPFLAGS_IMMUTABLETYPE
+
+
+def _dir_cacheable(klass, owner, default_dir):
+    """Tell if the listing of `klass` or its instances can be cached
+
+    `owner` is the type providing `__dir__`, it has to be the default
+    one. `klass` can't be a type that's changed without us knowing.
+    """
+    if _mutable_type(klass):
+        return False
+    return owner.__dir__ is default_dir
+
+
+def _hidden_names(klass):
+    """Names hidden from `dir()` in `klass` and its bases"""
+    hidden = set()
+    for base in klass.__mro__:
+        hidden.update(__hidden_elements__.get(base, ()))
+    return hidden
+
+
 @wraps(__builtin__.dir)
 def __filtered_dir__(obj=None):
-    name = hasattr(obj, '__name__') and obj.__name__ or obj.__class__.__name__
     if obj is None:
         # Return names from the local scope of the calling frame,
         # taking into account indirection added by __filtered_dir__
-        calling_frame = inspect.currentframe().f_back
-        return sorted(calling_frame.f_locals.keys())
-    return sorted(set(__dir__(obj)).difference(__hidden_elements__[name]))
+        return sorted(sys._getframe(1).f_locals.keys())
+
+    # builtin types and their instances only change when cursed, so
+    # their listings are cached until the next curse or reverse
+    if isinstance(obj, type):
+        klass, cache = obj, _dir_cache_types
+        cacheable = _dir_cacheable(klass, type(obj), type.__dir__)
+    else:
+        klass, cache = type(obj), _dir_cache_instances
+        cacheable = _dir_cacheable(klass, klass, object.__dir__) and \
+            not hasattr(obj, '__dict__')
+
+    names = cache.get(klass) if cacheable else None
+    if names is None:
+        names = sorted(set(__dir__(obj)).difference(_hidden_names(klass)))
+        if cacheable:
+            cache[klass] = names
+    return list(names)
+
+# names hidden from `dir()` by `curse(..., hide_from_dir=True)`, by
+# type, and the filtered `dir()` of types and of their instances. They
+# only exist once something got hidden.
+__hidden_elements__ = None
+_dir_cache_types = None
+_dir_cache_instances = None
 
-# Switching to the custom dir impl declared above
-__hidden_elements__ = defaultdict(list)
 __dir__ = dir
-__builtin__.dir = __filtered_dir__
+
+
+def _install_dir_hook():
+    """Switch to the custom dir impl declared above
+
+    Processes that never hide anything keep the builtin `dir()`.
+    """
+    global __hidden_elements__, _dir_cache_types, _dir_cache_instances
+    if __hidden_elements__ is not None:
+        return
+    import weakref
+    _dir_cache_types = weakref.WeakKeyDictionary()
+    _dir_cache_instances = weakref.WeakKeyDictionary()
+    __hidden_elements__ = weakref.WeakKeyDictionary()
+    __builtin__.dir = __filtered_dir__
+
+
+def _dir_changed():
+    """Drop cached listings, subclasses see what's cursed on their bases"""
+    if __hidden_elements__ is not None:
+        _dir_cache_types.clear()
+        _dir_cache_instances.clear()
 
 # build override information for dunder methods
 as_number = ('tp_as_number', [
@@ -312,37 +328,106 @@ as_sequence = ("tp_as_sequence", [
     ("irepeat", "sq_inplace_repeat"),
 ])
 
+as_mapping = ("tp_as_mapping", [
+    ("len", "mp_length"),
+    ("getitem", "mp_subscript"),
+    ("setitem", "mp_ass_subscript"),
+])
+
 as_async = ("tp_as_async", [
     ("await", "am_await"),
     ("aiter", "am_aiter"),
     ("anext", "am_anext"),
 ])
 
-override_dict = {}
-for override in [as_number, as_sequence, as_async]:
-    tp_as_name = override[0]
-    for dunder, impl_method in override[1]:
-        override_dict["__{}__".format(dunder)] = (tp_as_name, impl_method)
+# the comparison operators, in the order of their `tp_richcompare` op
+# codes, from Py_LT to Py_GE
+compare_ops = ("lt", "le", "eq", "ne", "gt", "ge")
 
-# divmod isn't a dunder, still make it overridable
-override_dict['divmod()'] = ('tp_as_number', "nb_divmod")
-override_dict['__str__'] = ('tp_str', "tp_str")
-override_dict['__new__'] = ('tp_new', "tp_new")
-override_dict['__hash__'] = ('tp_hash', "tp_hash")
+# where cursing the `attr` dunder goes: the `slot` field, of type
+# `cfunc_t` taking `arity` arguments, found `offset` bytes into the
+# `struct_type` structure pointed by the `tp_as_name` field of the type
+# object, or into the type object itself when `tp_as_name == slot`
+SlotDescriptor = namedtuple(
+    'SlotDescriptor', 'attr tp_as_name slot struct_type offset cfunc_t arity')
 
+_slot_table = None
+
+
+def slot_table():
+    """Describe the slots dunder methods get cursed into, by method name
+
+    Each name maps to a tuple of `SlotDescriptor`, a curse fills all of
+    them. The table is built on the first dunder curse.
+    """
+    global _slot_table
+    if _slot_table is not None:
+        return _slot_table
+
+    # refuse to write anything into type objects laid out differently
+    _layout.check()
+
+    # the interpreter goes through the mapping or the sequence slots
+    # depending on the operation, dunders found in both fill both
+    override_dict = {}
+    for override in [as_number, as_mapping, as_sequence, as_async]:
+        tp_as_name = override[0]
+        for dunder, impl_method in override[1]:
+            override_dict.setdefault("__{}__".format(dunder), []).append(
+                (tp_as_name, impl_method))
+
+    # divmod isn't a dunder, still make it overridable
+    override_dict['divmod()'] = [('tp_as_number', "nb_divmod")]
+    override_dict['__str__'] = [('tp_str', "tp_str")]
+    override_dict['__hash__'] = [('tp_hash', "tp_hash")]
+    override_dict['__call__'] = [('tp_call', "tp_call")]
+    override_dict['__iter__'] = [('tp_iter', "tp_iter")]
+    override_dict['__next__'] = [('tp_iternext', "tp_iternext")]
+    # all the comparisons share one slot, that dispatches on the op code
+    for op in compare_ops:
+        override_dict["__{}__".format(op)] = [
+            ('tp_richcompare', "tp_richcompare")]
+    # calling a type with a `tp_vectorcall` skips `tp_new`, so cursing
+    # `__new__` has to take both over
+    override_dict['__new__'] = [('tp_new', "tp_new"),
+                                ('tp_vectorcall', "tp_vectorcall")]
+    # the views are released by the objects `__buffer__` returns
+    override_dict['__buffer__'] = [('tp_as_buffer', "bf_getbuffer")]
+
+    table = {}
+    for attr, slots in override_dict.items():
+        descriptors = []
+        for tp_as_name, impl_method in slots:
+            struct_type = PyTypeObject_as_types_dict.get(tp_as_name, PyTypeObject)
+            fields = dict(getattr(struct_type, '_fields_', ()))
+            if impl_method not in fields:
+                # not laid out for this version of python
+                continue
+            cfunc_t = fields[impl_method]
+            descriptors.append(SlotDescriptor(
+                attr, tp_as_name, impl_method, struct_type,
+                getattr(struct_type, impl_method).offset, cfunc_t,
+                len(getattr(cfunc_t, '_argtypes_', ()))))
+        if descriptors:
+            table[attr] = tuple(descriptors)
+    _slot_table = table
+    return table
+
+
+def __getattr__(name):
+    # `override_dict` used to be built at import time
+    if name == 'override_dict':
+        return dict((attr, (slots[0].tp_as_name, slots[0].slot))
+                    for attr, slots in slot_table().items())
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name))
 
 
 def _is_dunder(func_name):
     return func_name.startswith("__") and func_name.endswith("__")
 
 
-def _curse_special(klass, attr, func):
-    """
-    Curse one of the "dunder" methods, i.e. methods beginning with __ which have a
-    precial resolution code path
-    """
-    assert callable(func)
-
+def _ctypes_wrapper(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         """
@@ -353,74 +438,811 @@ def _curse_special(klass, attr, func):
             return func(*args, **kwargs)
         except NotImplementedError:
             return NotImplementedRet
+    return wrapper
 
-    tp_as_name, impl_method = override_dict[attr]
+# code object shared by all the wrappers called from ctypes callbacks
+_ctypes_wrapper_code = _ctypes_wrapper(len).__code__
 
-    # get the pointer to the correct tp_as_* structure
-    # or create it if it doesn't exist
-    tyobj = PyTypeObject.from_address(id(klass))
-    if tp_as_name in PyTypeObject_as_types_dict:
-        struct_ty = PyTypeObject_as_types_dict[tp_as_name]
-        tp_as_ptr = getattr(tyobj, tp_as_name)
-        if not tp_as_ptr:
-            # allocate new array
-            tp_as_obj = struct_ty()
-            tp_as_dict[(klass, attr)] = tp_as_obj
-            tp_as_new_ptr = ctypes.cast(ctypes.addressof(tp_as_obj),
-                ctypes.POINTER(struct_ty))
-
-            setattr(tyobj, tp_as_name, tp_as_new_ptr)
-        tp_as = tp_as_ptr[0]
-
-        # find the C function type
-        for fname, ftype in struct_ty._fields_:
-            if fname == impl_method:
-                cfunc_t = ftype
-
-        cfunc = cfunc_t(wrapper)
-        tp_func_dict[(klass, attr)] = cfunc
-
-        setattr(tp_as, impl_method, cfunc)
-    else:
-        # find the C function type
-        for fname, ftype in PyTypeObject._fields_:
-            if fname == impl_method:
-                cfunc_t = ftype
 
-        if not (klass, attr) in tp_as_dict:
-            tp_as_dict[(klass, attr)] = ctypes.cast(getattr(tyobj, impl_method), cfunc_t)
+def _ctypes_callbacks_running():
+    """Tell if any thread is in the middle of a ctypes callback"""
+    for frame in sys._current_frames().values():
+        while frame is not None:
+            if frame.f_code is _ctypes_wrapper_code:
+                return True
+            frame = frame.f_back
+    return False
+
+
+def _keywords(func):
+    """Call `func(obj, args, kwargs)` from a classic `(obj, args, kwargs)` slot
+
+    `tp_new` and `tp_call` get the address of the keywords dict, or NULL
+    without keywords. `func` gets the dict or None, like it does from
+    the native trampolines.
+    """
+    @wraps(func)
+    def keywords(obj, args, kwargs):
+        if kwargs:
+            kwargs = ctypes.cast(kwargs, ctypes.py_object).value
+        return func(obj, args, kwargs)
+    return keywords
+
+
+def _spread_args(func):
+    """Call `func(obj, *args, **kwargs)` from an `(obj, args, kwargs)` slot"""
+    @wraps(func)
+    def spread(obj, args, kwargs):
+        if not kwargs:
+            return func(obj, *args)
+        # `tp_new` and `tp_call` get the address of the keywords dict
+        return func(obj, *args, **ctypes.cast(kwargs, ctypes.py_object).value)
+    return spread
+
+
+def _trampoline(impl_method, vectorcall, attr=None):
+    """Name of the trampoline filling `impl_method`, None for NULL
+
+    Curses made with `vectorcall=True` take their arguments spread, the
+    type's own `tp_vectorcall` is only used by them. Each comparison
+    `attr` has a trampoline of its own in `tp_richcompare`.
+    """
+    if impl_method == 'tp_richcompare':
+        return '{0}_{1}'.format(impl_method, attr.strip('_'))
+    if impl_method == 'tp_vectorcall':
+        return impl_method if vectorcall else None
+    if vectorcall:
+        return impl_method + '_vectorcall'
+    return impl_method
+
+
+def _setter(func, cfunc_t, original):
+    """Call `func(obj, key, value)` from an assignment slot
+
+    Those slots get a NULL value to delete items, that's left to the
+    `original` C function of the slot.
+    """
+    if original:
+        # keeps the GIL, unlike `cfunc_t`
+        original = ctypes.PYFUNCTYPE(
+            cfunc_t._restype_, *cfunc_t._argtypes_)(original)
+
+    @wraps(func)
+    def setter(obj, key, value):
+        if value is None:
+            if not original:
+                raise TypeError(
+                    "'{0}' object doesn't support item deletion".format(
+                        type(obj).__name__))
+            return original(obj, key, None)
+        func(obj, key, ctypes.cast(value, ctypes.py_object).value)
+        return 0
+    return setter
+
+
+def _iternext(func):
+    """Return the next item of `func` by address, NULL once it's exhausted
+
+    Ending the iteration that way spares the interpreter from handling a
+    `StopIteration` exception.
+    """
+    @wraps(func)
+    def iternext(obj):
+        try:
+            item = func(obj)
+        except StopIteration:
+            return None
+        # the slot returns a new reference
+        ctypes.pythonapi.Py_IncRef(ctypes.py_object(item))
+        return id(item)
+    return iternext
+
+
+def _getbuffer(func):
+    """Export the buffer of the object `func(obj, flags)` returns
+
+    The view belongs to that exporter, nothing is copied and releasing
+    it doesn't come back here. A ctypes callback can't set exceptions,
+    errors surface as `SystemError`.
+    """
+    @wraps(func)
+    def getbuffer(obj, view, flags):
+        view[0].obj = None
+        try:
+            exporter = func(obj, flags)
+            ctypes.pythonapi.PyObject_GetBuffer(
+                ctypes.py_object(exporter), view, flags)
+        except Exception:
+            return -1
+        return 0
+    return getbuffer
+
+
+def _modulus(func):
+    """Leave the modulus out of `func`'s arguments unless one is given
+
+    `pow()` fills it with None, like the native trampolines and the
+    interpreter's own slots do, `func(a, b)` gets called then.
+    """
+    @wraps(func)
+    def power(a, b, modulus):
+        if modulus is None:
+            return func(a, b)
+        return func(a, b, modulus)
+    return power
+
+
+# the power slots, they take an optional modulus
+_ternary_slots = frozenset(['nb_power', 'nb_inplace_power'])
+
+# slots assigning items, they also delete them
+_setter_slots = frozenset(['mp_ass_subscript', 'sq_ass_item'])
+
+# cursed comparisons by class and op code, only for the ctypes callbacks
+_compare_funcs = {}
+
+
+def _comparer(klass, trampoline, cfunc_t, func, original):
+    """Call the comparison cursed into `klass` for the op code of the call
+
+    `func` joins the ones already cursed, the others go to the `original`
+    C function of the slot.
+    """
+    funcs = _compare_funcs.setdefault(klass, {})
+    funcs[compare_ops.index(trampoline.rsplit('_', 1)[1])] = func
+    if original:
+        # keeps the GIL, unlike `cfunc_t`
+        original = ctypes.PYFUNCTYPE(
+            cfunc_t._restype_, *cfunc_t._argtypes_)(original)
+
+    def compare(obj, other, op):
+        func = funcs.get(op)
+        if func is not None:
+            return func(obj, other)
+        if original:
+            return original(obj, other, op)
+        return NotImplemented
+    return compare
+
+
+def _slot_func(klass, trampoline, cfunc_t, func, original=None):
+    """Build the C function pointer installed by the `trampoline` slot
+
+    The native trampoline from `_speedups` is used when it's available
+    for that slot, otherwise `func` gets wrapped in a ctypes callback.
+    None means the slot is left empty. `original` is the address of the
+    C function the slot had before the first curse.
+    """
+    if _speedups is not None and trampoline in _speedups.trampolines:
+        if original:
+            address = _speedups.register(trampoline, klass, func, original)
+        else:
+            address = _speedups.register(trampoline, klass, func)
+        return cfunc_t(address)
+    if trampoline == 'tp_vectorcall':
+        # calls go through `tp_new` instead
+        return None
+    if trampoline.endswith('_vectorcall'):
+        func = _spread_args(func)
+    elif trampoline in ('tp_new', 'tp_call'):
+        func = _keywords(func)
+    elif trampoline in _ternary_slots:
+        func = _modulus(func)
+    elif trampoline in _setter_slots:
+        func = _setter(func, cfunc_t, original)
+    elif trampoline == 'tp_iternext':
+        func = _iternext(func)
+    elif trampoline.startswith('tp_richcompare_'):
+        func = _comparer(klass, trampoline, cfunc_t, func, original)
+    elif trampoline == 'bf_getbuffer':
+        func = _getbuffer(func)
+    return cfunc_t(_ctypes_wrapper(func))
+
+
+def _unregister(klass, impl_method, keep=None):
+    """Drop the native trampolines registered for `impl_method` of `klass`"""
+    if _speedups is None:
+        return
+    for name in (impl_method, impl_method + '_vectorcall'):
+        if name != keep and name in _speedups.trampolines:
+            _speedups.unregister(name, klass)
+
+
+def _forget_comparison(klass, attr):
+    """Drop the comparison `attr` cursed into `klass`, leaving the slot"""
+    trampoline = _trampoline('tp_richcompare', False, attr)
+    if _speedups is not None and trampoline in _speedups.trampolines:
+        _speedups.unregister(trampoline, klass)
+    funcs = _compare_funcs.get(klass)
+    if funcs is not None:
+        funcs.pop(compare_ops.index(attr.strip('_')), None)
+        if not funcs:
+            del _compare_funcs[klass]
+
+
+def _slot_pointer(struct, impl_method):
+    """The `impl_method` field of `struct` as a writable `void *`"""
+    return _field_pointer(struct, getattr(type(struct), impl_method).offset)
+
+
+def _field_pointer(struct, offset):
+    return ctypes.c_void_p.from_address(ctypes.addressof(struct) + offset)
+
+
+def _type_tree(klass):
+    """Yield `klass` and all its subclasses, once each"""
+    seen = set()
+    pending = [klass]
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        yield current
+        pending.extend(type.__subclasses__(current))
+
+
+class SlotRegistry(object):
+    """Keep track of the memory handed over to type objects
+
+    Cursing a dunder installs a C function pointer into a slot of the
+    type object and might allocate the `tp_as_*` structure holding that
+    slot. Both must stay alive for as long as a type object points at
+    them. When they get replaced or reversed they are retired, and
+    `reclaim()` frees them once neither the cursed class nor any of its
+    subclasses point at them and no ctypes callback is running.
+
+    Things are only freed by a `reclaim()` call happening after the one
+    following their retirement. That leaves a grace period for threads
+    still returning from a callback that was just replaced.
+    """
+
+    def __init__(self):
+        # installed C function pointers, by (klass, slot)
+        self.funcs = {}
+        # allocated tp_as_* structures, by (klass, tp_as_name)
+        self.structs = {}
+        # how many cursed slots live within each allocated structure
+        self.users = {}
+        # (generation, klass, tp_as_name, slot, obj) waiting to be freed,
+        # `slot` is None for structures
+        self.retired = []
+        self.generation = 0
+
+    def struct(self, klass, tp_as_name):
+        """Get the `tp_as_name` structure of `klass`
+
+        A new structure is allocated when the type doesn't have one, but
+        it's only attached to the type by `attach()`, once the cursed
+        slot is filled in, so other threads never see it half done.
+        """
+        tp_as_ptr = getattr(PyTypeObject.from_address(id(klass)), tp_as_name)
+        if tp_as_ptr:
+            return tp_as_ptr[0]
+        # allocate new array
+        tp_as_obj = PyTypeObject_as_types_dict[tp_as_name]()
+        self.structs[(klass, tp_as_name)] = tp_as_obj
+        return tp_as_obj
+
+    def attach(self, klass, tp_as_name):
+        """Point `klass` to the structure allocated by `struct()`"""
+        tp_as_obj = self.structs.get((klass, tp_as_name))
+        if tp_as_obj is None:
+            return
+        pointer = _slot_pointer(PyTypeObject.from_address(id(klass)), tp_as_name)
+        if not pointer.value:
+            pointer.value = ctypes.addressof(tp_as_obj)
+
+    def acquire(self, klass, tp_as_name):
+        """A slot within the `tp_as_name` structure of `klass` got cursed"""
+        key = (klass, tp_as_name)
+        if key in self.structs:
+            self.users[key] = self.users.get(key, 0) + 1
+
+    def release(self, klass, tp_as_name):
+        """A slot within the `tp_as_name` structure of `klass` got reversed
+
+        The structure is detached from the type and retired when it was
+        allocated by us and none of its slots are cursed anymore.
+        """
+        key = (klass, tp_as_name)
+        if key not in self.users:
+            return
+        self.users[key] -= 1
+        if self.users[key]:
+            return
+        del self.users[key]
+        struct = self.structs.pop(key)
+        pointer = _slot_pointer(PyTypeObject.from_address(id(klass)), tp_as_name)
+        if pointer.value == ctypes.addressof(struct):
+            pointer.value = None
+        self.retired.append(
+            (self.generation, klass, tp_as_name, None, struct))
+
+    def install(self, klass, impl_method, tp_as_name, cfunc):
+        """Hold `cfunc` while it's in the `impl_method` slot of `klass`"""
+        old = self.funcs.get((klass, impl_method))
+        self.funcs[(klass, impl_method)] = cfunc
+        self.retire(klass, tp_as_name, impl_method, old)
+
+    def uninstall(self, klass, impl_method, tp_as_name):
+        cfunc = self.funcs.pop((klass, impl_method), None)
+        self.retire(klass, tp_as_name, impl_method, cfunc)
+
+    def retire(self, klass, tp_as_name, impl_method, cfunc):
+        # native trampolines are never freed, there's nothing to wait for
+        if cfunc is None or \
+           ctypes.cast(cfunc, ctypes.c_void_p).value in _native_trampolines:
+            return
+        self.retired.append(
+            (self.generation, klass, tp_as_name, impl_method, cfunc))
+
+    def referenced(self, klass, tp_as_name, impl_method, obj):
+        """Tell if any type in the tree of `klass` still points at `obj`"""
+        if impl_method is None:
+            address = ctypes.addressof(obj)
+        else:
+            address = ctypes.cast(obj, ctypes.c_void_p).value
+
+        for subclass in _type_tree(klass):
+            tyobj = PyTypeObject.from_address(id(subclass))
+            if impl_method is None or impl_method == tp_as_name:
+                struct, field = tyobj, tp_as_name
+            else:
+                tp_as_ptr = getattr(tyobj, tp_as_name)
+                if not tp_as_ptr:
+                    continue
+                struct, field = tp_as_ptr[0], impl_method
+            if _slot_pointer(struct, field).value == address:
+                return True
+        return False
+
+    @_synchronized
+    def reclaim(self):
+        """Free the retired things that are safe to be freed"""
+        generation = self.generation
+        self.generation += 1
+        running = None
+        retired = []
+        for entry in self.retired:
+            if entry[0] == generation or self.referenced(*entry[1:]):
+                retired.append(entry)
+                continue
+            # callbacks can't be freed while any of them is running
+            if entry[3] is not None:
+                if running is None:
+                    running = _ctypes_callbacks_running()
+                if running:
+                    retired.append(entry)
+        self.retired = retired
+
+    def memory_usage(self):
+        """Count what's currently held on behalf of type objects
+
+        `bytes` adds up the size of the allocated structures and of the
+        python objects wrapping the C function pointers.
+        """
+        objs = list(self.funcs.values()) + list(self.structs.values())
+        objs.extend(entry[-1] for entry in self.retired)
+        size = 0
+        for obj in objs:
+            if isinstance(obj, ctypes.Structure):
+                size += ctypes.sizeof(obj)
+            else:
+                size += sys.getsizeof(obj)
+        return {
+            'funcs': len(self.funcs),
+            'structs': len(self.structs),
+            'retired': len(self.retired),
+            'bytes': size,
+        }
+
+
+slot_registry = SlotRegistry()
+# dictionary holding references to the allocated function resolution
+# arrays to type objects
+tp_as_dict = slot_registry.structs
+# container to cfunc callbacks
+tp_func_dict = slot_registry.funcs
+
+
+def _curse_special(klass, attr, func, vectorcall=False, propagate=False):
+    """
+    Curse one of the "dunder" methods, i.e. methods beginning with __ which have a
+    precial resolution code path
+    """
+    assert callable(func)
+
+    _revert_propagated(klass, attr)
+    for descriptor in slot_table()[attr]:
+        _curse_slot(klass, descriptor, func, vectorcall)
+        if propagate:
+            _propagate_slot(klass, descriptor)
+    slot_registry.reclaim()
+
+
+def _slot_struct(klass, descriptor):
+    """The structure holding the `descriptor` slot of `klass`"""
+    if descriptor.struct_type is PyTypeObject:
+        return PyTypeObject.from_address(id(klass))
+    # get the correct tp_as_* structure or create it if it doesn't exist
+    return slot_registry.struct(klass, descriptor.tp_as_name)
+
+
+def _save_slot(klass, descriptor, struct):
+    # save the original function pointer so it can be restored by
+    # `reverse()`, unless the slot is already holding one of our own
+    key = (klass, descriptor.slot)
+    if key not in tp_orig_dict:
+        tp_orig_dict[key] = _field_pointer(struct, descriptor.offset).value
+        slot_registry.acquire(klass, descriptor.tp_as_name)
+    _slot_users.setdefault(key, set()).add(descriptor.attr)
+
+
+def _fill_slot(klass, descriptor, struct, cfunc):
+    tp_as_name, impl_method = descriptor.tp_as_name, descriptor.slot
+    if cfunc is None:
+        _field_pointer(struct, descriptor.offset).value = None
+        slot_registry.uninstall(klass, impl_method, tp_as_name)
+        return
+    setattr(struct, impl_method, cfunc)
+    slot_registry.attach(klass, tp_as_name)
+    slot_registry.install(klass, impl_method, tp_as_name, cfunc)
+
+
+def _curse_slot(klass, descriptor, func, vectorcall):
+    impl_method = descriptor.slot
+    struct = _slot_struct(klass, descriptor)
+    _save_slot(klass, descriptor, struct)
+
+    # override function call
+    trampoline = _trampoline(impl_method, vectorcall, descriptor.attr)
+    _unregister(klass, impl_method, keep=trampoline)
+    cfunc = trampoline and _slot_func(
+        klass, trampoline, descriptor.cfunc_t, func,
+        tp_orig_dict[(klass, impl_method)])
+    _fill_slot(klass, descriptor, struct, cfunc)
+
+
+# subclasses sharing the slots of curses made with `propagate=True`,
+# {(klass, attr): [(subclass, descriptor)]}
+_propagated = {}
+
+
+def _propagate_slot(klass, descriptor):
+    """Share the cursed `descriptor` slot of `klass` with its subclasses
+
+    Only the subclasses that inherited the original C function of the
+    slot get the same function pointer `klass` has. The native
+    trampolines find the callable through the MRO and the ctypes
+    callbacks don't depend on the type, so no new trampoline is made.
+    Subclasses with a function of their own are skipped, along with
+    their own subclasses.
+    """
+    impl_method = descriptor.slot
+    original = tp_orig_dict[(klass, impl_method)]
+    cfunc = slot_registry.funcs.get((klass, impl_method))
+    shared = None
+    if descriptor.struct_type is not PyTypeObject:
+        shared = ctypes.addressof(_slot_struct(klass, descriptor))
+    # the comparisons share their slot, subclasses holding it already
+    # got it from another one
+    holding = set(
+        subclass
+        for (base, _), entries in _propagated.items() if base is klass
+        for subclass, other in entries if other.slot == impl_method)
+    propagated = _propagated.setdefault((klass, descriptor.attr), [])
+
+    seen = set()
+    pending = list(type.__subclasses__(klass))
+    while pending:
+        subclass = pending.pop()
+        if subclass in seen:
+            continue
+        seen.add(subclass)
+        tyobj = PyTypeObject.from_address(id(subclass))
+        if shared is None:
+            value = _field_pointer(tyobj, descriptor.offset).value
+        else:
+            tp_as_ptr = getattr(tyobj, descriptor.tp_as_name)
+            if tp_as_ptr and ctypes.addressof(tp_as_ptr[0]) == shared:
+                # static types can point to the structure of their base,
+                # that one is cursed already
+                pending.extend(type.__subclasses__(subclass))
+                continue
+            value = None
+            if tp_as_ptr:
+                value = _field_pointer(tp_as_ptr[0], descriptor.offset).value
+        if value != original and subclass not in holding:
+            continue
+        struct = _slot_struct(subclass, descriptor)
+        _save_slot(subclass, descriptor, struct)
+        _fill_slot(subclass, descriptor, struct, cfunc)
+        propagated.append((subclass, descriptor))
+        pending.extend(type.__subclasses__(subclass))
+
+
+def _revert_propagated(klass, attr):
+    for subclass, descriptor in reversed(_propagated.pop((klass, attr), ())):
+        _revert_slot(subclass, descriptor)
 
-        # override function call
-        cfunc = cfunc_t(wrapper)
-        tp_func_dict[(klass, attr)] = cfunc
-        setattr(tyobj, impl_method, cfunc)
 
 def _revert_special(klass, attr):
-    tp_as_name, impl_method = override_dict[attr]
+    _revert_propagated(klass, attr)
+    for descriptor in slot_table()[attr]:
+        _revert_slot(klass, descriptor)
+    slot_registry.reclaim()
+
+
+def _revert_slot(klass, descriptor):
+    tp_as_name, impl_method = descriptor.tp_as_name, descriptor.slot
+    if not (klass, impl_method) in tp_orig_dict:
+        # we didn't save this pointer
+        # most likely never cursed
+        return
+    users = _slot_users[(klass, impl_method)]
+    if descriptor.attr not in users:
+        return
+    users.discard(descriptor.attr)
+    if impl_method == 'tp_richcompare':
+        _forget_comparison(klass, descriptor.attr)
+    if users:
+        # other dunders still go through the slot
+        return
+    del _slot_users[(klass, impl_method)]
+
     tyobj = PyTypeObject.from_address(id(klass))
-    tp_as_ptr = getattr(tyobj, tp_as_name)
-    if tp_as_ptr:
-        if tp_as_name in PyTypeObject_as_types_dict:
-            tp_as = tp_as_ptr[0]
-
-            struct_ty = PyTypeObject_as_types_dict[tp_as_name]
-            for fname, ftype in struct_ty._fields_:
-                if fname == impl_method:
-                    cfunc_t = ftype
-
-            setattr(tp_as, impl_method,
-                ctypes.cast(ctypes.c_void_p(None), cfunc_t))
+    if descriptor.struct_type is PyTypeObject:
+        struct = tyobj
+    else:
+        struct = getattr(tyobj, tp_as_name)[0]
+
+    # put back exactly what was there before the first curse
+    _field_pointer(struct, descriptor.offset).value = \
+        tp_orig_dict.pop((klass, impl_method))
+
+    _unregister(klass, impl_method)
+    slot_registry.uninstall(klass, impl_method, tp_as_name)
+    slot_registry.release(klass, tp_as_name)
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize maxbytes currsize bytes')
+
+
+class Memoized(object):
+    """Bounded cache of the results of a pure method
+
+    Results are keyed by the receiver, its type and the arguments of the
+    call, so the receiver must be immutable and hashable, like instances
+    of `str`, `int`, `bytes` or `tuple`. Calls with unhashable arguments
+    aren't cached.
+
+    The least recently used entries are evicted once there are more than
+    `maxsize` of them or, when `maxbytes` is set, once the results take
+    more than `maxbytes` as measured by `sys.getsizeof()`. Set `typed` to
+    cache arguments of different types separately, e.g. `1` and `1.0`.
+    """
+
+    def __init__(self, func, maxsize=128, maxbytes=None, typed=False):
+        if not callable(func):
+            raise TypeError('Only callables can be memoized')
+        update_wrapper(self, func)
+        self.func = func
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.typed = typed
+        self.cache = OrderedDict()
+        self.hits = self.misses = self.bytes = 0
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return MethodType(self, obj)
+
+    def key(self, receiver, args, kwargs):
+        key = (type(receiver), receiver) + args
+        if kwargs:
+            key += (_kwargs_mark,) + tuple(sorted(kwargs.items()))
+        if self.typed:
+            key += tuple(type(arg) for arg in args)
+        return key
+
+    def __call__(self, receiver, *args, **kwargs):
+        key = self.key(receiver, args, kwargs)
+        try:
+            result, size = self.cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable arguments
+            self.misses += 1
+            return self.func(receiver, *args, **kwargs)
         else:
-            if not (klass, attr) in tp_as_dict:
-                # we didn't save this pointer
-                # most likely never cursed
-                return
+            self.hits += 1
+            try:
+                self.cache.move_to_end(key)
+            except KeyError:
+                # evicted by another thread in the meantime
+                pass
+            return result
+
+        self.misses += 1
+        result = self.func(receiver, *args, **kwargs)
+        size = sys.getsizeof(result) if self.maxbytes is not None else 0
+        self.cache[key] = result, size
+        self.bytes += size
+        self.evict()
+        return result
+
+    def evict(self):
+        cache = self.cache
+        while cache and (
+                (self.maxsize is not None and len(cache) > self.maxsize) or
+                (self.maxbytes is not None and self.bytes > self.maxbytes)):
+            try:
+                self.bytes -= cache.popitem(last=False)[1][1]
+            except KeyError:
+                # emptied by another thread in the meantime
+                break
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, self.maxbytes,
+                         len(self.cache), self.bytes)
+
+    def cache_clear(self):
+        self.cache.clear()
+        self.hits = self.misses = self.bytes = 0
+
+# separates positional from keyword arguments in cache keys
+_kwargs_mark = object()
+
+
+def _memoize(klass, attr, value, memoize):
+    """Wrap `value` as requested by the `memoize` option of `curse()`"""
+    if getattr(klass, '__hash__', None) is None:
+        raise TypeError(
+            "Can't memoize methods of unhashable type '{0}'".format(
+                klass.__name__))
+    if isinstance(memoize, dict):
+        options = memoize
+    elif memoize is True:
+        options = {}
+    else:
+        options = {'maxsize': memoize}
+    memo = Memoized(value, **options)
+    _forget_memoized(klass, attr)
+    _memoized[(klass, attr)] = memo
+    return memo
+
+
+def _forget_memoized(klass, attr):
+    memo = _memoized.pop((klass, attr), None)
+    if memo is not None:
+        memo.cache_clear()
+
+
+CallStats = namedtuple(
+    'CallStats', 'calls errors total_ns max_ns p50_ns p90_ns p99_ns')
+
+# exceptions dunders raise to tell the interpreter something, not errors
+_signals = (StopIteration, NotImplementedError)
+if sys.version_info >= (3, 5):
+    _signals += (StopAsyncIteration,)
+
+
+class Instrument(object):
+    """Call counts and latencies of an instrumented curse
+
+    Each thread counts its own calls into a record nobody else writes to,
+    so calls never wait on each other. `stats()` adds the records up.
+    Latencies go into buckets by their number of bits, percentiles are
+    the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # threads still running a call finish it into the old records
+        self.local = _local()
+        self.records = []
+
+    def record(self):
+        """The record of the current thread, created on its first call"""
+        # calls, errors, total_ns, max_ns, buckets
+        record = [0, 0, 0, 0, [0] * 65]
+        self.local.record = record
+        self.records.append(record)
+        return record
+
+    def stats(self):
+        calls = errors = total = peak = 0
+        buckets = [0] * 65
+        for record in list(self.records):
+            calls += record[0]
+            errors += record[1]
+            total += record[2]
+            peak = max(peak, record[3])
+            for bits, count in enumerate(record[4]):
+                buckets[bits] += count
+
+        def percentile(fraction):
+            if not calls:
+                return None
+            rank, seen = fraction * calls, 0
+            for bits, count in enumerate(buckets):
+                seen += count
+                if seen >= rank:
+                    return min((1 << bits) - 1, peak)
+            return peak
+        return CallStats(calls, errors, total, peak, percentile(0.5),
+                         percentile(0.9), percentile(0.99))
+
+
+def _instrument(klass, attr, value):
+    """Wrap `value` as requested by the `instrument` option of `curse()`"""
+    if isinstance(value, (classmethod, staticmethod)):
+        return type(value)(_instrument(klass, attr, value.__func__))
+    if not callable(value):
+        raise TypeError('Only callables can be instrumented')
+    try:
+        from time import perf_counter_ns as clock
+    except ImportError:
+        # python < 3.7
+        from time import perf_counter
+
+        def clock():
+            return int(perf_counter() * 1e9)
+
+    instrument = Instrument()
+    _instrumented[(klass, attr)] = instrument
+
+    @wraps(value)
+    def instrumented(*args, **kwargs):
+        try:
+            record = instrument.local.record
+        except AttributeError:
+            record = instrument.record()
+        start = clock()
+        try:
+            return value(*args, **kwargs)
+        except _signals:
+            raise
+        except BaseException:
+            record[1] += 1
+            raise
+        finally:
+            elapsed = clock() - start
+            record[0] += 1
+            record[2] += elapsed
+            if elapsed > record[3]:
+                record[3] = elapsed
+            record[4][elapsed.bit_length()] += 1
+    instrumented.call_stats = instrument.stats
+    return instrumented
+
+
+def call_stats():
+    """Statistics of the curses made with `instrument=True`
+
+    Returns a `CallStats` by (klass, attr), with the number of calls and
+    of the exceptions they raised, the total and maximum time they took
+    and the 50th, 90th and 99th percentiles of that time, all in
+    nanoseconds.
+    """
+    return dict((key, instrument.stats())
+                for key, instrument in list(_instrumented.items()))
+
 
-            cfunc = tp_as_dict[(klass, attr)]
-            setattr(tyobj, impl_method, cfunc)
+def reset_call_stats():
+    """Start counting the calls of instrumented curses from scratch"""
+    for instrument in list(_instrumented.values()):
+        instrument.reset()
 
 
-def curse(klass, attr, value, hide_from_dir=False):
+@_synchronized
+def curse(klass, attr, value, hide_from_dir=False, memoize=None,
+          vectorcall=False, instrument=False, propagate=False):
     """Curse a built-in `klass` with `attr` set to `value`
 
     This function monkey-patches the built-in python object `attr` adding a new
@@ -442,15 +1264,72 @@ def curse(klass, attr, value, hide_from_dir=False):
       >>> curse(str, "hello", hello)
       >>> "yo".hello()
       "yoyo"
+
+    Pure methods of immutable types can have their results cached with
+    `memoize`. It takes `True` for the defaults of `Memoized`, the
+    maximum number of cached results or a dict of `Memoized` options:
+
+      >>> curse(str, "slugify", slugify, memoize={"maxbytes": 2 ** 20})
+      >>> str.slugify.cache_info()
+      CacheInfo(hits=0, misses=0, maxsize=128, maxbytes=1048576, ...)
+
+    The cache is dropped when the curse is reversed.
+
+    Cursed `__new__` and `__call__` get the argument tuple and keywords
+    dict of the call, `func(cls, args, kwargs)`. With `vectorcall` they
+    get them spread instead, and from python 3.9 on calling the cursed
+    type doesn't build the tuple nor the dict at all:
+
+      >>> def point(cls, x, y):
+      ...     return (x, y)
+      >>> curse(Point, "__new__", point, vectorcall=True)
+      >>> Point(1, 2)
+      (1, 2)
+
+    With `instrument` each call gets counted and timed, see
+    `call_stats()`. Calls answered by the `memoize` cache aren't:
+
+      >>> curse(str, "slugify", slugify, instrument=True)
+      >>> "Hello World".slugify()
+      >>> call_stats()[(str, "slugify")].calls
+      1
+
+    Subclasses have slots of their own, cursed dunders don't reach them.
+    With `propagate` they do, unless they have their own implementation
+    of the dunder. `reverse()` undoes the whole tree at once:
+
+      >>> curse(int, "__neg__", lambda self: 0, propagate=True)
+      >>> -True
+      0
+
+    Other attributes are always found through the subclasses.
     """
+    if vectorcall and attr not in ('__new__', '__call__'):
+        raise ValueError("only __new__ and __call__ can use vectorcall")
+    _touch(klass, attr)
+    # only recorded once the curse is in place
+    given = (value, dict(
+        (name, option) for name, option in (
+            ('hide_from_dir', hide_from_dir), ('memoize', memoize),
+            ('vectorcall', vectorcall), ('instrument', instrument),
+            ('propagate', propagate)) if option))
+    _instrumented.pop((klass, attr), None)
+    if instrument:
+        value = _instrument(klass, attr, value)
+    if memoize:
+        value = _memoize(klass, attr, value, memoize)
+    _dispatchers.pop((klass, attr), None)
+
     if _is_dunder(attr):
         if sys.version_info < (3, 3):
             raise NotImplementedError(
                 "Dunder overloading is only supported on Python >= 3.3")
-        _curse_special(klass, attr, value)
+        _curse_special(klass, attr, value, vectorcall, propagate)
+        _dunder_curses[(klass, attr)] = (value, vectorcall, propagate)
+        _record_active(klass, attr, given)
         return
 
-    dikt = patchable_builtin(klass)
+    dikt = _type_dict(klass)
 
     old_value = dikt.get(attr, None)
     old_name = '_c_%s' % attr   # do not use .format here, it breaks py2.{5,6}
@@ -460,7 +1339,9 @@ def curse(klass, attr, value, hide_from_dir=False):
 
     if old_value:
         hide_from_dir = False   # It was already in dir
-        dikt[old_name] = old_value
+        # cursing it again keeps the original around
+        if (klass, attr) not in _cursed_attrs:
+            dikt[old_name] = old_value
 
         try:
             dikt[attr].__name__ = old_value.__name__
@@ -471,17 +1352,29 @@ def curse(klass, attr, value, hide_from_dir=False):
         except AttributeError:
             pass
 
-    ctypes.pythonapi.PyType_Modified(ctypes.py_object(klass))
+    _cursed_attrs.add((klass, attr))
+    _type_modified(klass)
 
     if hide_from_dir:
-        __hidden_elements__[klass.__name__].append(attr)
+        _install_dir_hook()
+        __hidden_elements__.setdefault(klass, set()).add(attr)
+    _dir_changed()
+    _record_active(klass, attr, given)
+
 
+def _record_active(klass, attr, given):
+    # the latest curse goes last
+    _active.pop((klass, attr), None)
+    _active[(klass, attr)] = given
 
+
+@_synchronized
 def reverse(klass, attr):
     """Reverse a curse in a built-in object
 
-    This function removes *new* attributes. It's actually possible to remove
-    any kind of attribute from any built-in class, but just DON'T DO IT :)
+    This function removes *new* attributes and puts back the ones a curse
+    replaced. It's actually possible to remove any kind of attribute from
+    any built-in class, but just DON'T DO IT :)
 
     Good:
 
@@ -499,17 +1392,250 @@ def reverse(klass, attr):
       AttributeError: 'str' object has no attribute 'strip'
 
     """
+    _touch(klass, attr)
+    _forget_memoized(klass, attr)
+    _active.pop((klass, attr), None)
+    _instrumented.pop((klass, attr), None)
+    _dispatchers.pop((klass, attr), None)
+
     if _is_dunder(attr):
+        _dunder_curses.pop((klass, attr), None)
         _revert_special(klass, attr)
         return
 
-    dikt = patchable_builtin(klass)
-    del dikt[attr]
+    dikt = _type_dict(klass)
+    old_name = '_c_%s' % attr
+    if (klass, attr) in _cursed_attrs and old_name in dikt:
+        # put back the attribute the curse replaced
+        dikt[attr] = dikt.pop(old_name)
+    else:
+        del dikt[attr]
+    _cursed_attrs.discard((klass, attr))
+
+    _type_modified(klass)
+
+    if __hidden_elements__ is not None:
+        __hidden_elements__.get(klass, set()).discard(attr)
+    _dir_changed()
+
+
+def curse_many(klass, attrs, hide_from_dir=False):
+    """Curse a built-in `klass` with every `attr: value` pair of `attrs`
+
+    It works just like calling `curse()` for each item, but the type's
+    method cache is only invalidated once, after all of them are set:
+
+      >>> curse_many(str, {"one": 1, "two": 2})
+      >>> "".one + "".two
+      3
+    """
+    with batch():
+        for attr, value in attrs.items():
+            curse(klass, attr, value, hide_from_dir)
+
+
+@contextmanager
+def batch():
+    """Defer the method cache invalidation of all curses within a block
+
+    Every `curse()` and `reverse()` call made inside the block write to
+    the type dicts right away, but `PyType_Modified` is only called once
+    per distinct type when the block exits. Attribute lookups inside the
+    block might still hit stale method caches:
+
+      >>> with batch():
+      ...     curse(str, "one", 1)
+      ...     curse(int, "two", 2)
+      >>> "".one + (0).two
+      3
+
+    Nested blocks are merged into the outermost one. Curses from other
+    threads wait for the block to finish.
+    """
+    global _batch_types
+    with _lock:
+        if _batch_types is not None:
+            yield
+            return
+
+        _batch_types = {}
+        try:
+            yield
+        finally:
+            types, _batch_types = _batch_types, None
+            for klass in types:
+                ctypes.pythonapi.PyType_Modified(ctypes.py_object(klass))
+
 
-    ctypes.pythonapi.PyType_Modified(ctypes.py_object(klass))
+# bookkeeping of the curses of a type saved along with its dict
+_snapshot_tables = (_active, _memoized, _instrumented, _dispatchers,
+                    _dunder_curses)
+# weak references to the snapshots of each type still around
+_snapshots = {}
 
 
-def curses(klass, name):
+def _touch(klass, attr):
+    """Tell the snapshots of `klass` that `attr` is about to change"""
+    refs = _snapshots.get(klass)
+    if refs:
+        for ref in refs:
+            saved = ref()
+            if saved is not None:
+                saved.touched.add(attr)
+
+
+class Snapshot(object):
+    """Cursed state of a type, see `snapshot()`
+
+    It can also be used as a context manager restoring the state on exit.
+    """
+
+    def __init__(self, klass):
+        import weakref
+        self.klass = klass
+        # attributes cursed or reversed since the snapshot was taken
+        self.touched = set()
+        with _lock:
+            self.entries = dict(_type_dict(klass))
+            self.cursed = frozenset(
+                attr for cls, attr in _cursed_attrs if cls is klass)
+            self.tables = [_klass_entries(table, klass)
+                           for table in _snapshot_tables]
+            self.hidden = frozenset(
+                __hidden_elements__.get(klass, ())
+                if __hidden_elements__ is not None else ())
+            refs = _snapshots.setdefault(klass, [])
+            refs.append(weakref.ref(self, refs.remove))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        restore(self)
+
+
+def _klass_entries(table, klass):
+    return dict((attr, value) for (cls, attr), value in table.items()
+                if cls is klass)
+
+
+def snapshot(klass):
+    """Save everything cursed into `klass`, to be put back by `restore()`
+
+      >>> saved = snapshot(str)
+      >>> curse(str, "shout", lambda self: self.upper() + "!")
+      >>> restore(saved)
+      >>> hasattr("", "shout")
+      False
+
+    That covers its attributes, the originals of the ones cursed, the
+    dunders cursed into its slots and what's hidden from `dir()`.
+    """
+    return Snapshot(klass)
+
+
+def restore(snapshot):
+    """Bring the type of `snapshot` back to the state it was saved in
+
+    Only the attributes cursed or reversed since are compared and put
+    back, the method cache of the type is invalidated once. Dunders
+    cursed since then are reversed, and the ones reversed or replaced
+    get cursed again. Types defined in python can change without a
+    curse, their whole dicts are compared instead.
+    """
+    klass = snapshot.klass
+    with batch():
+        touched, snapshot.touched = snapshot.touched, set()
+        for ref in _snapshots.get(klass, ()):
+            other = ref()
+            if other is not None and other is not snapshot:
+                other.touched.update(touched)
+
+        dikt = _type_dict(klass)
+        entries = snapshot.entries
+        if _mutable_type(klass):
+            keys = set(dikt).union(entries)
+        else:
+            # the originals of cursed attributes are kept under `_c_`
+            keys = touched.union('_c_%s' % attr for attr in touched)
+        changed = False
+        for key in keys:
+            value = entries.get(key, _missing)
+            if dikt.get(key, _missing) is value:
+                continue
+            if value is _missing:
+                del dikt[key]
+            else:
+                dikt[key] = value
+            changed = True
+        if changed:
+            _type_modified(klass)
+
+        saved = snapshot.tables[-1]
+        for attr in touched:
+            key = (klass, attr)
+            if attr in snapshot.cursed:
+                _cursed_attrs.add(key)
+            else:
+                _cursed_attrs.discard(key)
+
+            record = saved.get(attr)
+            current = _dunder_curses.get(key)
+            if record is None:
+                if current is not None:
+                    _revert_special(klass, attr)
+            elif current is None or current[0] is not record[0] or \
+                    current[1:] != record[1:]:
+                _curse_special(klass, attr, *record)
+
+            for table, values in zip(_snapshot_tables, snapshot.tables):
+                if attr in values:
+                    table[key] = values[attr]
+                else:
+                    table.pop(key, None)
+
+            if attr in snapshot.hidden:
+                __hidden_elements__.setdefault(klass, set()).add(attr)
+            elif __hidden_elements__ is not None:
+                __hidden_elements__.get(klass, set()).discard(attr)
+        _dir_changed()
+
+
+def active_curses():
+    """List the curses in place as `(klass, attr, value, options)` tuples
+
+    They come in the order they were made, with the value and the
+    `curse()` options they were given, so making them again elsewhere
+    gets the same result. See `forbiddenfruit.pool`.
+    """
+    with _lock:
+        return [(klass, attr, value, dict(options))
+                for (klass, attr), (value, options) in _active.items()]
+
+
+# a process forked while another thread curses something could get its
+# types half done, and a lock it can't release
+def _before_fork():
+    _lock.acquire()
+
+
+def _after_fork_in_parent():
+    _lock.release()
+
+
+def _after_fork_in_child():
+    # the calls counted by the parent aren't the child's
+    reset_call_stats()
+    _lock.release()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork,
+                        after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
+
+
+def curses(klass, name, memoize=None, vectorcall=False, instrument=False):
     """Decorator to add decorated method named `name` the class `klass`
 
     So you can use it like this:
@@ -521,17 +1647,216 @@ def curses(klass, name):
         ...         l, l is 1 and '' or 's')
         >>> {'a': 1, 'b': 2}.banner()
         'This dict has 2 elements'
+
+    `memoize`, `vectorcall` and `instrument` work just like in `curse()`.
     """
     def wrapper(func):
-        curse(klass, name, func)
+        curse(klass, name, func, memoize=memoize, vectorcall=vectorcall,
+              instrument=instrument)
         return func
     return wrapper
 
 
+# curses waiting for their module to be imported,
+# {module name: [(type name, attr, value, options)]}
+_import_curses = {}
+
+
+class _CursingLoader(object):
+    """Wrap the loader of a module to curse its types once it's executed"""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # the module only ever gets to see its own loader
+        module.__loader__ = module.__spec__.loader = self.loader
+        self.loader.exec_module(module)
+        _apply_import_curses(self.name, module)
+
+
+class _CurseFinder(object):
+    """Meta path finder handing the modules with pending curses, and only
+    those, to a `_CursingLoader`"""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in _import_curses:
+            return None
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, 'find_spec', None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if hasattr(spec.loader, 'exec_module'):
+            spec.loader = _CursingLoader(fullname, spec.loader)
+        return spec
+
+
+_curse_finder = _CurseFinder()
+
+
+def _apply_import_curses(name, module):
+    with _lock:
+        pending = _import_curses.pop(name, ())
+        if not _import_curses and _curse_finder in sys.meta_path:
+            sys.meta_path.remove(_curse_finder)
+    with batch():
+        for type_name, attr, value, options in pending:
+            _curse_module_type(module, type_name, attr, value, options)
+
+
+def _curse_module_type(module, type_name, attr, value, options):
+    klass = module
+    for name in type_name.split('.'):
+        klass = getattr(klass, name)
+    curse(klass, attr, value, **options)
+
+
+def curse_on_import(module, type_name, attr, value, **options):
+    """Curse `attr` of the type `type_name` from `module` once it's imported
+
+        >>> curse_on_import('decimal', 'Decimal', 'double', lambda s: s * 2)
+
+    Nothing is imported here: a `sys.meta_path` finder curses the type
+    right after the module is executed. If the module was already
+    imported, the curse is applied right away. `options` are the keyword
+    arguments of `curse()`. Errors cursing the type, such as a missing
+    `type_name`, make the import of the module fail.
+    """
+    with _lock:
+        loaded = sys.modules.get(module)
+        if loaded is None:
+            _import_curses.setdefault(module, []).append(
+                (type_name, attr, value, options))
+            if _curse_finder not in sys.meta_path:
+                sys.meta_path.insert(0, _curse_finder)
+            return
+    _curse_module_type(loaded, type_name, attr, value, options)
+
+
+# marks scoped dispatchers without anything to fall back to
+_missing = object()
+
+
+class ScopedAttribute(object):
+    """Descriptor dispatching to the value of the current scoped curse
+
+    Outside of any scope it behaves like the attribute it replaced, or
+    raises `AttributeError` if there wasn't one.
+    """
+
+    def __init__(self, klass, attr, original):
+        self.key = (klass, attr)
+        self.original = original
+
+    def __get__(self, obj, objtype=None):
+        scoped = _scoped_curses.get()
+        if scoped is not None and self.key in scoped:
+            value = scoped[self.key]
+        elif self.original is not _missing:
+            value = self.original
+        else:
+            raise AttributeError("type object '{0}' has no attribute '{1}'"
+                                 .format(self.key[0].__name__, self.key[1]))
+        get = getattr(type(value), '__get__', None)
+        if get is None:
+            return value
+        return get(value, obj, objtype)
+
+
+def _scoped_dunder(klass, attr):
+    """Build the function dispatching a dunder to its scoped curse"""
+    key = (klass, attr)
+    original = getattr(klass, attr, None)
+
+    def dispatcher(*args):
+        scoped = _scoped_curses.get()
+        if scoped is not None and key in scoped:
+            return scoped[key](*args)
+        # the slot wrapper still calls the C function we replaced
+        if original is None or not isinstance(args[0], klass):
+            raise NotImplementedError()
+        return original(*args)
+    return dispatcher
+
+
+def _install_dispatcher(klass, attr):
+    with _lock:
+        if (klass, attr) in _dispatchers:
+            return
+        if _is_dunder(attr):
+            if attr == '__new__':
+                raise NotImplementedError(
+                    "__new__ can't be cursed within a scope")
+            dispatcher = _scoped_dunder(klass, attr)
+            curse(klass, attr, dispatcher)
+        else:
+            original = klass.__dict__.get(attr, _missing)
+            dispatcher = ScopedAttribute(klass, attr, original)
+            curse(klass, attr, dispatcher, hide_from_dir=original is _missing)
+        # scoped curses are local to the context, there's nothing to
+        # replicate elsewhere
+        _active.pop((klass, attr), None)
+        _dispatchers[(klass, attr)] = dispatcher
+
+
+class _Scope(ContextDecorator):
+    """Make a scoped curse visible to the code running within the block"""
+
+    def __init__(self, klass, attr, value):
+        if _scoped_curses is None:
+            raise NotImplementedError(
+                "Scoped curses are only supported on Python >= 3.7")
+        self.key = (klass, attr)
+        self.value = value
+        self.tokens = []
+
+    def _recreate_cm(self):
+        # each decorated call gets its own scope
+        return type(self)(self.key[0], self.key[1], self.value)
+
+    def __enter__(self):
+        if self.key not in _dispatchers:
+            _install_dispatcher(*self.key)
+        scoped = _scoped_curses.get()
+        scoped = dict(scoped) if scoped else {}
+        scoped[self.key] = self.value
+        self.tokens.append(_scoped_curses.set(scoped))
+        return self
+
+    def __exit__(self, *exc):
+        _scoped_curses.reset(self.tokens.pop())
+
+
 @contextmanager
-def cursed(obj, attr, val, hide_from_dir=False):
+def _cursed(obj, attr, val, hide_from_dir=False):
     curse(obj, attr, val, hide_from_dir)
     try:
         yield
     finally:
         reverse(obj, attr)
+
+
+def cursed(obj, attr, val, hide_from_dir=False, scoped=False):
+    """Curse `obj` with `attr` set to `val` and reverse it on exit
+
+    With `scoped`, the curse is only seen by code running in the same
+    thread or asyncio task as the block, and nothing is reversed on
+    exit. The first scoped curse of an attribute installs a dispatcher
+    that stays in place, after that entering and leaving scopes only
+    sets a context variable.
+    """
+    if scoped:
+        return _Scope(obj, attr, val)
+    return _cursed(obj, attr, val, hide_from_dir)
@@ -0,0 +1,360 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""ctypes declarations of the CPython objects forbiddenfruit writes to
+
+The object header and the tail of `PyTypeObject` change between python
+versions and build flavors. `build()` declares the structures for any
+`Layout`, and the module level names are the ones of the running
+interpreter, as detected by `detect()`. `check()` makes sure they match
+what the interpreter actually has in memory.
+"""
+
+import sys
+import ctypes
+from collections import namedtuple
+
+
+Py_ssize_t = ctypes.c_int64 if ctypes.sizeof(ctypes.c_void_p) == 8 else ctypes.c_int32
+
+PyObject_p = ctypes.py_object
+Inquiry_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p)
+# return type is void* to allow ctypes to convert python integers to
+# plain PyObject*
+UnaryFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p)
+BinaryFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, PyObject_p)
+TernaryFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, PyObject_p, PyObject_p)
+LenFunc_p = ctypes.CFUNCTYPE(Py_ssize_t, PyObject_p)
+SSizeArgFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, Py_ssize_t)
+# the value is NULL when deleting
+SSizeObjArgProc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, Py_ssize_t, ctypes.c_void_p)
+ObjObjArgProc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, PyObject_p, ctypes.c_void_p)
+ObjObjProc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, PyObject_p)
+Destructor_p = ctypes.CFUNCTYPE(None, PyObject_p)
+FreeFunc_p = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+GetAttroFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, PyObject_p)
+SetAttroFunc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, PyObject_p, ctypes.c_void_p)
+# NULL without an exception set ends the iteration, a new reference is
+# returned by address otherwise
+IterNextFunc_p = ctypes.CFUNCTYPE(ctypes.c_void_p, PyObject_p)
+# PySendResult (*sendfunc)(PyObject *iter, PyObject *value, PyObject **result)
+SendFunc_p = ctypes.CFUNCTYPE(
+    ctypes.c_int, PyObject_p, PyObject_p, ctypes.POINTER(ctypes.c_void_p))
+RichCmpFunc_p = ctypes.CFUNCTYPE(ctypes.py_object, PyObject_p, PyObject_p, ctypes.c_int)
+# callable, PyObject *const *args, size_t nargsf, PyObject *kwnames
+VectorcallFunc_p = ctypes.CFUNCTYPE(
+    ctypes.py_object, PyObject_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p)
+
+
+class Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        # owned reference to the exporting object
+        ('obj', ctypes.c_void_p),
+        ('len', Py_ssize_t),
+        ('itemsize', Py_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.POINTER(Py_ssize_t)),
+        ('strides', ctypes.POINTER(Py_ssize_t)),
+        ('suboffsets', ctypes.POINTER(Py_ssize_t)),
+        ('internal', ctypes.c_void_p),
+    ]
+
+Py_buffer_p = ctypes.POINTER(Py_buffer)
+GetBufferProc_p = ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, Py_buffer_p, ctypes.c_int)
+ReleaseBufferProc_p = ctypes.CFUNCTYPE(None, PyObject_p, Py_buffer_p)
+
+
+class PyFile(ctypes.Structure):
+    pass
+
+FILE_p = ctypes.POINTER(PyFile)
+
+
+# `version` is a (major, minor) tuple. `free_threaded` builds (3.13t)
+# have a bigger object header, so do `trace_refs` builds before 3.13.
+Layout = namedtuple('Layout', 'version free_threaded trace_refs')
+
+# the layouts `build()` knows about, newer versions get the last one
+SUPPORTED_VERSIONS = [(3, minor) for minor in range(5, 14)]
+
+
+def detect():
+    """The layout of the running interpreter"""
+    abiflags = getattr(sys, 'abiflags', None)
+    if abiflags is None:
+        # windows has no abiflags
+        import sysconfig
+        free_threaded = bool(sysconfig.get_config_var('Py_GIL_DISABLED'))
+    else:
+        free_threaded = 't' in abiflags
+    return Layout(sys.version_info[:2], free_threaded, hasattr(sys, 'getobjects'))
+
+
+def supported_layouts():
+    """Every layout `build()` can declare"""
+    for version in SUPPORTED_VERSIONS:
+        yield Layout(version, False, False)
+        if version < (3, 13):
+            yield Layout(version, False, True)
+        else:
+            yield Layout(version, True, False)
+
+
+def _object_head(layout, PyTypeObject):
+    """Fields of `PyObject_HEAD` in `layout`"""
+    head = []
+    if layout.trace_refs and layout.version < (3, 13):
+        # _PyObject_HEAD_EXTRA, 3.13 keeps traced objects in a table
+        head += [
+            ('_ob_next', ctypes.c_void_p),
+            ('_ob_prev', ctypes.c_void_p),
+        ]
+    if layout.free_threaded:
+        head += [
+            ('ob_tid', ctypes.c_size_t),
+            ('_padding', ctypes.c_uint16),
+            ('ob_mutex', ctypes.c_uint8),
+            ('ob_gc_bits', ctypes.c_uint8),
+            ('ob_ref_local', ctypes.c_uint32),
+            ('ob_ref_shared', Py_ssize_t),
+        ]
+    else:
+        head += [('ob_refcnt', Py_ssize_t)]
+    head += [('ob_type', ctypes.POINTER(PyTypeObject))]
+    return head
+
+
+def _type_fields(layout, structs):
+    """Fields of `PyTypeObject` in `layout`"""
+    version = layout.version
+    fields = [
+        # varhead
+        ('ob_base', structs['PyObject']),
+        ('ob_size', Py_ssize_t),
+        # declaration
+        ('tp_name', ctypes.c_char_p),
+        ('tp_basicsize', Py_ssize_t),
+        ('tp_itemsize', Py_ssize_t),
+        ('tp_dealloc', Destructor_p),
+    ]
+    if version >= (3, 8):
+        fields.append(('tp_vectorcall_offset', Py_ssize_t))
+    else:
+        fields.append(('tp_print', ctypes.CFUNCTYPE(
+            ctypes.c_int, PyObject_p, FILE_p, ctypes.c_int)))
+    fields += [
+        ('tp_getattr', ctypes.CFUNCTYPE(PyObject_p, PyObject_p, ctypes.c_char_p)),
+        ('tp_setattr', ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, ctypes.c_char_p, PyObject_p)),
+        ('tp_as_async', ctypes.POINTER(structs['PyAsyncMethods'])),
+        ('tp_repr', UnaryFunc_p),
+        ('tp_as_number', ctypes.POINTER(structs['PyNumberMethods'])),
+        ('tp_as_sequence', ctypes.POINTER(structs['PySequenceMethods'])),
+        ('tp_as_mapping', ctypes.POINTER(structs['PyMappingMethods'])),
+        ('tp_hash', ctypes.CFUNCTYPE(Py_ssize_t, PyObject_p)),
+        ('tp_call', ctypes.CFUNCTYPE(PyObject_p, PyObject_p, PyObject_p, ctypes.c_void_p)),
+        ('tp_str', UnaryFunc_p),
+        ('tp_getattro', GetAttroFunc_p),
+        ('tp_setattro', SetAttroFunc_p),
+        ('tp_as_buffer', ctypes.POINTER(structs['PyBufferProcs'])),
+        ('tp_flags', ctypes.c_ulong),
+        ('tp_doc', ctypes.c_char_p),
+        ('tp_traverse', ctypes.c_void_p),
+        ('tp_clear', Inquiry_p),
+        ('tp_richcompare', RichCmpFunc_p),
+        ('tp_weaklistoffset', Py_ssize_t),
+        ('tp_iter', UnaryFunc_p),
+        ('tp_iternext', IterNextFunc_p),
+        ('tp_methods', ctypes.c_void_p),
+        ('tp_members', ctypes.c_void_p),
+        ('tp_getset', ctypes.c_void_p),
+        ('tp_base', ctypes.c_void_p),
+        ('tp_dict', ctypes.c_void_p),
+        ('tp_descr_get', TernaryFunc_p),
+        ('tp_descr_set', ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, PyObject_p, ctypes.c_void_p)),
+        ('tp_dictoffset', Py_ssize_t),
+        ('tp_init', ctypes.CFUNCTYPE(ctypes.c_int, PyObject_p, PyObject_p, ctypes.c_void_p)),
+        ('tp_alloc', ctypes.c_void_p),
+        ('tp_new', ctypes.CFUNCTYPE(PyObject_p, PyObject_p, PyObject_p, ctypes.c_void_p)),
+        ('tp_free', FreeFunc_p),
+        ('tp_is_gc', Inquiry_p),
+        ('tp_bases', ctypes.c_void_p),
+        ('tp_mro', ctypes.c_void_p),
+        ('tp_cache', ctypes.c_void_p),
+        # an index into the interpreter state for static types since 3.12
+        ('tp_subclasses', ctypes.c_void_p),
+        ('tp_weaklist', ctypes.c_void_p),
+        ('tp_del', Destructor_p),
+        ('tp_version_tag', ctypes.c_uint),
+        ('tp_finalize', Destructor_p),
+    ]
+    if version >= (3, 8):
+        fields.append(('tp_vectorcall', VectorcallFunc_p))
+    if version == (3, 8):
+        # kept for backwards compatibility in 3.8 only
+        fields.append(('tp_print', ctypes.c_void_p))
+    if version >= (3, 12):
+        fields.append(('tp_watched', ctypes.c_ubyte))
+    if version >= (3, 13):
+        fields.append(('tp_versions_used', ctypes.c_uint16))
+    return fields
+
+
+def build(layout):
+    """Declare the structures of `layout`, returns them by name"""
+
+    class PyObject(ctypes.Structure):
+        if layout.free_threaded:
+            # the thread owning the object has its own count, anyone else
+            # goes through the shared one, shifted by two flag bits
+            def incref(self):
+                self.ob_ref_shared += 1 << 2
+
+            def decref(self):
+                self.ob_ref_shared -= 1 << 2
+        else:
+            def incref(self):
+                self.ob_refcnt += 1
+
+            def decref(self):
+                self.ob_refcnt -= 1
+
+    class PyNumberMethods(ctypes.Structure):
+        _fields_ = [
+        ('nb_add', BinaryFunc_p),
+        ('nb_subtract', BinaryFunc_p),
+        ('nb_multiply', BinaryFunc_p),
+        ('nb_remainder', BinaryFunc_p),
+        ('nb_divmod', BinaryFunc_p),
+        ('nb_power', TernaryFunc_p),
+        ('nb_negative', UnaryFunc_p),
+        ('nb_positive', UnaryFunc_p),
+        ('nb_absolute', UnaryFunc_p),
+        ('nb_bool', Inquiry_p),
+        ('nb_invert', UnaryFunc_p),
+        ('nb_lshift', BinaryFunc_p),
+        ('nb_rshift', BinaryFunc_p),
+        ('nb_and', BinaryFunc_p),
+        ('nb_xor', BinaryFunc_p),
+        ('nb_or', BinaryFunc_p),
+        ('nb_int', UnaryFunc_p),
+        ('nb_reserved', ctypes.c_void_p),
+        ('nb_float', UnaryFunc_p),
+
+        ('nb_inplace_add', BinaryFunc_p),
+        ('nb_inplace_subtract', BinaryFunc_p),
+        ('nb_inplace_multiply', BinaryFunc_p),
+        ('nb_inplace_remainder', BinaryFunc_p),
+        ('nb_inplace_power', TernaryFunc_p),
+        ('nb_inplace_lshift', BinaryFunc_p),
+        ('nb_inplace_rshift', BinaryFunc_p),
+        ('nb_inplace_and', BinaryFunc_p),
+        ('nb_inplace_xor', BinaryFunc_p),
+        ('nb_inplace_or', BinaryFunc_p),
+
+        ('nb_floor_divide', BinaryFunc_p),
+        ('nb_true_divide', BinaryFunc_p),
+        ('nb_inplace_floor_divide', BinaryFunc_p),
+        ('nb_inplace_true_divide', BinaryFunc_p),
+
+        ('nb_index', UnaryFunc_p),
+
+        ('nb_matrix_multiply', BinaryFunc_p),
+        ('nb_inplace_matrix_multiply', BinaryFunc_p),
+        ]
+
+    class PySequenceMethods(ctypes.Structure):
+        _fields_ = [
+            ('sq_length', LenFunc_p),
+            ('sq_concat', BinaryFunc_p),
+            ('sq_repeat', SSizeArgFunc_p),
+            ('sq_item', SSizeArgFunc_p),
+            ('was_sq_slice', ctypes.c_void_p),
+            ('sq_ass_item', SSizeObjArgProc_p),
+            ('was_sq_ass_slice', ctypes.c_void_p),
+            ('sq_contains', ObjObjProc_p),
+            ('sq_inplace_concat', BinaryFunc_p),
+            ('sq_inplace_repeat', SSizeArgFunc_p),
+        ]
+
+    class PyMappingMethods(ctypes.Structure):
+        _fields_ = [
+            ('mp_length', LenFunc_p),
+            ('mp_subscript', BinaryFunc_p),
+            ('mp_ass_subscript', ObjObjArgProc_p),
+        ]
+
+    class PyTypeObject(ctypes.Structure):
+        pass
+
+    class PyAsyncMethods(ctypes.Structure):
+        _fields_ = [
+            ('am_await', UnaryFunc_p),
+            ('am_aiter', UnaryFunc_p),
+            ('am_anext', UnaryFunc_p),
+        ]
+        if layout.version >= (3, 10):
+            _fields_ = _fields_ + [('am_send', SendFunc_p)]
+
+    class PyBufferProcs(ctypes.Structure):
+        _fields_ = [
+            ('bf_getbuffer', GetBufferProc_p),
+            ('bf_releasebuffer', ReleaseBufferProc_p),
+        ]
+
+    structs = {
+        'PyObject': PyObject,
+        'PyNumberMethods': PyNumberMethods,
+        'PySequenceMethods': PySequenceMethods,
+        'PyMappingMethods': PyMappingMethods,
+        'PyTypeObject': PyTypeObject,
+        'PyAsyncMethods': PyAsyncMethods,
+        'PyBufferProcs': PyBufferProcs,
+    }
+    PyObject._fields_ = _object_head(layout, PyTypeObject)
+    PyTypeObject._fields_ = _type_fields(layout, structs)
+    return structs
+
+
+def check(structs=None, klass=int):
+    """Compare the declared `PyTypeObject` with what's in memory
+
+    Raises `RuntimeError` when the fields backing the attributes of
+    `klass` don't hold the same values, which means they're not laid out
+    where the declarations say.
+    """
+    structs = structs or globals()
+    tyobj = structs['PyTypeObject'].from_address(id(klass))
+    expected = [
+        ('ob_type', ctypes.cast(tyobj.ob_base.ob_type, ctypes.c_void_p).value,
+         id(type(klass))),
+        ('tp_basicsize', tyobj.tp_basicsize, klass.__basicsize__),
+        ('tp_itemsize', tyobj.tp_itemsize, klass.__itemsize__),
+        ('tp_flags', tyobj.tp_flags, klass.__flags__),
+        ('tp_weaklistoffset', tyobj.tp_weaklistoffset, klass.__weakrefoffset__),
+        ('tp_dictoffset', tyobj.tp_dictoffset, klass.__dictoffset__),
+        ('tp_mro', tyobj.tp_mro, id(klass.__mro__)),
+    ]
+    for field, found, wanted in expected:
+        if found != wanted:
+            raise RuntimeError(
+                "Unsupported object layout: {0} of {1} is {2}, expected {3}"
+                .format(field, klass.__name__, found, wanted))
+
+
+layout = detect()
+_structs = build(layout)
+
+PyObject = _structs['PyObject']
+PyNumberMethods = _structs['PyNumberMethods']
+PySequenceMethods = _structs['PySequenceMethods']
+PyMappingMethods = _structs['PyMappingMethods']
+PyTypeObject = _structs['PyTypeObject']
+PyAsyncMethods = _structs['PyAsyncMethods']
+PyBufferProcs = _structs['PyBufferProcs']
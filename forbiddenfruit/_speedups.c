@@ -0,0 +1,963 @@
+/*
+ * forbiddenfruit - Patch built-in python objects
+ *
+ * Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+ *
+ * This program is dual licensed under GPLv3 and MIT. See the COPYING
+ * and COPYING.mit files distributed with this program for details.
+ *
+ * Native trampolines for cursed "dunder" slots.
+ *
+ * Each trampoline below is a plain C function with the exact signature
+ * CPython expects in a given slot (nb_add, sq_item, tp_str, ...). It
+ * finds the python callable registered for the receiving type and calls
+ * it directly, without going through libffi and ctypes argument
+ * conversion. Raising NotImplementedError from the callable is turned
+ * into a native `Py_NotImplemented' return, just like the ctypes
+ * wrapper built by `_curse_special()' does.
+ *
+ * The `*_vectorcall' trampolines serve `tp_new' and `tp_call' to callables
+ * taking the arguments spread, `func(obj, *args, **kwargs)'. From 3.9 on,
+ * `tp_vectorcall' calls them straight from the caller's argument array,
+ * without building an argument tuple or a keyword dict.
+ *
+ * The six comparison operators share `tp_richcompare', which dispatches
+ * on the operator. Each one is registered on its own, as
+ * `tp_richcompare_lt' to `tp_richcompare_ge', and the ones that aren't
+ * cursed still go to the original C function of the type.
+ *
+ * A cursed `__next__' raising StopIteration makes `tp_iternext' return
+ * NULL without an exception set, which is how C iterators tell they're
+ * exhausted, so loops don't have to catch it.
+ *
+ * Assignment slots get called with a NULL value to delete items. Only
+ * setting is cursed, deleting goes to the C function the slot had before
+ * the curse, given to `register()'.
+ *
+ * A cursed `__buffer__' returns another object supporting the buffer
+ * protocol. `bf_getbuffer' exports the memory of that one as is, views
+ * are released by the exporter itself.
+ *
+ * The module only knows about callables and function addresses. Writing
+ * those addresses into the type objects is still done from python.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+
+#if PY_VERSION_HEX >= 0x03090000
+# define ff_vectorcall(f, a, n) PyObject_Vectorcall((f), (a), (n), NULL)
+# define ff_vectorcall_dict(f, a, n, kw) PyObject_VectorcallDict((f), (a), (n), (kw))
+#elif PY_VERSION_HEX >= 0x03080000
+# define ff_vectorcall(f, a, n) _PyObject_Vectorcall((f), (a), (n), NULL)
+# define ff_vectorcall_dict(f, a, n, kw) _PyObject_FastCallDict((f), (a), (n), (kw))
+#else
+# define ff_vectorcall(f, a, n) _PyObject_FastCall((f), (PyObject **) (a), (n))
+# define ff_vectorcall_dict(f, a, n, kw) _PyObject_FastCallDict((f), (PyObject **) (a), (n), (kw))
+#endif
+
+/* Types only honor `tp_vectorcall' from 3.9 on */
+#if PY_VERSION_HEX >= 0x03090000
+# define FF_VECTORCALL_SLOTS(X) X(tp_vectorcall, vectorcall)
+#else
+# define FF_VECTORCALL_SLOTS(X)
+#endif
+
+/* Arguments that fit in here are passed on from the C stack */
+#define FF_SMALL_ARGS 8
+
+
+/* Every slot we know how to trampoline, along with its C signature */
+#define FF_SLOTS(X)                             \
+  X(nb_add, binary)                             \
+  X(nb_subtract, binary)                        \
+  X(nb_multiply, binary)                        \
+  X(nb_remainder, binary)                       \
+  X(nb_divmod, binary)                          \
+  X(nb_power, ternary)                          \
+  X(nb_negative, unary)                         \
+  X(nb_positive, unary)                         \
+  X(nb_absolute, unary)                         \
+  X(nb_bool, inquiry)                           \
+  X(nb_invert, unary)                           \
+  X(nb_lshift, binary)                          \
+  X(nb_rshift, binary)                          \
+  X(nb_and, binary)                             \
+  X(nb_xor, binary)                             \
+  X(nb_or, binary)                              \
+  X(nb_int, unary)                              \
+  X(nb_float, unary)                            \
+  X(nb_inplace_add, binary)                     \
+  X(nb_inplace_subtract, binary)                \
+  X(nb_inplace_multiply, binary)                \
+  X(nb_inplace_remainder, binary)               \
+  X(nb_inplace_power, ternary)                  \
+  X(nb_inplace_lshift, binary)                  \
+  X(nb_inplace_rshift, binary)                  \
+  X(nb_inplace_and, binary)                     \
+  X(nb_inplace_xor, binary)                     \
+  X(nb_inplace_or, binary)                      \
+  X(nb_floor_divide, binary)                    \
+  X(nb_true_divide, binary)                     \
+  X(nb_inplace_floor_divide, binary)            \
+  X(nb_inplace_true_divide, binary)             \
+  X(nb_index, unary)                            \
+  X(nb_matrix_multiply, binary)                 \
+  X(nb_inplace_matrix_multiply, binary)         \
+  X(am_await, unary)                            \
+  X(am_aiter, unary)                            \
+  X(am_anext, unary)                            \
+  X(mp_length, len)                             \
+  X(mp_subscript, objarg)                       \
+  X(mp_ass_subscript, objobjarg)                \
+  X(sq_length, len)                             \
+  X(sq_concat, binary)                          \
+  X(sq_repeat, ssizearg)                        \
+  X(sq_item, ssizearg)                          \
+  X(sq_ass_item, ssizeobjarg)                   \
+  X(sq_contains, objobj)                        \
+  X(sq_inplace_concat, binary)                  \
+  X(sq_inplace_repeat, ssizearg)                \
+  X(tp_hash, hash)                              \
+  X(tp_richcompare_lt, compare)                 \
+  X(tp_richcompare_le, compare)                 \
+  X(tp_richcompare_eq, compare)                 \
+  X(tp_richcompare_ne, compare)                 \
+  X(tp_richcompare_gt, compare)                 \
+  X(tp_richcompare_ge, compare)                 \
+  X(tp_str, unary)                              \
+  X(tp_iter, unary)                             \
+  X(tp_iternext, iternext)                      \
+  X(tp_call, call)                              \
+  X(tp_new, new)                                \
+  X(tp_call_vectorcall, spread)                 \
+  X(tp_new_vectorcall, spread)                  \
+  X(bf_getbuffer, getbuffer)                    \
+  FF_VECTORCALL_SLOTS(X)
+
+
+#define FF_ENUM(name, kind) FF_SLOT_##name,
+enum { FF_SLOTS(FF_ENUM) FF_NSLOTS };
+#undef FF_ENUM
+
+
+/* One {type: callable} dictionary per slot */
+static PyObject *ff_registry[FF_NSLOTS];
+
+/* One {type: address} dictionary per slot, what the slots of the cursed
+ * types pointed to before */
+static PyObject *ff_originals[FF_NSLOTS];
+
+static void *ff_address(int slot);
+
+
+/* Find the value `registry' has for `type' or any of its bases.
+ * Returns a borrowed reference or NULL without an exception set. */
+static PyObject *
+ff_lookup_in(PyObject *registry, PyTypeObject *type)
+{
+  PyObject *value, *mro;
+  Py_ssize_t i, n;
+
+  value = PyDict_GetItem(registry, (PyObject *) type);
+  if (value != NULL)
+    return value;
+
+  mro = type->tp_mro;
+  if (mro == NULL)
+    return NULL;
+  n = PyTuple_GET_SIZE(mro);
+  for (i = 1; i < n; i++) {
+    value = PyDict_GetItem(registry, PyTuple_GET_ITEM(mro, i));
+    if (value != NULL)
+      return value;
+  }
+  return NULL;
+}
+
+
+#ifndef Py_GIL_DISABLED
+/* The last type each slot was called for and its callable, the type is
+ * told apart by its version tag as well, which is never given to two
+ * types. Changing the registry of a slot drops its entry. */
+static struct {
+  PyTypeObject *type;
+  unsigned int version;
+  PyObject *func;
+} ff_cache[FF_NSLOTS];
+
+/* name looked up to get types a version tag */
+static PyObject *ff_tag_name;
+
+
+/* The version tag of `type', they're only assigned on demand. Zero
+ * when it can't have one. */
+static unsigned int
+ff_version(PyTypeObject *type)
+{
+#if PY_VERSION_HEX >= 0x030C0000
+  if (type->tp_version_tag == 0)
+    PyUnstable_Type_AssignVersionTag(type);
+  return type->tp_version_tag;
+#else
+  if (!PyType_HasFeature(type, Py_TPFLAGS_VALID_VERSION_TAG))
+    _PyType_Lookup(type, ff_tag_name);
+  return PyType_HasFeature(type, Py_TPFLAGS_VALID_VERSION_TAG) ?
+    type->tp_version_tag : 0;
+#endif
+}
+#endif
+
+
+/* The callable cursed into `slot' for `type' */
+static PyObject *
+ff_lookup(int slot, PyTypeObject *type)
+{
+#ifdef Py_GIL_DISABLED
+  return ff_lookup_in(ff_registry[slot], type);
+#else
+  unsigned int version = ff_version(type);
+  PyObject *func;
+
+  if (version != 0 && ff_cache[slot].type == type &&
+      ff_cache[slot].version == version)
+    return ff_cache[slot].func;
+  func = ff_lookup_in(ff_registry[slot], type);
+  if (version != 0) {
+    ff_cache[slot].type = type;
+    ff_cache[slot].version = version;
+    ff_cache[slot].func = func;
+  }
+  return func;
+#endif
+}
+
+
+static void
+ff_forget(int slot)
+{
+#ifndef Py_GIL_DISABLED
+  ff_cache[slot].type = NULL;
+  ff_cache[slot].func = NULL;
+#endif
+}
+
+
+/* The C function `slot' had for `type' before being cursed, NULL if it
+ * was empty. Another trampoline doesn't count, it would call us back. */
+static void *
+ff_original(int slot, PyTypeObject *type)
+{
+  PyObject *address = ff_lookup_in(ff_originals[slot], type);
+  void *original;
+
+  if (address == NULL)
+    return NULL;
+  original = PyLong_AsVoidPtr(address);
+  return original == ff_address(slot) ? NULL : original;
+}
+
+
+static int
+ff_cant_delete(PyObject *self)
+{
+  PyErr_Format(PyExc_TypeError,
+               "'%.200s' object doesn't support item deletion",
+               Py_TYPE(self)->tp_name);
+  return -1;
+}
+
+
+static PyObject *
+ff_missing(int slot, PyObject *self)
+{
+  PyErr_Format(PyExc_TypeError,
+               "no curse registered for this slot on '%.200s'",
+               Py_TYPE(self)->tp_name);
+  return NULL;
+}
+
+
+/* NotImplementedError raised by a cursed callable means NotImplemented */
+static PyObject *
+ff_result(PyObject *result)
+{
+  if (result == NULL && PyErr_ExceptionMatches(PyExc_NotImplementedError)) {
+    PyErr_Clear();
+    Py_RETURN_NOTIMPLEMENTED;
+  }
+  return result;
+}
+
+
+/* Call `func' keeping it alive even if it gets reversed while running */
+static PyObject *
+ff_invoke(PyObject *func, PyObject *const *args, Py_ssize_t nargs)
+{
+  PyObject *result;
+
+  Py_INCREF(func);
+  result = ff_vectorcall(func, args, nargs);
+  Py_DECREF(func);
+  return ff_result(result);
+}
+
+
+static PyObject *
+ff_call_unary(int slot, PyObject *self)
+{
+  PyObject *func = ff_lookup(slot, Py_TYPE(self));
+  PyObject *args[1];
+
+  if (func == NULL)
+    return ff_missing(slot, self);
+  args[0] = self;
+  return ff_invoke(func, args, 1);
+}
+
+
+static PyObject *
+ff_call_iternext(int slot, PyObject *self)
+{
+  PyObject *result = ff_call_unary(slot, self);
+
+  if (result == NULL && PyErr_ExceptionMatches(PyExc_StopIteration))
+    PyErr_Clear();
+  return result;
+}
+
+
+/* Binary number slots are called for both operands. When both types are
+ * cursed they share the same trampoline and CPython only calls it once,
+ * so the right operand gets its turn from here. */
+static PyObject *
+ff_call_operator(int slot, PyObject *const *args, Py_ssize_t nargs)
+{
+  PyTypeObject *ta = Py_TYPE(args[0]), *tb = Py_TYPE(args[1]);
+  PyObject *funca, *funcb = NULL, *result;
+
+  funca = ff_lookup(slot, ta);
+  if (ta != tb && (funcb = ff_lookup(slot, tb)) == funca)
+    funcb = NULL;
+
+  if (funca == NULL && funcb == NULL)
+    Py_RETURN_NOTIMPLEMENTED;
+
+  /* `funcb' is borrowed and could be reversed while `funca' runs */
+  Py_XINCREF(funcb);
+  if (funca != NULL) {
+    result = ff_invoke(funca, args, nargs);
+    if (result != Py_NotImplemented || funcb == NULL)
+      goto done;
+    Py_DECREF(result);
+  }
+  result = ff_invoke(funcb, args, nargs);
+ done:
+  Py_XDECREF(funcb);
+  return result;
+}
+
+
+static PyObject *
+ff_call_binary(int slot, PyObject *a, PyObject *b)
+{
+  PyObject *args[2];
+
+  args[0] = a;
+  args[1] = b;
+  return ff_call_operator(slot, args, 2);
+}
+
+
+static PyObject *
+ff_call_ternary(int slot, PyObject *a, PyObject *b, PyObject *c)
+{
+  PyObject *args[3];
+
+  args[0] = a;
+  args[1] = b;
+  args[2] = c;
+  /* Same as CPython's own slot_nb_power(), don't pass a None modulus */
+  return ff_call_operator(slot, args, c == Py_None ? 2 : 3);
+}
+
+
+static PyObject *
+ff_call_ssizearg(int slot, PyObject *self, Py_ssize_t i)
+{
+  PyObject *func = ff_lookup(slot, Py_TYPE(self));
+  PyObject *args[2], *index, *result;
+
+  if (func == NULL)
+    return ff_missing(slot, self);
+  if ((index = PyLong_FromSsize_t(i)) == NULL)
+    return NULL;
+  args[0] = self;
+  args[1] = index;
+  result = ff_invoke(func, args, 2);
+  Py_DECREF(index);
+  return result;
+}
+
+
+static PyObject *
+ff_call_objarg(int slot, PyObject *self, PyObject *key)
+{
+  PyObject *func = ff_lookup(slot, Py_TYPE(self));
+  PyObject *args[2];
+
+  if (func == NULL)
+    return ff_missing(slot, self);
+  args[0] = self;
+  args[1] = key;
+  return ff_invoke(func, args, 2);
+}
+
+
+static int
+ff_call_setter(PyObject *func, PyObject *self, PyObject *key, PyObject *value)
+{
+  PyObject *args[3], *result;
+
+  args[0] = self;
+  args[1] = key;
+  args[2] = value;
+  if ((result = ff_invoke(func, args, 3)) == NULL)
+    return -1;
+  Py_DECREF(result);
+  return 0;
+}
+
+
+static int
+ff_call_ssizeobjarg(int slot, PyObject *self, Py_ssize_t i, PyObject *value)
+{
+  PyObject *func, *index;
+  int status;
+
+  if (value == NULL) {
+    ssizeobjargproc original =
+      (ssizeobjargproc) ff_original(slot, Py_TYPE(self));
+    return original == NULL ? ff_cant_delete(self) : original(self, i, NULL);
+  }
+  if ((func = ff_lookup(slot, Py_TYPE(self))) == NULL) {
+    ff_missing(slot, self);
+    return -1;
+  }
+  if ((index = PyLong_FromSsize_t(i)) == NULL)
+    return -1;
+  status = ff_call_setter(func, self, index, value);
+  Py_DECREF(index);
+  return status;
+}
+
+
+static int
+ff_call_objobjarg(int slot, PyObject *self, PyObject *key, PyObject *value)
+{
+  PyObject *func;
+
+  if (value == NULL) {
+    objobjargproc original = (objobjargproc) ff_original(slot, Py_TYPE(self));
+    return original == NULL ? ff_cant_delete(self) : original(self, key, NULL);
+  }
+  if ((func = ff_lookup(slot, Py_TYPE(self))) == NULL) {
+    ff_missing(slot, self);
+    return -1;
+  }
+  return ff_call_setter(func, self, key, value);
+}
+
+
+/* Shared by the slots returning a C truth value */
+static int
+ff_call_predicate(int slot, PyObject *self, PyObject *other, Py_ssize_t nargs)
+{
+  PyObject *func = ff_lookup(slot, Py_TYPE(self));
+  PyObject *args[2], *result;
+  int truth;
+
+  if (func == NULL) {
+    ff_missing(slot, self);
+    return -1;
+  }
+  args[0] = self;
+  args[1] = other;
+  if ((result = ff_invoke(func, args, nargs)) == NULL)
+    return -1;
+  truth = PyObject_IsTrue(result);
+  Py_DECREF(result);
+  return truth;
+}
+
+
+/* Shared by the slots returning a Py_ssize_t */
+static Py_ssize_t
+ff_call_ssize(int slot, PyObject *self)
+{
+  PyObject *result = ff_call_unary(slot, self);
+  Py_ssize_t value;
+
+  if (result == NULL)
+    return -1;
+  value = PyLong_AsSsize_t(result);
+  Py_DECREF(result);
+  return value;
+}
+
+
+static PyObject *
+ff_call_new(int slot, PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+  PyObject *func = ff_lookup(slot, type);
+  PyObject *argv[3];
+
+  if (func == NULL)
+    return ff_missing(slot, (PyObject *) type);
+  argv[0] = (PyObject *) type;
+  argv[1] = args;
+  argv[2] = kwargs == NULL ? Py_None : kwargs;
+  return ff_invoke(func, argv, 3);
+}
+
+
+static PyObject *
+ff_call_call(int slot, PyObject *self, PyObject *args, PyObject *kwargs)
+{
+  PyObject *func = ff_lookup(slot, Py_TYPE(self));
+  PyObject *argv[3];
+
+  if (func == NULL)
+    return ff_missing(slot, self);
+  argv[0] = self;
+  argv[1] = args;
+  argv[2] = kwargs == NULL ? Py_None : kwargs;
+  return ff_invoke(func, argv, 3);
+}
+
+
+/* Call `func(first, *args, **kwargs)' for a classic (args, kwargs) slot */
+static PyObject *
+ff_call_spread(PyObject *func, PyObject *first, PyObject *args,
+               PyObject *kwargs)
+{
+  PyObject *small[FF_SMALL_ARGS], **stack = small, *result;
+  Py_ssize_t i, nargs = PyTuple_GET_SIZE(args);
+
+  if (nargs + 1 > FF_SMALL_ARGS) {
+    stack = PyMem_Malloc((nargs + 1) * sizeof(PyObject *));
+    if (stack == NULL)
+      return PyErr_NoMemory();
+  }
+  stack[0] = first;
+  for (i = 0; i < nargs; i++)
+    stack[i + 1] = PyTuple_GET_ITEM(args, i);
+
+  Py_INCREF(func);
+  result = ff_vectorcall_dict(func, stack, nargs + 1, kwargs);
+  Py_DECREF(func);
+  if (stack != small)
+    PyMem_Free(stack);
+  return ff_result(result);
+}
+
+
+/* `self' is the instance for `tp_call' and the type for `tp_new' */
+static PyObject *
+ff_call_spread_slot(int slot, PyObject *self, PyObject *args,
+                    PyObject *kwargs)
+{
+  PyObject *func;
+
+  if (slot == FF_SLOT_tp_new_vectorcall)
+    func = ff_lookup(slot, (PyTypeObject *) self);
+  else
+    func = ff_lookup(slot, Py_TYPE(self));
+  if (func == NULL)
+    return ff_missing(slot, self);
+  return ff_call_spread(func, self, args, kwargs);
+}
+
+
+/* Export the buffer of the object the cursed callable returns. The view
+ * belongs to that exporter, releasing it goes straight to its own
+ * `bf_releasebuffer' and the memory stays put without being copied. */
+static int
+ff_call_getbuffer(int slot, PyObject *self, Py_buffer *view, int flags)
+{
+  PyObject *func = ff_lookup(slot, Py_TYPE(self));
+  PyObject *args[2], *exporter;
+  int status;
+
+  view->obj = NULL;
+  if (func == NULL) {
+    ff_missing(slot, self);
+    return -1;
+  }
+  args[0] = self;
+  if ((args[1] = PyLong_FromLong(flags)) == NULL)
+    return -1;
+  Py_INCREF(func);
+  exporter = ff_vectorcall(func, args, 2);
+  Py_DECREF(func);
+  Py_DECREF(args[1]);
+  if (exporter == NULL)
+    return -1;
+  status = PyObject_GetBuffer(exporter, view, flags);
+  Py_DECREF(exporter);
+  return status;
+}
+
+
+/* `tp_richcompare' of any type with a cursed comparison. The compare
+ * slots are declared in the order of the operators, Py_LT to Py_GE. */
+static PyObject *
+ff_richcompare(PyObject *self, PyObject *other, int op)
+{
+  PyTypeObject *type = Py_TYPE(self);
+  PyObject *func, *args[2];
+  richcmpfunc original;
+  int i;
+
+  if (op < Py_LT || op > Py_GE)
+    Py_RETURN_NOTIMPLEMENTED;
+  func = ff_lookup(FF_SLOT_tp_richcompare_lt + op, type);
+  if (func != NULL) {
+    args[0] = self;
+    args[1] = other;
+    return ff_invoke(func, args, 2);
+  }
+  /* every cursed operator keeps the same original around */
+  for (i = Py_LT; i <= Py_GE; i++) {
+    original = (richcmpfunc) ff_original(FF_SLOT_tp_richcompare_lt + i, type);
+    if (original != NULL)
+      return original(self, other, op);
+  }
+  Py_RETURN_NOTIMPLEMENTED;
+}
+
+
+#if PY_VERSION_HEX >= 0x03090000
+/* Run `tp_init' like `type.__call__' would, unless it's object's own,
+ * which accepts anything and does nothing once `tp_new' is replaced */
+static int
+ff_init(PyObject *obj, PyObject *const *args, size_t nargsf,
+        PyObject *kwnames)
+{
+  initproc init = Py_TYPE(obj)->tp_init;
+  PyObject *tuple, *kwargs = NULL;
+  Py_ssize_t i, nargs = PyVectorcall_NARGS(nargsf);
+  int status;
+
+  if (init == NULL || init == PyBaseObject_Type.tp_init)
+    return 0;
+  if ((tuple = PyTuple_New(nargs)) == NULL)
+    return -1;
+  for (i = 0; i < nargs; i++) {
+    Py_INCREF(args[i]);
+    PyTuple_SET_ITEM(tuple, i, args[i]);
+  }
+  if (kwnames != NULL && PyTuple_GET_SIZE(kwnames) > 0) {
+    if ((kwargs = PyDict_New()) == NULL)
+      goto error;
+    for (i = 0; i < PyTuple_GET_SIZE(kwnames); i++)
+      if (PyDict_SetItem(kwargs, PyTuple_GET_ITEM(kwnames, i),
+                         args[nargs + i]) < 0)
+        goto error;
+  }
+  status = init(obj, tuple, kwargs);
+  Py_DECREF(tuple);
+  Py_XDECREF(kwargs);
+  return status;
+
+ error:
+  Py_DECREF(tuple);
+  Py_XDECREF(kwargs);
+  return -1;
+}
+
+
+/* `tp_vectorcall' of a type with a cursed `__new__', calls the curse
+ * with the type prepended to the caller's arguments, borrowing the slot
+ * in front of them when the caller allows it */
+static PyObject *
+ff_call_vectorcall(int slot, PyObject *type, PyObject *const *args,
+                   size_t nargsf, PyObject *kwnames)
+{
+  PyObject *func = ff_lookup(slot, (PyTypeObject *) type);
+  PyObject *small[FF_SMALL_ARGS], **stack, *saved = NULL, *result;
+  Py_ssize_t nargs = PyVectorcall_NARGS(nargsf);
+  Py_ssize_t total = nargs + (kwnames == NULL ? 0 : PyTuple_GET_SIZE(kwnames));
+
+  if (func == NULL)
+    return ff_missing(slot, type);
+
+  if (nargsf & PY_VECTORCALL_ARGUMENTS_OFFSET) {
+    stack = (PyObject **) args - 1;
+    saved = stack[0];
+  }
+  else if (total + 1 <= FF_SMALL_ARGS) {
+    stack = small;
+    memcpy(stack + 1, args, total * sizeof(PyObject *));
+  }
+  else {
+    stack = PyMem_Malloc((total + 1) * sizeof(PyObject *));
+    if (stack == NULL)
+      return PyErr_NoMemory();
+    memcpy(stack + 1, args, total * sizeof(PyObject *));
+  }
+  stack[0] = type;
+
+  Py_INCREF(func);
+  result = PyObject_Vectorcall(func, stack, nargs + 1, kwnames);
+  Py_DECREF(func);
+
+  if (nargsf & PY_VECTORCALL_ARGUMENTS_OFFSET)
+    stack[0] = saved;
+  else if (stack != small)
+    PyMem_Free(stack);
+
+  result = ff_result(result);
+  if (result != NULL && PyObject_TypeCheck(result, (PyTypeObject *) type) &&
+      ff_init(result, args, nargsf, kwnames) < 0)
+    Py_CLEAR(result);
+  return result;
+}
+#endif
+
+
+/* One C function per slot, generated from its kind */
+
+#define FF_TRAMPOLINE_unary(name)                               \
+  static PyObject *ff_##name(PyObject *self)                    \
+  { return ff_call_unary(FF_SLOT_##name, self); }
+
+#define FF_TRAMPOLINE_iternext(name)                            \
+  static PyObject *ff_##name(PyObject *self)                    \
+  { return ff_call_iternext(FF_SLOT_##name, self); }
+
+#define FF_TRAMPOLINE_binary(name)                              \
+  static PyObject *ff_##name(PyObject *a, PyObject *b)          \
+  { return ff_call_binary(FF_SLOT_##name, a, b); }
+
+#define FF_TRAMPOLINE_ternary(name)                                     \
+  static PyObject *ff_##name(PyObject *a, PyObject *b, PyObject *c)     \
+  { return ff_call_ternary(FF_SLOT_##name, a, b, c); }
+
+#define FF_TRAMPOLINE_inquiry(name)                             \
+  static int ff_##name(PyObject *self)                          \
+  { return ff_call_predicate(FF_SLOT_##name, self, NULL, 1); }
+
+#define FF_TRAMPOLINE_objobj(name)                              \
+  static int ff_##name(PyObject *self, PyObject *other)         \
+  { return ff_call_predicate(FF_SLOT_##name, self, other, 2); }
+
+#define FF_TRAMPOLINE_len(name)                                 \
+  static Py_ssize_t ff_##name(PyObject *self)                   \
+  { return ff_call_ssize(FF_SLOT_##name, self); }
+
+#define FF_TRAMPOLINE_hash(name)                                \
+  static Py_hash_t ff_##name(PyObject *self)                    \
+  {                                                             \
+    Py_hash_t h = (Py_hash_t) ff_call_ssize(FF_SLOT_##name, self); \
+    return (h == -1 && !PyErr_Occurred()) ? -2 : h;             \
+  }
+
+#define FF_TRAMPOLINE_ssizearg(name)                            \
+  static PyObject *ff_##name(PyObject *self, Py_ssize_t i)      \
+  { return ff_call_ssizearg(FF_SLOT_##name, self, i); }
+
+#define FF_TRAMPOLINE_objarg(name)                              \
+  static PyObject *ff_##name(PyObject *self, PyObject *key)     \
+  { return ff_call_objarg(FF_SLOT_##name, self, key); }
+
+#define FF_TRAMPOLINE_objobjarg(name)                                   \
+  static int ff_##name(PyObject *self, PyObject *key, PyObject *value)  \
+  { return ff_call_objobjarg(FF_SLOT_##name, self, key, value); }
+
+#define FF_TRAMPOLINE_ssizeobjarg(name)                                 \
+  static int ff_##name(PyObject *self, Py_ssize_t i, PyObject *value)   \
+  { return ff_call_ssizeobjarg(FF_SLOT_##name, self, i, value); }
+
+#define FF_TRAMPOLINE_new(name)                                         \
+  static PyObject *ff_##name(PyTypeObject *type, PyObject *args,        \
+                             PyObject *kwargs)                          \
+  { return ff_call_new(FF_SLOT_##name, type, args, kwargs); }
+
+#define FF_TRAMPOLINE_call(name)                                        \
+  static PyObject *ff_##name(PyObject *self, PyObject *args,            \
+                             PyObject *kwargs)                          \
+  { return ff_call_call(FF_SLOT_##name, self, args, kwargs); }
+
+#define FF_TRAMPOLINE_spread(name)                                      \
+  static PyObject *ff_##name(PyObject *self, PyObject *args,            \
+                             PyObject *kwargs)                          \
+  { return ff_call_spread_slot(FF_SLOT_##name, self, args, kwargs); }
+
+#define FF_TRAMPOLINE_vectorcall(name)                                  \
+  static PyObject *ff_##name(PyObject *type, PyObject *const *args,     \
+                             size_t nargsf, PyObject *kwnames)          \
+  { return ff_call_vectorcall(FF_SLOT_##name, type, args, nargsf, kwnames); }
+
+#define FF_TRAMPOLINE_getbuffer(name)                                   \
+  static int ff_##name(PyObject *self, Py_buffer *view, int flags)      \
+  { return ff_call_getbuffer(FF_SLOT_##name, self, view, flags); }
+/* All the compare slots share `ff_richcompare()', so their trampolines
+ * have the same address and any of them can be left in the slot */
+#define FF_TRAMPOLINE_compare(name)
+#define ff_tp_richcompare_lt ff_richcompare
+#define ff_tp_richcompare_le ff_richcompare
+#define ff_tp_richcompare_eq ff_richcompare
+#define ff_tp_richcompare_ne ff_richcompare
+#define ff_tp_richcompare_gt ff_richcompare
+#define ff_tp_richcompare_ge ff_richcompare
+
+#define FF_TRAMPOLINE(name, kind) FF_TRAMPOLINE_##kind(name)
+FF_SLOTS(FF_TRAMPOLINE)
+#undef FF_TRAMPOLINE
+
+
+static struct {
+  const char *name;
+  void *address;
+} ff_trampolines[] = {
+#define FF_ENTRY(name, kind) {#name, (void *) ff_##name},
+  FF_SLOTS(FF_ENTRY)
+#undef FF_ENTRY
+  {NULL, NULL}
+};
+
+
+static void *
+ff_address(int slot)
+{
+  return ff_trampolines[slot].address;
+}
+
+
+static int
+ff_slot_index(PyObject *name)
+{
+  const char *cname = PyUnicode_AsUTF8(name);
+  int i;
+
+  if (cname == NULL)
+    return -1;
+  for (i = 0; i < FF_NSLOTS; i++)
+    if (strcmp(ff_trampolines[i].name, cname) == 0)
+      return i;
+  PyErr_Format(PyExc_KeyError, "no native trampoline for slot '%s'", cname);
+  return -1;
+}
+
+
+static PyObject *
+ff_register(PyObject *module, PyObject *args)
+{
+  PyObject *name, *klass, *func, *original = NULL;
+  int slot;
+
+  if (!PyArg_ParseTuple(args, "UO!O|O!:register",
+                        &name, &PyType_Type, &klass, &func,
+                        &PyLong_Type, &original))
+    return NULL;
+  if (!PyCallable_Check(func)) {
+    PyErr_SetString(PyExc_TypeError, "curse value must be callable");
+    return NULL;
+  }
+  if ((slot = ff_slot_index(name)) < 0)
+    return NULL;
+  ff_forget(slot);
+  if (PyDict_SetItem(ff_registry[slot], klass, func) < 0)
+    return NULL;
+  if (original != NULL &&
+      PyDict_SetItem(ff_originals[slot], klass, original) < 0)
+    return NULL;
+  return PyLong_FromVoidPtr(ff_trampolines[slot].address);
+}
+
+
+static PyObject *
+ff_unregister(PyObject *module, PyObject *args)
+{
+  PyObject *name, *klass;
+  int slot;
+
+  if (!PyArg_ParseTuple(args, "UO!:unregister", &name, &PyType_Type, &klass))
+    return NULL;
+  if ((slot = ff_slot_index(name)) < 0)
+    return NULL;
+  ff_forget(slot);
+  if (PyDict_GetItem(ff_registry[slot], klass) != NULL &&
+      PyDict_DelItem(ff_registry[slot], klass) < 0)
+    return NULL;
+  if (PyDict_GetItem(ff_originals[slot], klass) != NULL &&
+      PyDict_DelItem(ff_originals[slot], klass) < 0)
+    return NULL;
+  Py_RETURN_NONE;
+}
+
+
+static PyMethodDef ff_methods[] = {
+  {"register", ff_register, METH_VARARGS,
+   "register(slot, klass, func[, original]) -> address\n\n"
+   "Make the trampoline of `slot' call `func' for `klass' and return\n"
+   "the address of the trampoline. `original' is the address of the C\n"
+   "function the slot had before"},
+  {"unregister", ff_unregister, METH_VARARGS,
+   "unregister(slot, klass)\n\n"
+   "Forget the callable registered for `slot' on `klass'"},
+  {NULL, NULL, 0, NULL}
+};
+
+
+static struct PyModuleDef ff_module = {
+  PyModuleDef_HEAD_INIT,
+  "forbiddenfruit._speedups",
+  "Native trampolines for cursed dunder slots",
+  -1,
+  ff_methods
+};
+
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+  PyObject *m, *trampolines = NULL;
+  int i;
+
+  if ((m = PyModule_Create(&ff_module)) == NULL)
+    return NULL;
+#ifndef Py_GIL_DISABLED
+  if ((ff_tag_name = PyUnicode_InternFromString("__ff_version_tag__")) == NULL)
+    goto error;
+#endif
+  if ((trampolines = PyDict_New()) == NULL)
+    goto error;
+
+  for (i = 0; i < FF_NSLOTS; i++) {
+    PyObject *address;
+
+    if ((ff_registry[i] = PyDict_New()) == NULL)
+      goto error;
+    if ((ff_originals[i] = PyDict_New()) == NULL)
+      goto error;
+    if ((address = PyLong_FromVoidPtr(ff_trampolines[i].address)) == NULL)
+      goto error;
+    if (PyDict_SetItemString(trampolines, ff_trampolines[i].name, address) < 0) {
+      Py_DECREF(address);
+      goto error;
+    }
+    Py_DECREF(address);
+  }
+
+  if (PyModule_AddObject(m, "trampolines", trampolines) < 0)
+    goto error;
+  return m;
+
+ error:
+  Py_XDECREF(trampolines);
+  Py_DECREF(m);
+  return NULL;
+}
@@ -0,0 +1,283 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Apply many curses declared in one place
+
+A manifest lists curses as `(type, attr, target, options)` entries.
+Types and targets are given as dotted paths, `"package.module.name"` or
+`"package.module:name"`, and types without a module are builtins.
+Options are the keyword arguments of `curse()`:
+
+    [[curses]]
+    type = "str"
+    attr = "slugify"
+    target = "myapp.text:slugify"
+    options = {memoize = 1024}
+
+Entries with a `value` instead of a `target` curse that value as is.
+The same document can be given as a python mapping, a list of entries or
+a JSON file. Entries are applied grouped by type, within a single
+`batch()`. Targets of plain attributes are only imported the first time
+the attribute is looked up, unless `lazy` is false; dunder methods are
+called straight by the interpreter, their targets are imported right
+away.
+"""
+
+import os
+from collections import namedtuple
+from importlib import import_module
+
+import forbiddenfruit
+from forbiddenfruit import _lock, _type_dict, batch, curse, reverse
+
+
+# options an entry can hand over to `curse()`
+CURSE_OPTIONS = frozenset(
+    ['hide_from_dir', 'memoize', 'vectorcall', 'instrument', 'propagate'])
+
+EntryTiming = namedtuple('EntryTiming', 'klass attr target import_ns curse_ns')
+
+# entries without a literal value
+_unset = object()
+
+
+try:
+    from time import perf_counter_ns as _clock
+except ImportError:
+    # python < 3.7
+    from time import perf_counter
+
+    def _clock():
+        return int(perf_counter() * 1e9)
+
+
+def _import(module):
+    # a module found in sys.modules might still be running its body in
+    # another thread, import_module waits for it to be done
+    return import_module(module)
+
+
+def resolve(path):
+    """Import the object named by the dotted `path`
+
+    Anything but a string is returned as is. Names without a module are
+    looked up in the builtins.
+    """
+    if not isinstance(path, str):
+        return path
+    if ':' in path:
+        module, qualname = path.split(':', 1)
+        obj = _import(module)
+    elif '.' not in path:
+        obj, qualname = forbiddenfruit.__builtin__, path
+    else:
+        # the longest prefix that can be imported is the module
+        parts = path.split('.')
+        for split in range(len(parts) - 1, 0, -1):
+            module = '.'.join(parts[:split])
+            try:
+                obj = _import(module)
+            except ImportError:
+                if split == 1:
+                    raise
+                continue
+            qualname = '.'.join(parts[split:])
+            break
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+class Entry(object):
+    """One curse of a manifest, along with the time it took to apply"""
+
+    def __init__(self, klass, attr, target, options=None, value=_unset):
+        options = dict(options or {})
+        self.lazy = options.pop('lazy', None)
+        unknown = set(options) - CURSE_OPTIONS
+        if unknown:
+            raise ValueError('Unknown curse options: {0}'.format(
+                ', '.join(sorted(unknown))))
+        self.klass = klass
+        self.attr = attr
+        self.target = target
+        self.options = options
+        self.literal = value
+        # nanoseconds, None until done
+        self.import_ns = None
+        self.curse_ns = None
+
+    def __repr__(self):
+        return 'Entry({0!r}, {1!r}, {2!r}, {3!r})'.format(
+            self.klass, self.attr, self.target, self.options)
+
+    def timing(self):
+        return EntryTiming(self.klass, self.attr, self.target,
+                           self.import_ns, self.curse_ns)
+
+    def value(self):
+        if self.literal is not _unset:
+            return self.literal
+        start = _clock()
+        value = resolve(self.target)
+        self.import_ns = _clock() - start
+        return value
+
+    def prepare(self, lazy):
+        """The value to curse and its options, importing the target now
+        unless it's lazy"""
+        if self.lazy is not None:
+            lazy = self.lazy
+        if lazy and self.literal is _unset and \
+           not forbiddenfruit._is_dunder(self.attr):
+            return LazyTarget(self), {
+                'hide_from_dir': self.options.get('hide_from_dir', False)}
+        return self.value(), self.options
+
+    def curse(self, value, options):
+        start = _clock()
+        curse(self.klass, self.attr, value, **options)
+        self.curse_ns = _clock() - start
+
+    def apply(self, lazy):
+        self.curse(*self.prepare(lazy))
+
+
+class LazyTarget(object):
+    """Stand in for the target of an entry until it's looked up
+
+    The first lookup imports the target and curses it in place of this
+    placeholder, with the options of the entry.
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __get__(self, obj, objtype=None):
+        entry = self.entry
+        if _type_dict(entry.klass).get(entry.attr) is self:
+            # imported without holding the lock, the module might curse
+            # something from another thread while it's loading
+            value = entry.value()
+            with _lock:
+                # unless another thread got there first, cursing it
+                # again keeps the original attribute, if any
+                if _type_dict(entry.klass).get(entry.attr) is self:
+                    curse(entry.klass, entry.attr, value, **entry.options)
+        return getattr(obj if obj is not None else entry.klass, entry.attr)
+
+
+class Manifest(object):
+    """Curses loaded from a manifest, see `load_manifest()`"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.applied = False
+
+    def apply(self, lazy=True):
+        """Curse every entry, the ones of the same type one after another
+
+        Targets are imported before taking the lock of the curses. A
+        manifest applied by another thread in the meantime isn't applied
+        again.
+        """
+        order = {}
+        for entry in self.entries:
+            order.setdefault(entry.klass, len(order))
+        entries = sorted(self.entries, key=lambda e: order[e.klass])
+        prepared = [entry.prepare(lazy) for entry in entries]
+        with batch():
+            if self.applied:
+                return self
+            for entry, (value, options) in zip(entries, prepared):
+                entry.curse(value, options)
+            self.applied = True
+        return self
+
+    def reverse(self):
+        """Reverse every curse of the manifest"""
+        with batch():
+            for entry in reversed(self.entries):
+                reverse(entry.klass, entry.attr)
+        self.applied = False
+
+    def timings(self):
+        """`EntryTiming` of the entries, the slowest to apply first
+
+        `import_ns` is None for the targets that weren't imported yet.
+        """
+        return sorted(
+            (entry.timing() for entry in self.entries),
+            key=lambda t: (t.import_ns or 0) + (t.curse_ns or 0),
+            reverse=True)
+
+
+def _read(path):
+    path = os.fspath(path)
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            # python < 3.11
+            import tomli as tomllib
+        with open(path, 'rb') as source:
+            return tomllib.load(source)
+    import json
+    with open(path) as source:
+        return json.load(source)
+
+
+def _entry(index, item):
+    value = _unset
+    if isinstance(item, dict):
+        try:
+            if 'value' in item:
+                value = item['value']
+                fields = [item['type'], item['attr'], None,
+                          item.get('options')]
+            else:
+                fields = [item['type'], item['attr'], item['target'],
+                          item.get('options')]
+        except KeyError as exc:
+            raise ValueError(
+                'Manifest entry {0} has no {1}'.format(index, exc))
+    elif len(item) in (3, 4):
+        fields = list(item) + [None] * (4 - len(item))
+    else:
+        raise ValueError(
+            'Manifest entry {0} should be (type, attr, target, options)'
+            .format(index))
+    fields[0] = resolve(fields[0])
+    if not isinstance(fields[0], type):
+        raise ValueError(
+            'Manifest entry {0} curses {1!r}, not a type'.format(
+                index, fields[0]))
+    return Entry(*fields, value=value)
+
+
+def load_manifest(source):
+    """Read the entries of a manifest without applying them
+
+    `source` is the path of a JSON or TOML file, a mapping with the list
+    of entries under `curses` or the list of entries itself. Entries are
+    `(type, attr, target[, options])` sequences or mappings with those
+    keys, mappings can have a literal `value` instead of a `target`.
+    """
+    if isinstance(source, str) or hasattr(source, '__fspath__'):
+        source = _read(source)
+    if isinstance(source, dict):
+        source = source.get('curses', [])
+    return Manifest([_entry(i, item) for i, item in enumerate(source)])
+
+
+def apply_manifest(source, lazy=True):
+    """Load the manifest in `source` and apply it
+
+    Returns the `Manifest`, its `reverse()` method undoes all of its
+    curses and `timings()` tells how long each entry took.
+    """
+    return load_manifest(source).apply(lazy)
@@ -0,0 +1,155 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Replicate the curses of a process in its worker processes
+
+Workers started with the spawn or forkserver methods of `multiprocessing`
+get fresh type objects, without any of the curses of their parent.
+`pool_options()` makes the workers of a `multiprocessing.Pool` or of a
+`ProcessPoolExecutor` apply them before running anything:
+
+    with ProcessPoolExecutor(4, mp_context=get_context('spawn'),
+                             **pool_options()) as executor:
+        ...
+
+Curses travel as manifest entries naming their types and values by
+reference, see `forbiddenfruit.manifest`, so the workers import them
+just like the parent did. Values that aren't callable travel pickled.
+Forked workers already have the curses of their parent, those are left
+alone.
+"""
+
+import sys
+import pickle
+import warnings
+
+from forbiddenfruit import active_curses, batch
+from forbiddenfruit.manifest import _entry, resolve
+
+
+def reference(obj):
+    """The `module:qualname` path `obj` can be imported from
+
+    Raises `ValueError` for objects that can't be found that way, like
+    lambdas, nested functions and bound methods.
+    """
+    module = getattr(obj, '__module__', None)
+    qualname = getattr(obj, '__qualname__', None)
+    if qualname and '<' not in qualname:
+        if module:
+            path = '{0}:{1}'.format(module, qualname)
+            try:
+                if resolve(path) is obj:
+                    return path
+            except (ImportError, AttributeError):
+                pass
+        # extension types tell the name of their module as it was built,
+        # look for the one they were imported as
+        for name, loaded in list(sys.modules.items()):
+            if name in ('__main__', '__mp_main__'):
+                continue
+            found = loaded
+            for attr in qualname.split('.'):
+                found = getattr(found, attr, None)
+            if found is obj:
+                return '{0}:{1}'.format(name, qualname)
+    raise ValueError('{0!r} has no importable reference'.format(obj))
+
+
+def _export(klass, attr, value, options):
+    entry = {'type': reference(klass), 'attr': attr, 'options': options}
+    if callable(value):
+        entry['target'] = reference(value)
+    else:
+        pickle.dumps(value)
+        entry['value'] = value
+    return entry
+
+
+def export_curses(strict=True):
+    """The curses in place as manifest entries
+
+    With `strict`, curses that can't be exported raise `ValueError`,
+    otherwise they're left out.
+    """
+    entries = []
+    for klass, attr, value, options in active_curses():
+        try:
+            entries.append(_export(klass, attr, value, options))
+        except (ValueError, pickle.PicklingError, TypeError, AttributeError):
+            if strict:
+                raise ValueError(
+                    "The curse of {0}.{1} can't be exported".format(
+                        klass.__name__, attr))
+    return entries
+
+
+def _applied(entry, active):
+    """Tell if the curse of `entry` is in place already, by reference"""
+    current = active.get((entry.get('type'), entry.get('attr')))
+    if current is None:
+        return False
+    if 'target' in entry:
+        return current.get('target') == entry['target']
+    try:
+        return 'value' in current and bool(current['value'] == entry['value'])
+    except Exception:
+        return False
+
+
+def replicate(entries, initializer=None, initargs=()):
+    """Apply the curses `export_curses()` gave in the parent process
+
+    Curses already in place, as in forked processes, are skipped without
+    importing anything. The ones failing to apply are reported with a
+    `RuntimeWarning` rather than raised, an initializer raising would
+    get the workers of a pool restarted over and over. Then
+    `initializer(*initargs)` is called, if given.
+    """
+    active = {}
+    for klass, attr, value, options in active_curses():
+        try:
+            entry = _export(klass, attr, value, options)
+        except (ValueError, pickle.PicklingError, TypeError, AttributeError):
+            continue
+        active[(entry['type'], entry['attr'])] = entry
+
+    failed = []
+    pending = []
+    for index, item in enumerate(entries):
+        if isinstance(item, dict) and _applied(item, active):
+            continue
+        try:
+            entry = _entry(index, item)
+            # imports happen before taking the lock of the curses
+            pending.append((entry, entry.prepare(lazy=True)))
+        except Exception as exc:
+            failed.append((item, exc))
+    with batch():
+        for entry, (value, options) in pending:
+            try:
+                entry.curse(value, options)
+            except Exception as exc:
+                failed.append((entry, exc))
+    for item, exc in failed:
+        warnings.warn('Curse not replicated, {0!r}: {1}'.format(item, exc),
+                      RuntimeWarning)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def pool_options(initializer=None, initargs=(), strict=True):
+    """Keyword arguments for pools whose workers replicate the curses
+
+    They fit both `multiprocessing.Pool` and `ProcessPoolExecutor`, the
+    pool's own `initializer` is called with `initargs` afterwards.
+    """
+    return {
+        'initializer': replicate,
+        'initargs': (export_curses(strict), initializer, initargs),
+    }
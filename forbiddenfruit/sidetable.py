@@ -0,0 +1,172 @@
+# forbiddenfruit - Patch built-in python objects
+#
+# Copyright (c) 2013-2020  Lincoln de Sousa <lincoln@clarete.li>
+#
+# This program is dual licensed under GPLv3 and MIT. See the COPYING
+# and COPYING.mit files distributed with this program for details.
+
+"""Per-instance attributes for objects without a `__dict__`
+
+Instances of `str`, `int`, `tuple` and most other built-in types can't
+hold attributes of their own. `cursed_property()` curses a property onto
+their type that keeps its values in a `SideTable`, keyed by the identity
+of the instances:
+
+    >>> origin = cursed_property(str, "origin")
+    >>> name = "".join(["lin", "coln"])
+    >>> name.origin = "user input"
+    >>> name.origin
+    'user input'
+
+Each entry is a slot in two dicts sharing the same key, with no object
+wrapping the instance. The table has to make sure an identity isn't
+reused while it still has an entry for it:
+
+  * Instances supporting weak references are only referenced weakly and
+    their entries go away along with them.
+  * The other ones are kept alive by the table until their entry is
+    discarded, or until the `scope()` it was set in is over. `sweep()`
+    drops the entries of the instances nothing else references.
+"""
+
+import sys
+import weakref
+import threading
+from contextlib import contextmanager
+
+from forbiddenfruit import curse
+
+
+class _Pin(weakref.ref):
+    """Weak reference knowing the key of the entry it keeps"""
+
+    __slots__ = ('key',)
+
+
+class _Scopes(threading.local):
+    """Keys set within each of the scopes open in a thread"""
+
+    def __init__(self):
+        self.stack = []
+
+
+class SideTable(object):
+    """Values attached to objects, keyed by their identity"""
+
+    def __init__(self):
+        # {id(obj): value} and {id(obj): obj or _Pin} with the same keys
+        self._values = {}
+        self._pins = {}
+        self._scopes = _Scopes()
+        # a single bound method shared by all the weak references
+        self._release = self._forget
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, obj):
+        return id(obj) in self._values
+
+    def get(self, obj, default=None):
+        return self._values.get(id(obj), default)
+
+    def set(self, obj, value):
+        key = id(obj)
+        pins = self._pins
+        if key not in pins:
+            if type(obj).__weakrefoffset__:
+                pins[key] = pin = _Pin(obj, self._release)
+                pin.key = key
+            else:
+                # no weak references, the object stays around as long
+                # as its entry does
+                pins[key] = obj
+            stack = self._scopes.stack
+            if stack:
+                stack[-1].append(key)
+        self._values[key] = value
+
+    def discard(self, obj):
+        """Drop the entry of `obj`, if there's one"""
+        self._forget_key(id(obj))
+
+    def clear(self):
+        self._values.clear()
+        self._pins.clear()
+
+    def _forget(self, pin):
+        self._forget_key(pin.key)
+
+    def _forget_key(self, key):
+        self._values.pop(key, None)
+        self._pins.pop(key, None)
+
+    @contextmanager
+    def scope(self):
+        """Drop the entries set within the block once it's over
+
+        Entries that were already there when the block started are left
+        alone. Scopes nest and belong to the thread that opened them.
+        """
+        stack = self._scopes.stack
+        keys = []
+        stack.append(keys)
+        try:
+            yield self
+        finally:
+            stack.pop()
+            for key in keys:
+                self._forget_key(key)
+
+    def sweep(self):
+        """Drop the entries of objects only referenced by the table
+
+        Returns how many were dropped. It needs reference counts, so
+        it's only available on CPython.
+        """
+        getrefcount = getattr(sys, 'getrefcount', None)
+        if getrefcount is None:
+            raise NotImplementedError(
+                'Sweeping needs sys.getrefcount, only available on CPython')
+        dropped = 0
+        for key in list(self._pins):
+            obj = self._pins.get(key)
+            if obj is None or isinstance(obj, _Pin):
+                continue
+            # the table, `obj` and the argument of getrefcount
+            if getrefcount(obj) <= 3:
+                self._forget_key(key)
+                dropped += 1
+            obj = None
+        return dropped
+
+    def property(self, default=None, doc=None):
+        """A property storing its values in the table"""
+        values = self._values
+        forget = self._forget_key
+
+        def fget(obj):
+            return values.get(id(obj), default)
+
+        def fdel(obj):
+            if id(obj) not in values:
+                raise AttributeError(
+                    "'{0}' object has no value for this attribute".format(
+                        type(obj).__name__))
+            forget(id(obj))
+
+        return property(fget, self.set, fdel, doc)
+
+
+def cursed_property(klass, attr, default=None, table=None,
+                    hide_from_dir=False):
+    """Curse `attr` onto `klass` as a property stored in a side table
+
+    Instances without a value read `default`. Returns the `SideTable`
+    holding the values, a new one unless `table` is given. Reversing
+    the curse leaves the table and its entries alone.
+    """
+    if table is None:
+        table = SideTable()
+    curse(klass, attr, table.property(default), hide_from_dir=hide_from_dir)
+    return table
@@ -44,10 +44,18 @@
 import os
 from setuptools import setup, find_packages, Extension
 
+# Native trampolines for cursed dunder slots. The build is optional,
+# forbiddenfruit falls back to ctypes callbacks without it
+ext_modules = [
+    Extension('forbiddenfruit._speedups',
+              sources=['forbiddenfruit/_speedups.c'],
+              optional=True),
+]
+
 if os.environ.get('FFRUIT_EXTENSION', '') == 'true':
-    ext_modules = [Extension('ffruit', sources=['tests/unit/ffruit.c'])]
-else:
-    ext_modules = []
+    ext_modules.append(Extension('ffruit', sources=['tests/unit/ffruit.c']))
+    ext_modules.append(
+        Extension('ffruit_lazy', sources=['tests/unit/ffruit_lazy.c']))
 
 
 local_file = lambda f: \
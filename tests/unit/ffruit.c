@@ -126,6 +126,102 @@ static PyTypeObject DummyType = {
 };
 
 
+/* Holds a payload without exposing it through the buffer protocol, like
+   the C types cursed with `__buffer__' */
+typedef struct {
+  PyObject_HEAD
+  PyObject *payload;
+} Blob;
+
+
+static void
+Blob_dealloc(Blob *self)
+{
+  Py_XDECREF(self->payload);
+  Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+
+static PyObject *
+Blob_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+  Blob *self;
+  PyObject *payload;
+
+  if (!PyArg_ParseTuple(args, "O:Blob", &payload))
+    return NULL;
+  self = (Blob *) type->tp_alloc(type, 0);
+  if (self != NULL) {
+    self->payload = payload;
+    Py_INCREF(payload);
+  }
+  return (PyObject *) self;
+}
+
+
+static PyObject *
+Blob_tobytes(Blob *self, PyObject *unused)
+{
+  return PyBytes_FromObject(self->payload);
+}
+
+
+static PyMemberDef Blob_members[] = {
+  {"payload", T_OBJECT_EX, offsetof(Blob, payload), READONLY,
+   "The object holding the memory of the blob"},
+  {NULL}                        /* Sentinel */
+};
+
+
+static PyMethodDef Blob_methods[] = {
+  {"tobytes", (PyCFunction) Blob_tobytes, METH_NOARGS,
+   "Return a copy of the payload"},
+  {NULL}                        /* Sentinel */
+};
+
+
+static PyTypeObject BlobType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+  "ffruit.Blob",             /*tp_name*/
+  sizeof(Blob),              /*tp_basicsize*/
+  0,                         /*tp_itemsize*/
+  (destructor) Blob_dealloc, /*tp_dealloc*/
+  0,                         /*tp_print*/
+  0,                         /*tp_getattr*/
+  0,                         /*tp_setattr*/
+  0,                         /*tp_compare*/
+  0,                         /*tp_repr*/
+  0,                         /*tp_as_number*/
+  0,                         /*tp_as_sequence*/
+  0,                         /*tp_as_mapping*/
+  0,                         /*tp_hash */
+  0,                         /*tp_call*/
+  0,                         /*tp_str*/
+  0,                         /*tp_getattro*/
+  0,                         /*tp_setattro*/
+  0,                         /*tp_as_buffer*/
+  Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
+  "Blob of forbidden bytes", /*tp_doc*/
+  0,                         /* tp_traverse */
+  0,                         /* tp_clear */
+  0,                         /* tp_richcompare */
+  0,                         /* tp_weaklistoffset */
+  0,                         /* tp_iter */
+  0,                         /* tp_iternext */
+  Blob_methods,              /* tp_methods */
+  Blob_members,              /* tp_members */
+  0,                         /* tp_getset */
+  0,                         /* tp_base */
+  0,                         /* tp_dict */
+  0,                         /* tp_descr_get */
+  0,                         /* tp_descr_set */
+  0,                         /* tp_dictoffset */
+  (initproc) 0,              /* tp_init */
+  0,                         /* tp_alloc */
+  Blob_new,                  /* tp_new */
+};
+
+
 static PyMethodDef FFruitMethods[] = {
   {"sum",  ffruit_sum, METH_VARARGS, "sum two numbers."},
   {NULL, NULL, 0, NULL}
@@ -159,6 +255,8 @@ FUNC_NAME(void)
 
   if (PyType_Ready(&DummyType) < 0)
     goto end;
+  if (PyType_Ready(&BlobType) < 0)
+    goto end;
 
 #if PY_MAJOR_VERSION < 3
   m = Py_InitModule("ffruit", FFruitMethods);
@@ -170,6 +268,8 @@ FUNC_NAME(void)
 
   Py_INCREF(&DummyType);
   PyModule_AddObject(m, "Dummy", (PyObject *)&DummyType);
+  Py_INCREF(&BlobType);
+  PyModule_AddObject(m, "Blob", (PyObject *)&BlobType);
 
  end:
 #if PY_MAJOR_VERSION < 3
@@ -0,0 +1,95 @@
+#include <Python.h>
+
+
+/* Stands for a type of some heavy extension, only to be cursed once it's
+   imported */
+typedef struct {
+  PyObject_HEAD
+} Heavy;
+
+
+static PyObject *
+Heavy_weight(Heavy *self, PyObject *unused)
+{
+  return PyLong_FromLong(1);
+}
+
+
+static PyMethodDef Heavy_methods[] = {
+  {"weight", (PyCFunction) Heavy_weight, METH_NOARGS,
+   "Return the weight of the object"},
+  {NULL}                        /* Sentinel */
+};
+
+
+static PyTypeObject HeavyType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+  "ffruit_lazy.Heavy",       /*tp_name*/
+  sizeof(Heavy),             /*tp_basicsize*/
+  0,                         /*tp_itemsize*/
+  0,                         /*tp_dealloc*/
+  0,                         /*tp_print*/
+  0,                         /*tp_getattr*/
+  0,                         /*tp_setattr*/
+  0,                         /*tp_compare*/
+  0,                         /*tp_repr*/
+  0,                         /*tp_as_number*/
+  0,                         /*tp_as_sequence*/
+  0,                         /*tp_as_mapping*/
+  0,                         /*tp_hash */
+  0,                         /*tp_call*/
+  0,                         /*tp_str*/
+  0,                         /*tp_getattro*/
+  0,                         /*tp_setattro*/
+  0,                         /*tp_as_buffer*/
+  Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+  "Heavy forbidden fruits",  /*tp_doc*/
+  0,                         /* tp_traverse */
+  0,                         /* tp_clear */
+  0,                         /* tp_richcompare */
+  0,                         /* tp_weaklistoffset */
+  0,                         /* tp_iter */
+  0,                         /* tp_iternext */
+  Heavy_methods,             /* tp_methods */
+  0,                         /* tp_members */
+  0,                         /* tp_getset */
+  0,                         /* tp_base */
+  0,                         /* tp_dict */
+  0,                         /* tp_descr_get */
+  0,                         /* tp_descr_set */
+  0,                         /* tp_dictoffset */
+  0,                         /* tp_init */
+  0,                         /* tp_alloc */
+  PyType_GenericNew,         /* tp_new */
+};
+
+
+static struct PyModuleDef ffruit_lazy_module = {
+  PyModuleDef_HEAD_INIT,
+  "ffruit_lazy",
+  "Toy module only imported on demand",
+  -1,
+  NULL
+};
+
+
+PyMODINIT_FUNC
+PyInit_ffruit_lazy(void)
+{
+  PyObject *m;
+
+  if (PyType_Ready(&HeavyType) < 0)
+    return NULL;
+
+  m = PyModule_Create(&ffruit_lazy_module);
+  if (m == NULL)
+    return NULL;
+
+  Py_INCREF(&HeavyType);
+  if (PyModule_AddObject(m, "Heavy", (PyObject *) &HeavyType) < 0) {
+    Py_DECREF(&HeavyType);
+    Py_DECREF(m);
+    return NULL;
+  }
+  return m;
+}
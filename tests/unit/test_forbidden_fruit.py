@@ -1,7 +1,16 @@
+import gc
 import sys
+import ctypes
+import weakref
+import operator
+import threading
+import time
+import subprocess
+from contextlib import contextmanager
 from datetime import datetime
-from forbiddenfruit import cursed, curses, curse, reverse
+from forbiddenfruit import cursed, curses, curse, reverse, curse_many, batch
 from types import FunctionType
+import forbiddenfruit
 from nose.tools import nottest, istest
 
 # Our stub! :)
@@ -16,6 +25,23 @@ def almost_equal(a, b, e=0.001):
 
 skip_legacy = nottest if sys.version_info < (3, 3) else istest
 
+
+def engines():
+    """The engines dunder curses run on, the native trampolines first"""
+    if forbiddenfruit._speedups is None:
+        return [None]
+    return [forbiddenfruit._speedups, None]
+
+
+@contextmanager
+def using(engine):
+    """Curse dunders with `engine` within the block, None for ctypes"""
+    speedups, forbiddenfruit._speedups = forbiddenfruit._speedups, engine
+    try:
+        yield engine
+    finally:
+        forbiddenfruit._speedups = speedups
+
 def test_cursing_a_builtin_class():
 
     # Given that I have a function that returns *blah*
@@ -376,3 +402,1852 @@ def test_cursed_decorator():
     # And it was reversed
     assert "open_box" not in dir(obj)
     assert "open_box" not in dir(dict)
+
+
+@skip_legacy
+def test_dunder_uses_native_trampoline():
+    "Dunder curses should be installed through the compiled trampolines"
+    if forbiddenfruit._speedups is None:
+        return
+
+    # Given that I curse a number slot
+    curse(FunctionType, '__neg__', lambda self: 'negative')
+    try:
+        # Then I see that the slot points to the native trampoline
+        tyobj = forbiddenfruit.PyTypeObject.from_address(id(FunctionType))
+        address = ctypes.cast(tyobj.tp_as_number[0].nb_negative,
+                              ctypes.c_void_p).value
+        assert address == forbiddenfruit._speedups.trampolines['nb_negative']
+        assert -(lambda: None) == 'negative'
+    finally:
+        reverse(FunctionType, '__neg__')
+
+
+@skip_legacy
+def test_dunder_ctypes_fallback():
+    "Dunder curses should still work when the trampolines aren't built"
+
+    # Given that the compiled trampolines aren't available
+    with using(None):
+        # When I curse a dunder method
+        def not_for_strings(self, other):
+            if isinstance(other, str):
+                raise NotImplementedError()
+            return 'sum'
+        curse(FunctionType, '__add__', not_for_strings)
+
+        # Then I see it works through ctypes callbacks, including
+        # returning NotImplemented
+        f = lambda: None
+        assert f + 1 == 'sum'
+        try:
+            f + 'a'
+        except TypeError:
+            pass
+        else:
+            assert False
+        reverse(FunctionType, '__add__')
+
+
+@skip_legacy
+def test_dunder_both_operands_cursed():
+    "Both operands get a chance to handle a binary operator"
+
+    # Given that I curse the same operator on two types, and the one from the
+    # left operand doesn't know how to handle the right operand
+    def left(self, other):
+        raise NotImplementedError()
+    curse(FunctionType, '__sub__', left)
+    curse(list, '__sub__', lambda self, other: 'right')
+
+    # Then I see that the right operand is tried as well
+    assert (lambda: None) - [] == 'right'
+
+    reverse(FunctionType, '__sub__')
+    reverse(list, '__sub__')
+
+
+def test_curse_many():
+    "curse_many() should curse a class with all the given attributes"
+
+    # Given that I curse many attributes at once
+    curse_many(str, {'many_a': 'a', 'many_b': lambda self: self + 'b'},
+               hide_from_dir=True)
+
+    # Then I see that all of them were installed
+    assert str.many_a == 'a'
+    assert 'x'.many_b() == 'xb'
+    assert 'many_a' not in dir(str)
+    assert 'many_b' not in dir(str)
+
+
+def test_batch_invalidates_each_type_once():
+    "batch() should call PyType_Modified once per distinct type"
+
+    # Given that I count the calls to PyType_Modified
+    calls = []
+    original = ctypes.pythonapi.PyType_Modified
+    ctypes.pythonapi.PyType_Modified = lambda obj: calls.append(obj.value)
+    try:
+        # When I curse and reverse a few things within nested batches
+        with batch():
+            curse(str, 'batch_a', 1)
+            with batch():
+                curse(str, 'batch_b', 2)
+                curse(int, 'batch_c', 3)
+            reverse(str, 'batch_b')
+            assert calls == []
+    finally:
+        ctypes.pythonapi.PyType_Modified = original
+
+    # Then I see that each type was invalidated only once
+    assert calls == [str, int]
+    assert str.batch_a == 1
+    assert not hasattr(str, 'batch_b')
+    assert int.batch_c == 3
+
+
+@skip_legacy
+def test_dunder_reverse_restores_native_slot():
+    "reverse() should put back the original C function of a slot"
+
+    # Given that I know the address of the native `int.__add__'
+    def nb_add():
+        tyobj = forbiddenfruit.PyTypeObject.from_address(id(int))
+        return ctypes.cast(tyobj.tp_as_number[0].nb_add,
+                           ctypes.c_void_p).value
+    native = nb_add()
+    one, two = 1, 2
+
+    # When I curse it twice and then reverse it
+    curse(int, '__add__', lambda a, b: int.__add__(a, b) * 10)
+    curse(int, '__add__', lambda a, b: int.__add__(a, b) * 100)
+    try:
+        assert operator.add(one, two) == 300
+    finally:
+        reverse(int, '__add__')
+
+    # Then I see the native function is back in place
+    assert nb_add() == native
+    assert operator.add(one, two) == 3
+
+
+@skip_legacy
+def test_dunder_reverse_frees_allocated_struct():
+    "reverse() should give back the tp_as_* structs allocated by curse()"
+
+    # Given that I have a type without number methods
+    tyobj = forbiddenfruit.PyTypeObject.from_address(id(ffruit.Dummy))
+    assert not tyobj.tp_as_number
+    before = forbiddenfruit.slot_registry.memory_usage()
+
+    # When I curse and reverse two number methods
+    curse(ffruit.Dummy, '__neg__', lambda self: 'neg')
+    curse(ffruit.Dummy, '__pos__', lambda self: 'pos')
+    assert tyobj.tp_as_number
+    assert -ffruit.Dummy() == 'neg'
+    reverse(ffruit.Dummy, '__neg__')
+    assert tyobj.tp_as_number
+    assert +ffruit.Dummy() == 'pos'
+    reverse(ffruit.Dummy, '__pos__')
+
+    # Then I see the struct is detached from the type and released
+    assert not tyobj.tp_as_number
+    forbiddenfruit.slot_registry.reclaim()
+    after = forbiddenfruit.slot_registry.memory_usage()
+    assert after['structs'] == before['structs']
+    assert after['funcs'] == before['funcs']
+    assert after['retired'] == 0
+
+
+@skip_legacy
+def test_dunder_reverse_releases_callbacks():
+    "Callbacks and the functions they hold should be freed after reverse()"
+
+    # Given that I curse a dunder many times through ctypes callbacks
+    with using(None):
+        refs = []
+        for _ in range(10):
+            def negative(self):
+                return 'negative'
+            refs.append(weakref.ref(negative))
+            curse(FunctionType, '__neg__', negative)
+            del negative
+            reverse(FunctionType, '__neg__')
+        forbiddenfruit.slot_registry.reclaim()
+
+    # Then I see that none of them are kept around
+    gc.collect()
+    assert [ref() for ref in refs] == [None] * 10
+    assert (FunctionType, 'nb_negative') not in forbiddenfruit.tp_func_dict
+
+
+def test_memoized_curse():
+    "curse() should cache the results of methods cursed with memoize"
+
+    # Given that I have a pure function that counts its calls
+    calls = []
+    def shout(self, times=1):
+        calls.append(self)
+        return self.upper() * times
+
+    # When I curse it with a cache of two entries
+    curse(str, 'shout', shout, memoize=2)
+
+    # Then I see that repeated calls are served from the cache
+    assert 'a'.shout() == 'A'
+    assert 'a'.shout() == 'A'
+    assert 'a'.shout(times=2) == 'AA'
+    assert calls == ['a', 'a']
+    assert str.shout.cache_info().hits == 1
+
+    # And that the least recently used entry gets evicted
+    assert 'b'.shout() == 'B'
+    assert 'a'.shout() == 'A'
+    assert calls == ['a', 'a', 'b', 'a']
+    assert str.shout.cache_info().currsize == 2
+
+    # And that reversing the curse drops the cache
+    memo = str.shout
+    reverse(str, 'shout')
+    assert memo.cache_info().currsize == 0
+
+
+def test_memoized_curse_size_eviction():
+    "memoize should also evict entries when results take too much memory"
+
+    # Given that I curse a method with a cache limited by size
+    curse(int, 'kilo', lambda self: 'x' * 1000 * self,
+          memoize={'maxsize': None, 'maxbytes': 3500})
+
+    # When I cache results adding up to more than that
+    for i in range(1, 4):
+        (i).kilo()
+
+    # Then I see that only the most recent ones were kept
+    info = int.kilo.cache_info()
+    assert info.currsize == 1
+    assert info.bytes <= 3500
+    reverse(int, 'kilo')
+
+
+def test_memoized_curse_keys_by_receiver_type():
+    "Equal receivers of different types shouldn't share cached results"
+    curse(int, 'kind', lambda self: type(self).__name__, memoize=True)
+    assert (1).kind() == 'int'
+    assert True.kind() == 'bool'
+    reverse(int, 'kind')
+
+
+def test_memoized_curse_requires_hashable_type():
+    "memoize can't be used on types whose instances aren't hashable"
+    try:
+        curse(list, 'first', lambda self: self[0], memoize=True)
+    except TypeError:
+        pass
+    else:
+        assert False
+
+
+@skip_legacy
+def test_toggling_curses_while_other_threads_use_them():
+    "Cursed operators should keep working while other threads toggle them"
+
+    # Given that I have threads using operators of a type
+    results = set()
+    errors = []
+    done = threading.Event()
+
+    def hammer():
+        obj = ffruit.Dummy()
+        while not done.is_set():
+            for operation in (lambda: -obj, lambda: obj.toggled()):
+                try:
+                    results.add(operation())
+                except (TypeError, AttributeError):
+                    pass
+                except Exception as exc:
+                    errors.append(exc)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=hammer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    # When I curse and reverse them over and over with both engines
+    available = engines()
+    try:
+        for i in range(200):
+            with using(available[i % len(available)]), \
+                    cursed(ffruit.Dummy, 'toggled', lambda self: 'method'):
+                curse(ffruit.Dummy, '__neg__', lambda self: 'neg')
+                time.sleep(0.0001)
+                reverse(ffruit.Dummy, '__neg__')
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+
+    # Then I see that no thread ever got anything but the cursed values
+    assert errors == []
+    assert results == set(['neg', 'method'])
+
+
+@skip_legacy
+def test_scoped_curse_is_only_seen_within_its_scope():
+    "Scoped curses shouldn't be seen outside of their block"
+
+    # Given that I have a scoped curse of a new attribute
+    with cursed(str, 'scoped_attr', lambda self: 'in scope', scoped=True):
+        # Then I see it within the block
+        assert 'x'.scoped_attr() == 'in scope'
+        with cursed(str, 'scoped_attr', lambda self: 'nested', scoped=True):
+            assert 'x'.scoped_attr() == 'nested'
+        assert 'x'.scoped_attr() == 'in scope'
+
+    # And that it isn't there anymore after the block
+    assert not hasattr('x', 'scoped_attr')
+    assert 'scoped_attr' not in dir(str)
+
+
+@skip_legacy
+def test_scoped_curse_isolated_between_threads():
+    "Scoped curses of one thread shouldn't be seen by other threads"
+    entered = threading.Event()
+    leave = threading.Event()
+    seen = []
+
+    def worker():
+        with cursed(str, 'scoped_thread', 'worker', scoped=True):
+            entered.set()
+            leave.wait()
+            seen.append(str.scoped_thread)
+
+    # Given that another thread is within a scoped curse
+    thread = threading.Thread(target=worker)
+    thread.start()
+    entered.wait()
+
+    # Then I see that this thread has its own value for it
+    try:
+        with cursed(str, 'scoped_thread', 'main', scoped=True):
+            assert str.scoped_thread == 'main'
+        assert not hasattr(str, 'scoped_thread')
+    finally:
+        leave.set()
+        thread.join()
+    assert seen == ['worker']
+
+
+@skip_legacy
+def test_scoped_curse_isolated_between_asyncio_tasks():
+    "Scoped curses of one asyncio task shouldn't be seen by others"
+    import asyncio
+
+    async def task(value):
+        with cursed(int, 'scoped_task', value, scoped=True):
+            await asyncio.sleep(0)
+            first = (0).scoped_task
+            await asyncio.sleep(0)
+            return first, (0).scoped_task
+
+    async def main():
+        return await asyncio.gather(task('a'), task('b'))
+
+    # Given that two tasks interleave within different scoped curses
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    # Then I see that each one only saw its own value
+    assert results == [('a', 'a'), ('b', 'b')]
+
+
+@skip_legacy
+def test_scoped_dunder_falls_back_to_native():
+    "Scoped dunder curses should leave the native slot working outside"
+    items = [1, 2, 3]
+
+    # Given that I have a scoped curse of a dunder
+    with cursed(list, '__len__', lambda self: 42, scoped=True):
+        # Then I see the curse within the block
+        assert len(items) == 42
+
+    # And the native implementation outside of it
+    assert len(items) == 3
+
+
+def test_dir_filtering_same_name_different_type():
+    "Hidden attributes of a type shouldn't hide those of types named alike"
+
+    # Given that I have a python class named after a C type
+    class Dummy(object):
+        pass
+
+    # When I hide an attribute of the C type
+    curse(ffruit.Dummy, 'attr_z', 'hidden', hide_from_dir=True)
+    curse(Dummy, 'attr_z', 'visible')
+
+    # Then I see that only the C type got it hidden
+    assert 'attr_z' not in dir(ffruit.Dummy)
+    assert 'attr_z' in dir(Dummy)
+    reverse(ffruit.Dummy, 'attr_z')
+
+
+def test_dir_cache_follows_curses():
+    "dir() results should be up to date with curses and reverses"
+
+    # Given that I list the attributes of a built-in type
+    before = dir(str)
+    before.append('garbage')
+
+    # When I curse and then reverse it
+    curse(str, 'cached_attr', 1)
+    assert 'cached_attr' in dir(str)
+    assert 'cached_attr' in dir('instance')
+    reverse(str, 'cached_attr')
+
+    # Then I see that dir() followed it, and didn't hand out its cache
+    assert 'cached_attr' not in dir(str)
+    assert 'garbage' not in dir(str)
+
+
+def test_dir_hidden_in_subclasses():
+    "Attributes hidden on a type should also be hidden on its subclasses"
+    curse(int, 'attr_w', 1, hide_from_dir=True)
+    assert bool.attr_w == 1
+    assert 'attr_w' not in dir(bool)
+    assert 'attr_w' not in dir(True)
+    reverse(int, 'attr_w')
+
+
+def test_dir_hook_installed_lazily():
+    "Importing forbiddenfruit shouldn't replace dir() until something's hidden"
+
+    # Given a fresh interpreter that imports forbiddenfruit
+    code = (
+        "import builtins, forbiddenfruit\n"
+        "assert builtins.dir is forbiddenfruit.__dir__\n"
+        "forbiddenfruit.curse(str, 'shown', 1)\n"
+        "assert builtins.dir is forbiddenfruit.__dir__\n"
+        "forbiddenfruit.curse(str, 'hidden', 1, hide_from_dir=True)\n"
+        "assert builtins.dir is not forbiddenfruit.__dir__\n"
+        "assert 'hidden' not in dir(str)\n"
+    )
+
+    # When I run it; Then I see dir() was only replaced by the hidden curse
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_override_dict_built_on_demand():
+    "The dunder slot table should still be reachable as override_dict"
+    assert forbiddenfruit.override_dict['__add__'] == ('tp_as_number', 'nb_add')
+    assert forbiddenfruit.override_dict['__str__'] == ('tp_str', 'tp_str')
+
+
+def test_slot_table_describes_slots():
+    "The slot table should tell where each dunder gets cursed into"
+    add, = forbiddenfruit.slot_table()['__add__']
+    assert add.tp_as_name == 'tp_as_number'
+    assert add.slot == 'nb_add'
+    assert add.struct_type is forbiddenfruit.PyNumberMethods
+    assert add.offset == forbiddenfruit.PyNumberMethods.nb_add.offset
+    assert add.arity == 2
+
+    string, = forbiddenfruit.slot_table()['__str__']
+    assert string.struct_type is forbiddenfruit.PyTypeObject
+    assert string.offset == forbiddenfruit.PyTypeObject.tp_str.offset
+    assert string.arity == 1
+
+
+def test_slot_table_arity():
+    "Each slot should take as many arguments as its dunder gets"
+    table = forbiddenfruit.slot_table()
+
+    # Given the unary number slots, __index__ included
+    unary = ('__neg__', '__pos__', '__abs__', '__invert__', '__int__',
+             '__float__', '__index__', '__bool__')
+
+    # When I look their descriptors up; Then I see they take one argument
+    for attr in unary:
+        for descriptor in table[attr]:
+            assert descriptor.arity == 1, attr
+
+    # And the power slots take a modulus
+    assert [d.arity for d in table['__pow__']] == [3]
+    assert [d.arity for d in table['__ipow__']] == [3]
+
+
+@skip_legacy
+def test_dunder_power_modulus():
+    "Cursed __pow__ should get the modulus from both engines"
+
+    def power(self, other, modulus=None):
+        return other, modulus
+
+    for engine in engines():
+        with using(engine):
+            # Given that I curse __pow__ on a C type
+            curse(ffruit.Dummy, '__pow__', power)
+            try:
+                # When I call pow() with and without a modulus
+                # Then I see the modulus only when it's given
+                dummy = ffruit.Dummy()
+                assert pow(dummy, 2, 5) == (2, 5)
+                assert dummy ** 2 == (2, None)
+            finally:
+                reverse(ffruit.Dummy, '__pow__')
+
+
+@skip_legacy
+def test_dunder_index_ctypes():
+    "Cursed __index__ should work with the ctypes callbacks"
+    with using(None):
+        # Given that I curse __index__ without the native trampolines
+        curse(FunctionType, '__index__', lambda self: 1)
+        try:
+            # When I index a list with a function
+            # Then I see the index it returns used
+            g = lambda: None
+            assert [10, 20, 30][g] == 20
+        finally:
+            reverse(FunctionType, '__index__')
+
+
+def test_layout_matches_running_interpreter():
+    "The declared type object should match the one in memory"
+    from forbiddenfruit import _layout
+
+    # Given the layout detected for this interpreter
+    structs = _layout.build(_layout.detect())
+
+    # When I read the fields of a few types; Then they're where expected
+    for klass in (int, dict, type, ffruit.Dummy):
+        _layout.check(structs, klass)
+    tyobj = forbiddenfruit.PyTypeObject.from_address(id(int))
+    assert tyobj.tp_name == b'int'
+    int.real  # lookups assign a version tag
+    assert tyobj.tp_version_tag != 0
+
+    gen = forbiddenfruit.PyTypeObject.from_address(id(type(x for x in ())))
+    assert gen.tp_finalize
+    if sys.version_info >= (3, 9):
+        assert forbiddenfruit.PyTypeObject.from_address(id(range)).tp_vectorcall
+
+    # heap types embed the slot structures, `as_async` comes first
+    class Heap(object):
+        pass
+    heap = forbiddenfruit.PyTypeObject.from_address(id(Heap))
+    assert ctypes.addressof(heap.tp_as_number[0]) - \
+        ctypes.addressof(heap.tp_as_async[0]) == \
+        ctypes.sizeof(forbiddenfruit.PyAsyncMethods)
+
+
+def test_layout_mismatch_detected():
+    "Reading type objects with another object header should be refused"
+    from forbiddenfruit import _layout
+    current = _layout.detect()
+    other = current._replace(free_threaded=not current.free_threaded)
+
+    try:
+        _layout.check(_layout.build(other))
+    except RuntimeError as exc:
+        assert 'Unsupported object layout' in str(exc)
+    else:
+        raise AssertionError('RuntimeError not raised')
+
+
+def test_supported_layouts_offsets():
+    "Each supported layout should put the type fields at CPython's offsets"
+    from forbiddenfruit import _layout
+    if ctypes.sizeof(ctypes.c_void_p) != 8:
+        return
+
+    for layout in _layout.supported_layouts():
+        structs = _layout.build(layout)
+        PyTypeObject = structs['PyTypeObject']
+        # trace refs and free threaded builds have two more words in
+        # their object headers
+        extra = 16 if layout.trace_refs or layout.free_threaded else 0
+        assert ctypes.sizeof(structs['PyObject']) == 16 + extra, layout
+        assert PyTypeObject.tp_name.offset == 24 + extra, layout
+        assert PyTypeObject.tp_as_number.offset == 96 + extra, layout
+        assert PyTypeObject.tp_new.offset == 312 + extra, layout
+        assert PyTypeObject.tp_version_tag.offset == 384 + extra, layout
+        assert PyTypeObject.tp_finalize.offset == 392 + extra, layout
+
+        if layout.version >= (3, 8):
+            assert PyTypeObject.tp_vectorcall.offset == 400 + extra, layout
+        else:
+            assert not hasattr(PyTypeObject, 'tp_vectorcall'), layout
+
+        size = {(3, 8): 416, (3, 12): 416, (3, 13): 416}.get(
+            layout.version, 400 if layout.version < (3, 8) else 408)
+        assert ctypes.sizeof(PyTypeObject) == size + extra, layout
+        assert ctypes.sizeof(structs['PyAsyncMethods']) == (
+            32 if layout.version >= (3, 10) else 24), layout
+
+
+@skip_legacy
+def test_dunder_new_vectorcall():
+    "Cursed __new__ should get the call arguments spread with vectorcall"
+
+    def new(cls, *args, **kwargs):
+        return cls, args, kwargs
+
+    for engine in engines():
+        with using(engine):
+            # Given that I curse the constructor of a C type
+            curse(ffruit.Dummy, '__new__', new, vectorcall=True)
+
+            # When I call it in all sorts of ways, enough times for the
+            # interpreter to specialize the call
+            for _ in range(20):
+                assert ffruit.Dummy(1, 2) == (ffruit.Dummy, (1, 2), {})
+            assert ffruit.Dummy(1, a=2) == (ffruit.Dummy, (1,), {'a': 2})
+            args = tuple(range(20))
+            assert ffruit.Dummy(*args) == (ffruit.Dummy, args, {})
+            assert ffruit.Dummy.__new__(ffruit.Dummy, 3) == \
+                (ffruit.Dummy, (3,), {})
+
+            # Then I see it's gone once reversed
+            reverse(ffruit.Dummy, '__new__')
+            assert isinstance(ffruit.Dummy(), ffruit.Dummy)
+
+
+@skip_legacy
+def test_dunder_new_vectorcall_runs_init():
+    "Objects made by a vectorcall __new__ should still get initialized"
+
+    # Given a type with its own __init__
+    class Point(object):
+        def __init__(self, x, y=0):
+            self.x, self.y = x, y
+
+    # When I curse its constructor
+    blank = object.__new__(Point)
+    curse(Point, '__new__', lambda cls, *args, **kw: blank, vectorcall=True)
+    try:
+        # Then I see __init__ still gets the arguments
+        point = Point(1, y=2)
+        assert point is blank
+        assert (point.x, point.y) == (1, 2)
+    finally:
+        reverse(Point, '__new__')
+
+
+@skip_legacy
+@skip_legacy
+def test_dunder_new_keywords():
+    "Classic cursed __new__ should get the same keywords from both engines"
+
+    def new(cls, args, kwargs):
+        return args, kwargs
+
+    for engine in engines():
+        with using(engine):
+            # Given that I curse the constructor of a C type
+            curse(ffruit.Dummy, '__new__', new)
+            try:
+                # When I call it with and without keywords
+                # Then I see the keywords dict or None
+                assert ffruit.Dummy(1, a=2) == ((1,), {'a': 2})
+                assert ffruit.Dummy(1) == ((1,), None)
+            finally:
+                reverse(ffruit.Dummy, '__new__')
+
+
+def test_dunder_new_skips_native_vectorcall():
+    "Cursing __new__ should take over types with their own vectorcall"
+    if sys.version_info < (3, 9):
+        return
+
+    # Given a type with its own vectorcall, like list
+    curse(list, '__new__', lambda cls, args, kwargs: 'cursed')
+    try:
+        # Then I see that calling it goes through the curse
+        assert list() == 'cursed'
+        assert list((1, 2)) == 'cursed'
+    finally:
+        reverse(list, '__new__')
+    assert list((1, 2)) == [1, 2]
+
+
+@skip_legacy
+def test_dunder_call():
+    "Instances of a type should become callable by cursing __call__"
+    for engine in engines():
+        with using(engine):
+            obj = ffruit.Dummy()
+
+            # Given that I curse __call__ on a C type with the classic
+            # signature and with vectorcall
+            curse(ffruit.Dummy, '__call__',
+                  lambda self, args, kwargs: (args, kwargs))
+            assert obj(1, 2) == ((1, 2), None)
+            assert obj(1, a=2) == ((1,), {'a': 2})
+            curse(ffruit.Dummy, '__call__',
+                  lambda self, *args, **kwargs: (self, args, kwargs),
+                  vectorcall=True)
+            assert obj(1, a=2) == (obj, (1,), {'a': 2})
+
+            # When I reverse it; Then I see it can't be called anymore
+            reverse(ffruit.Dummy, '__call__')
+            try:
+                obj()
+            except TypeError:
+                pass
+            else:
+                assert False
+
+
+def test_vectorcall_only_for_calls():
+    "Only __new__ and __call__ can be cursed with vectorcall"
+    try:
+        curse(ffruit.Dummy, '__add__', lambda a, b: a, vectorcall=True)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+@skip_legacy
+def test_dunder_mapping_slots():
+    "Cursing __getitem__, __setitem__ and __len__ should cover mappings"
+
+    class Cache(dict):
+        pass
+
+    def read_through(self, key):
+        if not dict.__contains__(self, key):
+            dict.__setitem__(self, key, 'loaded ' + key)
+        return dict.__getitem__(self, key)
+
+    def upper(self, key, value):
+        dict.__setitem__(self, key.upper(), value)
+
+    for engine in engines():
+        with using(engine):
+            cache = Cache(a=1)
+
+            # Given that I curse the mapping dunders of a dict subclass
+            curse(Cache, '__getitem__', read_through)
+            curse(Cache, '__setitem__', upper)
+            curse(Cache, '__len__', lambda self: 42)
+
+            # When I use them; Then I see they're cursed
+            for _ in range(20):
+                assert cache['b'] == 'loaded b'
+            assert operator.getitem(cache, 'a') == 1
+            cache['c'] = 3
+            assert dict(cache) == {'a': 1, 'b': 'loaded b', 'C': 3}
+            assert len(cache) == 42
+
+            # And that deleting still goes through dict
+            del cache['C']
+            assert 'C' not in dict(cache)
+
+            reverse(Cache, '__getitem__')
+            reverse(Cache, '__setitem__')
+            reverse(Cache, '__len__')
+            try:
+                cache['missing']
+            except KeyError:
+                pass
+            else:
+                assert False
+            assert len(cache) == 2
+
+
+@skip_legacy
+def test_dunder_getitem_slices():
+    "Subscripts with slices go through the mapping slot of sequences"
+
+    class Items(list):
+        pass
+
+    curse(Items, '__getitem__', lambda self, key: key)
+    try:
+        items = Items([1, 2, 3])
+        assert items[1:2] == slice(1, 2)
+        assert items[0] == 0
+        assert operator.getitem(items, -1) == -1
+    finally:
+        reverse(Items, '__getitem__')
+    assert items[1:2] == [2]
+
+
+@skip_legacy
+def test_dunder_setitem_without_deletion():
+    "Deleting items of a type that can't do it should raise TypeError"
+    if forbiddenfruit._speedups is None:
+        return
+
+    # Given a type without any item assignment of its own
+    stored = {}
+    curse(ffruit.Dummy, '__setitem__',
+          lambda self, key, value: stored.update({key: value}))
+    try:
+        obj = ffruit.Dummy()
+        obj['key'] = 'value'
+        assert stored == {'key': 'value'}
+
+        # When I delete an item; Then I see it's not supported
+        try:
+            del obj['key']
+        except TypeError as exc:
+            assert 'item deletion' in str(exc)
+        else:
+            assert False
+    finally:
+        reverse(ffruit.Dummy, '__setitem__')
+
+
+@skip_legacy
+def test_dunder_richcompare():
+    "Comparisons should be cursed one operator at a time"
+    for engine in engines():
+        with using(engine):
+            objs = [ffruit.Dummy() for _ in range(10)]
+            rank = dict((id(obj), -i) for i, obj in enumerate(objs))
+
+            # Given that I curse `<` and `==` into a C type
+            curse(ffruit.Dummy, '__lt__',
+                  lambda self, other: rank[id(self)] < rank[id(other)])
+            curse(ffruit.Dummy, '__eq__', lambda self, other: 'eq')
+
+            # When I compare instances; Then I see the cursed operators
+            assert sorted(objs) == objs[::-1]
+            assert objs[1] < objs[0]
+            assert (objs[0] == objs[1]) == 'eq'
+
+            # And that the other operators are still the original ones,
+            # object's `!=` inverts whatever `==` says
+            assert (objs[0] != objs[1]) is False
+            try:
+                objs[0] <= objs[1]
+            except TypeError:
+                pass
+            else:
+                assert False
+
+            # And that reversing an operator leaves the others cursed
+            reverse(ffruit.Dummy, '__gt__')
+            reverse(ffruit.Dummy, '__lt__')
+            assert (objs[0] == objs[1]) == 'eq'
+            try:
+                objs[1] < objs[0]
+            except TypeError:
+                pass
+            else:
+                assert False
+            reverse(ffruit.Dummy, '__eq__')
+            assert objs[0] == objs[0]
+            assert not (objs[0] == objs[1])
+
+
+@skip_legacy
+def test_dunder_iter():
+    "Cursing __iter__ should make C types iterable"
+    for engine in engines():
+        with using(engine):
+            # Given that I curse a generator as __iter__ of a C type
+            curse(ffruit.Dummy, '__iter__', lambda self: (i * 2 for i in range(3)))
+
+            # When I iterate an instance; Then I see the generator items
+            assert list(ffruit.Dummy()) == [0, 2, 4]
+
+            # And that it's not iterable after reversing the curse
+            reverse(ffruit.Dummy, '__iter__')
+            try:
+                iter(ffruit.Dummy())
+            except TypeError:
+                pass
+            else:
+                assert False
+
+
+@skip_legacy
+def test_dunder_next():
+    "Cursed __next__ should end loops by raising StopIteration"
+    item = object()
+    refcount = sys.getrefcount(item)
+    for engine in engines():
+        with using(engine):
+            remaining = [item] * 100
+
+            def next_item(self):
+                if not remaining:
+                    raise StopIteration
+                return remaining.pop()
+
+            # Given a C type cursed into an iterator
+            curse(ffruit.Dummy, '__iter__', lambda self: self)
+            curse(ffruit.Dummy, '__next__', next_item)
+            obj = ffruit.Dummy()
+
+            # When I exhaust it; Then I see all its items
+            assert list(obj) == [item] * 100
+            assert next(obj, 'done') == 'done'
+            try:
+                next(obj)
+            except StopIteration:
+                pass
+            else:
+                assert False
+
+            reverse(ffruit.Dummy, '__next__')
+            reverse(ffruit.Dummy, '__iter__')
+
+    # And that the items weren't leaked
+    assert sys.getrefcount(item) == refcount
+
+
+@skip_legacy
+def test_dunder_async():
+    "Cursing the async dunders should make C types awaitable and async iterable"
+    import asyncio
+
+    def answer(self):
+        return 42
+        yield
+
+    loop = asyncio.new_event_loop()
+    try:
+        for engine in engines():
+            with using(engine):
+                remaining = [3, 2, 1]
+
+                async def next_item():
+                    if not remaining:
+                        raise StopAsyncIteration
+                    return remaining.pop()
+
+                # Given that I curse the async protocol into a C type
+                curse(ffruit.Dummy, '__await__', answer)
+                curse(ffruit.Dummy, '__aiter__', lambda self: self)
+                curse(ffruit.Dummy, '__anext__', lambda self: next_item())
+
+                # When I await it and loop over it; Then I see the curses
+                async def main():
+                    obj = ffruit.Dummy()
+                    return await obj, [item async for item in obj]
+                assert loop.run_until_complete(main()) == (42, [1, 2, 3])
+
+                # And that reversing them makes it a plain object again
+                for attr in ('__await__', '__aiter__', '__anext__'):
+                    reverse(ffruit.Dummy, attr)
+
+                async def wait():
+                    await ffruit.Dummy()
+                try:
+                    loop.run_until_complete(wait())
+                except TypeError:
+                    pass
+                else:
+                    assert False
+    finally:
+        loop.close()
+
+
+@skip_legacy
+def test_dunder_lookup_follows_curses():
+    "Native trampolines should never call a curse that was replaced"
+    obj, number = ffruit.Dummy(), complex(1, 2)
+
+    # Given two types sharing the same trampoline
+    curse(ffruit.Dummy, '__neg__', lambda self: 'dummy')
+    curse(complex, '__neg__', lambda self: 'complex')
+    try:
+        # When I call them in turns and curse them again; Then I see
+        # the callable cursed last
+        for value in ('one', 'two', 'three'):
+            assert -obj == 'dummy'
+            assert -number == 'complex'
+            curse(ffruit.Dummy, '__neg__', lambda self, value=value: value)
+            assert -obj == value
+            curse(ffruit.Dummy, '__neg__', lambda self: 'dummy')
+        reverse(complex, '__neg__')
+        assert -number == complex(-1, -2)
+        assert -obj == 'dummy'
+    finally:
+        reverse(ffruit.Dummy, '__neg__')
+        reverse(complex, '__neg__')
+
+
+def test_instrumented_curse():
+    "Instrumented curses should count their calls, errors and latency"
+    forbiddenfruit.reset_call_stats()
+
+    def words(self, fail=False):
+        if fail:
+            raise ValueError(self)
+        return self.split()
+
+    # Given that I curse an instrumented method
+    curse(str, 'words', words, instrument=True)
+    try:
+        # When I call it from a few threads
+        def run():
+            for _ in range(10):
+                'a b'.words()
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        run()
+        try:
+            'a'.words(fail=True)
+        except ValueError:
+            pass
+
+        # Then I see the calls of all of them added up
+        stats = forbiddenfruit.call_stats()[(str, 'words')]
+        assert stats.calls == 41
+        assert stats.errors == 1
+        assert 0 <= stats.p50_ns <= stats.p99_ns <= stats.max_ns
+        assert stats.total_ns >= stats.max_ns
+        assert str.words.call_stats() == stats
+
+        # And that resetting starts over
+        forbiddenfruit.reset_call_stats()
+        'a b'.words()
+        assert forbiddenfruit.call_stats()[(str, 'words')].calls == 1
+    finally:
+        reverse(str, 'words')
+    assert (str, 'words') not in forbiddenfruit.call_stats()
+
+
+def test_uninstrumented_curse():
+    "Curses should only be wrapped when they're instrumented"
+    def words(self):
+        return self.split()
+
+    curse(str, 'words', words)
+    try:
+        assert str.__dict__['words'] is words
+        assert (str, 'words') not in forbiddenfruit.call_stats()
+    finally:
+        reverse(str, 'words')
+
+    try:
+        curse(str, 'words', 'not callable', instrument=True)
+    except TypeError:
+        pass
+    else:
+        assert False
+
+
+@skip_legacy
+def test_instrumented_dunder():
+    "Instrumented dunders shouldn't count the exceptions of their protocol"
+    def next_item(self):
+        raise StopIteration
+
+    curse(ffruit.Dummy, '__iter__', lambda self: self)
+    curse(ffruit.Dummy, '__next__', next_item, instrument=True)
+    curse(ffruit.Dummy, 'total', classmethod(lambda cls: 42), instrument=True)
+    try:
+        assert list(ffruit.Dummy()) == []
+        assert ffruit.Dummy.total() == 42
+        stats = forbiddenfruit.call_stats()
+        assert stats[(ffruit.Dummy, '__next__')][:2] == (1, 0)
+        assert stats[(ffruit.Dummy, 'total')][:2] == (1, 0)
+    finally:
+        reverse(ffruit.Dummy, 'total')
+        reverse(ffruit.Dummy, '__next__')
+        reverse(ffruit.Dummy, '__iter__')
+
+
+def manifest_targets(tmpdir, **modules):
+    "Write the given modules into `tmpdir` and make them importable"
+    import os
+    for name, source in modules.items():
+        with open(os.path.join(tmpdir, name + '.py'), 'w') as module:
+            module.write(source)
+    sys.path.insert(0, tmpdir)
+
+
+def test_manifest_lazy_targets():
+    "Manifests should only import the targets of methods when looked up"
+    import tempfile
+    from forbiddenfruit.manifest import apply_manifest
+
+    tmpdir = tempfile.mkdtemp()
+    manifest_targets(
+        tmpdir,
+        ff_lazy_targets='def shout(self):\n    return self.upper() + "!"\n',
+        ff_eager_targets='def neg(self):\n    return "neg"\n')
+    try:
+        # Given a manifest cursing a method and a dunder method
+        manifest = apply_manifest({'curses': [
+            ('str', 'shout', 'ff_lazy_targets:shout', {'hide_from_dir': True}),
+            {'type': ffruit.Dummy, 'attr': '__neg__',
+             'target': 'ff_eager_targets.neg'},
+        ]})
+
+        # When I apply it; Then I see the method target wasn't imported
+        assert 'ff_lazy_targets' not in sys.modules
+        assert 'ff_eager_targets' in sys.modules
+        assert -ffruit.Dummy() == 'neg'
+        timings = dict((t.attr, t) for t in manifest.timings())
+        assert timings['shout'].import_ns is None
+        assert timings['__neg__'].import_ns >= 0
+
+        # And that it is on the first lookup
+        assert 'yo'.shout() == 'YO!'
+        assert 'ff_lazy_targets' in sys.modules
+        assert str.__dict__['shout'].__module__ == 'ff_lazy_targets'
+        assert '_c_shout' not in str.__dict__
+        assert 'shout' not in dir('')
+        assert manifest.timings()[0].import_ns is not None or \
+            manifest.timings()[1].import_ns is not None
+
+        # And that reversing it removes everything
+        manifest.reverse()
+        assert not hasattr('', 'shout')
+        try:
+            -ffruit.Dummy()
+        except TypeError:
+            pass
+        else:
+            assert False
+    finally:
+        sys.path.remove(tmpdir)
+        sys.modules.pop('ff_lazy_targets', None)
+        sys.modules.pop('ff_eager_targets', None)
+
+
+def test_manifest_imports_outside_lock():
+    "Targets should be imported without holding the lock of the curses"
+    import tempfile
+    from forbiddenfruit.manifest import apply_manifest
+
+    # Given target modules cursing from another thread while they load
+    body = (
+        'import threading\n'
+        'from forbiddenfruit import curse\n'
+        'worker = threading.Thread(\n'
+        '    target=curse, args=(str, "{0}_loaded", True))\n'
+        'worker.start()\n'
+        'worker.join(5)\n'
+        'joined = not worker.is_alive()\n'
+        'def target(self):\n'
+        '    return joined\n')
+    tmpdir = tempfile.mkdtemp()
+    manifest_targets(tmpdir, ff_locked_lazy=body.format('lazy'),
+                     ff_locked_eager=body.format('eager'))
+    try:
+        # When I apply a manifest with a lazy and an eager target
+        manifest = apply_manifest([
+            ('str', 'locked_lazy', 'ff_locked_lazy:target'),
+            ('str', 'locked_eager', 'ff_locked_eager:target',
+             {'lazy': False}),
+        ])
+
+        # Then I see the curses of the other threads didn't wait for them
+        assert ''.locked_eager()
+        assert ''.locked_lazy()
+        assert ''.lazy_loaded and ''.eager_loaded
+
+        # And that applying it again while applied does nothing
+        assert manifest.apply() is manifest
+        assert ''.locked_lazy()
+    finally:
+        manifest.reverse()
+        reverse(str, 'lazy_loaded')
+        reverse(str, 'eager_loaded')
+        sys.path.remove(tmpdir)
+        sys.modules.pop('ff_locked_lazy', None)
+        sys.modules.pop('ff_locked_eager', None)
+
+
+def test_manifest_files():
+    "Manifests should be read from JSON and TOML files"
+    import os
+    import json
+    import tempfile
+    from forbiddenfruit.manifest import apply_manifest
+
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'curses.json')
+    with open(path, 'w') as manifest:
+        json.dump({'curses': [
+            {'type': 'int', 'attr': 'halve',
+             'target': 'operator.floordiv', 'options': {'instrument': True}},
+            {'type': 'builtins.str', 'attr': 'joinpath',
+             'target': 'posixpath:join'},
+        ]}, manifest)
+
+    # Given a JSON manifest; When I apply it eagerly
+    manifest = apply_manifest(path, lazy=False)
+    try:
+        # Then I see its curses with their options
+        assert (4).halve(2) == 2
+        assert 'a'.joinpath('b') == 'a/b'
+        assert forbiddenfruit.call_stats()[(int, 'halve')].calls == 1
+        assert all(t.import_ns is not None for t in manifest.timings())
+    finally:
+        manifest.reverse()
+    assert not hasattr(1, 'halve')
+
+    try:
+        import tomllib  # noqa: F401
+    except ImportError:
+        return
+    path = os.path.join(tmpdir, 'curses.toml')
+    with open(path, 'w') as manifest:
+        manifest.write('[[curses]]\ntype = "str"\nattr = "basename"\n'
+                       'target = "posixpath.basename"\n')
+    manifest = apply_manifest(path)
+    try:
+        assert 'a/b'.basename() == 'b'
+    finally:
+        manifest.reverse()
+
+
+def test_manifest_errors():
+    "Invalid manifest entries should be refused before cursing anything"
+    from forbiddenfruit.manifest import load_manifest
+
+    for entries in ([('int', 'halve', 'operator.floordiv', {'fast': True})],
+                    [('operator.floordiv', 'halve', 'operator.floordiv')],
+                    [{'type': 'int', 'attr': 'halve'}],
+                    [('int', 'halve')]):
+        try:
+            load_manifest(entries)
+        except ValueError:
+            pass
+        else:
+            assert False, entries
+    assert not hasattr(1, 'halve')
+
+
+def test_curse_on_import():
+    "Curses of types from modules not imported yet should wait for them"
+    from forbiddenfruit import curse_on_import
+    sys.modules.pop('tests.unit.ffruit_lazy', None)
+
+    # Given curses for a type of an extension that wasn't imported
+    curse_on_import('tests.unit.ffruit_lazy', 'Heavy', 'weight',
+                    lambda self: 42)
+    curse_on_import('tests.unit.ffruit_lazy', 'Heavy', '__neg__',
+                    lambda self: 'neg', hide_from_dir=True)
+
+    # Then I see nothing gets imported
+    assert 'tests.unit.ffruit_lazy' not in sys.modules
+
+    # When the module gets imported
+    from . import ffruit_lazy
+    try:
+        # Then I see the curses applied and the finder gone
+        assert ffruit_lazy.Heavy().weight() == 42
+        assert -ffruit_lazy.Heavy() == 'neg'
+        assert not isinstance(ffruit_lazy.__loader__,
+                              forbiddenfruit._CursingLoader)
+        assert forbiddenfruit._curse_finder not in sys.meta_path
+    finally:
+        reverse(ffruit_lazy.Heavy, '__neg__')
+        reverse(ffruit_lazy.Heavy, 'weight')
+
+
+def test_curse_on_import_loaded():
+    "Curses of types from modules already imported should be applied"
+    from forbiddenfruit import curse_on_import
+
+    # Given that the module was imported
+    assert 'tests.unit.ffruit' in sys.modules
+
+    # When I curse one of its types on import
+    curse_on_import('tests.unit.ffruit', 'Dummy', 'loaded', 'yes')
+
+    # Then I see the curse right away
+    try:
+        assert ffruit.Dummy.loaded == 'yes'
+        assert forbiddenfruit._curse_finder not in sys.meta_path
+    finally:
+        reverse(ffruit.Dummy, 'loaded')
+
+
+def test_curse_on_import_missing_type():
+    "Curses of types missing from their modules should fail the import"
+    import tempfile
+    from forbiddenfruit import curse_on_import
+
+    tmpdir = tempfile.mkdtemp()
+    manifest_targets(tmpdir, ff_import_nothing='VALUE = 1\n')
+    try:
+        # Given a curse of a type its module doesn't have
+        curse_on_import('ff_import_nothing', 'Missing', 'attr', 1)
+
+        # When I import the module; Then I see it failing
+        try:
+            import ff_import_nothing  # noqa: F401
+        except AttributeError:
+            pass
+        else:
+            assert False
+        assert 'ff_import_nothing' not in sys.modules
+        assert forbiddenfruit._curse_finder not in sys.meta_path
+    finally:
+        sys.path.remove(tmpdir)
+
+
+def test_propagated_dunder():
+    "Dunders cursed with propagate should reach the subclasses"
+
+    # Given subclasses of a C type, with and without their own __neg__
+    class Inherits(int):
+        pass
+
+    class Overrides(int):
+        def __neg__(self):
+            return 'own'
+
+    class Grandchild(Inherits):
+        pass
+
+    objs = [True, Inherits(1), Overrides(1), Grandchild(1)]
+
+    # When I curse the type without propagating
+    curse(int, '__neg__', lambda self: 'cursed')
+    try:
+        # Then I see its subclasses left out
+        assert [-obj for obj in objs] == [-1, -1, 'own', -1]
+    finally:
+        reverse(int, '__neg__')
+
+    # When I curse it propagating to the subclasses
+    curse(int, '__neg__', lambda self: 'cursed', propagate=True)
+    try:
+        # Then I see all of them cursed but the one with its own __neg__
+        assert [-obj for obj in objs] == \
+            ['cursed', 'cursed', 'own', 'cursed']
+    finally:
+        reverse(int, '__neg__')
+
+    # And that reversing it restores the whole tree
+    assert [-obj for obj in objs] == [-1, -1, 'own', -1]
+    assert (bool, 'nb_negative') not in forbiddenfruit.tp_orig_dict
+    assert not forbiddenfruit._propagated
+
+
+def test_propagated_dunder_skips_overrides():
+    "Subclasses of C types with their own slot shouldn't be cursed"
+    yes, three = True, 3
+
+    # Given that bool has its own `&`
+    curse(int, '__and__', lambda a, b: 'and', propagate=True)
+    try:
+        # Then I see it untouched by the curse
+        assert (yes & yes) is True
+        assert (three & yes) == 'and'
+    finally:
+        reverse(int, '__and__')
+    assert (three & yes) == 1
+
+
+def test_propagated_comparisons():
+    "Comparisons sharing a slot should all propagate to subclasses"
+
+    class Child(ffruit.Dummy):
+        pass
+
+    class Grandchild(Child):
+        pass
+
+    child, grandchild = Child(), Grandchild()
+
+    # Given two comparisons cursed one after the other
+    curse(ffruit.Dummy, '__lt__', lambda a, b: 'lt', propagate=True)
+    curse(ffruit.Dummy, '__gt__', lambda a, b: 'gt', propagate=True)
+    try:
+        # Then I see both reaching the subclasses
+        assert (child < child) == 'lt'
+        assert (grandchild > grandchild) == 'gt'
+
+        # And that reversing one leaves the other
+        reverse(ffruit.Dummy, '__gt__')
+        assert (grandchild < grandchild) == 'lt'
+    finally:
+        reverse(ffruit.Dummy, '__lt__')
+    try:
+        child < child
+    except TypeError:
+        pass
+    else:
+        assert False
+
+
+def test_reverse_restores_shadowed_attribute():
+    "Reversing the curse of an existing attribute should put it back"
+    obj = ffruit.Dummy()
+
+    # Given that I curse an existing method twice
+    curse(ffruit.Dummy, 'my_method', lambda self: 'first')
+    curse(ffruit.Dummy, 'my_method', lambda self: 'second')
+
+    # Then I see the backup of the original is kept
+    assert obj.my_method() == 'second'
+    assert obj._c_my_method(1) == ((1,), {})
+
+    # When I reverse the curse
+    reverse(ffruit.Dummy, 'my_method')
+
+    # Then I see the original method back, without its backup
+    assert obj.my_method(1) == ((1,), {})
+    assert '_c_my_method' not in ffruit.Dummy.__dict__
+
+
+def test_snapshot_restore():
+    "restore() should bring a type back to the state of its snapshot"
+    from forbiddenfruit import snapshot, restore
+    obj = ffruit.Dummy()
+
+    # Given a type with a few curses saved in a snapshot
+    curse(ffruit.Dummy, 'kept', 1)
+    curse(ffruit.Dummy, '__neg__', lambda self: 'kept')
+    saved = snapshot(ffruit.Dummy)
+
+    try:
+        # When I curse it some more
+        curse(ffruit.Dummy, 'kept', 2)
+        curse(ffruit.Dummy, 'added', 3, hide_from_dir=True)
+        curse(ffruit.Dummy, 'my_method', lambda self: 'cursed')
+        curse(ffruit.Dummy, 'doubled', lambda self: 4, memoize=True)
+        curse(ffruit.Dummy, '__neg__', lambda self: 'replaced')
+        curse(ffruit.Dummy, '__pos__', lambda self: 'added')
+        reverse(ffruit.Dummy, 'kept')
+        assert (obj.my_method(), -obj, +obj) == ('cursed', 'replaced', 'added')
+
+        # And restore the snapshot
+        restore(saved)
+
+        # Then I see the type as it was when saved
+        assert obj.kept == 1
+        assert not hasattr(obj, 'added')
+        assert not hasattr(obj, 'doubled')
+        assert (ffruit.Dummy, 'doubled') not in forbiddenfruit._memoized
+        assert obj.my_method(1) == ((1,), {})
+        assert '_c_my_method' not in ffruit.Dummy.__dict__
+        assert -obj == 'kept'
+        try:
+            +obj
+        except TypeError:
+            pass
+        else:
+            assert False
+
+        # And that the snapshot can be restored as a context manager
+        with snapshot(ffruit.Dummy):
+            reverse(ffruit.Dummy, '__neg__')
+            reverse(ffruit.Dummy, 'kept')
+            curse(ffruit.Dummy, 'my_method', lambda self: 'cursed')
+        assert (obj.kept, -obj) == (1, 'kept')
+        assert obj.my_method(1) == ((1,), {})
+    finally:
+        reverse(ffruit.Dummy, '__neg__')
+        reverse(ffruit.Dummy, 'kept')
+
+
+def test_snapshot_restore_nested():
+    "Snapshots of the same type should each restore their own state"
+    from forbiddenfruit import snapshot, restore
+
+    # Given two snapshots of a type, taken before and after a curse
+    outer = snapshot(str)
+    curse(str, 'nested_one', 1)
+    inner = snapshot(str)
+    curse(str, 'nested_one', 2)
+    curse(str, 'nested_two', 2, hide_from_dir=True)
+
+    # When I restore the inner one
+    restore(inner)
+
+    # Then I see the curses made after it undone
+    assert ''.nested_one == 1
+    assert not hasattr('', 'nested_two')
+
+    # And that the outer one still restores what was there before it
+    curse(str, 'nested_two', 3)
+    restore(outer)
+    assert not hasattr('', 'nested_one')
+    assert not hasattr('', 'nested_two')
+    assert (str, 'nested_one') not in forbiddenfruit._active
+    assert (str, 'nested_one') not in forbiddenfruit._cursed_attrs
+
+    # And that a snapshot restored once can be restored again
+    curse(str, 'nested_one', 4)
+    restore(outer)
+    assert not hasattr('', 'nested_one')
+
+
+def test_snapshot_restore_python_class():
+    "restore() should also undo what was set on a class without a curse"
+    from forbiddenfruit import snapshot, restore
+
+    class Plain(object):
+        kept = 1
+
+    # Given a snapshot of a class defined in python
+    saved = snapshot(Plain)
+
+    # When I change it with and without curses
+    Plain.kept = 2
+    Plain.added = 3
+    curse(Plain, 'cursed', 4)
+    restore(saved)
+
+    # Then I see all of it undone
+    assert Plain.kept == 1
+    assert not hasattr(Plain, 'added')
+    assert not hasattr(Plain, 'cursed')
+
+
+def test_active_curses():
+    "active_curses() should list the curses in place with their options"
+    from forbiddenfruit import active_curses
+
+    def shout(self):
+        return self.upper()
+
+    # Given a few curses, one of them scoped
+    curse(str, 'shout', shout, hide_from_dir=True, memoize=16)
+    curse(ffruit.Dummy, '__neg__', shout)
+    with cursed(ffruit.Dummy, 'scoped', 1, scoped=True):
+        # Then I see the ones that aren't scoped, with the given values
+        active = [c for c in active_curses()
+                  if c[1] in ('shout', '__neg__', 'scoped')]
+        assert active == [
+            (str, 'shout', shout, {'hide_from_dir': True, 'memoize': 16}),
+            (ffruit.Dummy, '__neg__', shout, {})]
+
+    # And that reversing them takes them out
+    reverse(str, 'shout')
+    reverse(ffruit.Dummy, '__neg__')
+    assert not [c for c in active_curses() if c[1] in ('shout', '__neg__')]
+
+
+def pool_shout(self):
+    return self.upper() + '!'
+
+
+def pool_negative(self):
+    return 'negative'
+
+
+def pool_probe(_):
+    return ('yo'.pool_shout(), (1).pool_answer, -ffruit.Dummy(),
+            forbiddenfruit.call_stats()[(str, 'pool_shout')].calls)
+
+
+def test_export_curses():
+    "Curses should be exported by reference, or by value when not callable"
+    from forbiddenfruit.pool import export_curses
+
+    # Given curses of a function, a value and a lambda
+    with forbiddenfruit.snapshot(str), forbiddenfruit.snapshot(int):
+        curse(str, 'pool_shout', pool_shout, instrument=True)
+        curse(int, 'pool_answer', 42)
+        curse(int, 'pool_lambda', lambda self: self)
+
+        # Then I see the lambda can't be exported
+        try:
+            export_curses()
+        except ValueError:
+            pass
+        else:
+            assert False
+
+        # And that the others can
+        exported = [entry for entry in export_curses(strict=False)
+                    if entry['attr'].startswith('pool_')]
+        assert exported == [
+            {'type': 'builtins:str', 'attr': 'pool_shout',
+             'target': 'tests.unit.test_forbidden_fruit:pool_shout',
+             'options': {'instrument': True}},
+            {'type': 'builtins:int', 'attr': 'pool_answer', 'value': 42,
+             'options': {}},
+        ]
+    assert not hasattr('', 'pool_shout')
+
+
+def test_pool_replication():
+    "Workers of a pool should get the curses of their parent"
+    from multiprocessing import get_context
+    from forbiddenfruit.pool import pool_options
+
+    # Given a few curses
+    with forbiddenfruit.snapshot(str), forbiddenfruit.snapshot(int), \
+            forbiddenfruit.snapshot(ffruit.Dummy):
+        curse(str, 'pool_shout', pool_shout, instrument=True)
+        curse(int, 'pool_answer', 42)
+        curse(ffruit.Dummy, '__neg__', pool_negative)
+        'parent'.pool_shout()
+
+        for method in ('spawn', 'fork'):
+            # When workers are started with or without forking
+            # (only the curses of this test, other tests leave theirs)
+            options = pool_options(strict=False)
+            entries, _, _ = options['initargs']
+            options['initargs'] = ([
+                entry for entry in entries
+                if entry.get('target', '').endswith(
+                    ('pool_shout', 'pool_negative')) or
+                entry['attr'] == 'pool_answer'], None, ())
+            with get_context(method).Pool(1, **options) as pool:
+                # Then I see them cursed, counting their own calls
+                assert pool.map(pool_probe, [0]) == [
+                    ('YO!', 42, 'negative', 1)]
+
+
+def test_failed_curses_arent_active():
+    "Curses that raise shouldn't be listed as active"
+    from forbiddenfruit import active_curses
+
+    # When a curse fails
+    try:
+        curse(str, 'pool_failed', 'not callable', instrument=True)
+    except TypeError:
+        pass
+
+    # Then I don't see it listed
+    assert 'pool_failed' not in [c[1] for c in active_curses()]
+
+
+def test_replicate_reports_failures():
+    "Entries that can't be replicated should warn instead of raising"
+    import warnings
+    from forbiddenfruit.pool import replicate
+
+    # Given entries with a missing target and a valid one
+    entries = [
+        {'type': 'builtins:str', 'attr': 'pool_missing',
+         'target': 'tests.unit.test_forbidden_fruit:nothing_here',
+         'options': {}},
+        {'type': 'builtins:nothing', 'attr': 'pool_missing', 'value': 1,
+         'options': {}},
+        {'type': 'builtins:int', 'attr': 'pool_replicated', 'value': 1,
+         'options': {}},
+    ]
+    called = []
+
+    # When I replicate them
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        replicate(entries, called.append, ('done',))
+    try:
+        # Then I see the type that can't be found reported, the missing
+        # target is only imported once looked up
+        assert len([w for w in caught
+                    if issubclass(w.category, RuntimeWarning)]) == 1
+        assert (1).pool_replicated == 1
+        assert called == ['done']
+        try:
+            ''.pool_missing
+        except AttributeError:
+            pass
+        else:
+            assert False
+    finally:
+        reverse(int, 'pool_replicated')
+        reverse(str, 'pool_missing')
+
+
+def test_cursed_property():
+    "Instances without a __dict__ should hold values of a cursed property"
+    from forbiddenfruit.sidetable import cursed_property
+
+    # Given a property cursed onto str
+    table = cursed_property(str, 'origin')
+    try:
+        # When I set it on a string
+        name = ''.join(['lin', 'coln'])
+        name.origin = 'user input'
+
+        # Then I see it only on that very string
+        assert name.origin == 'user input'
+        assert ''.join(['lin', 'coln']).origin is None
+        assert name in table and len(table) == 1
+
+        # And deleting it drops the entry
+        del name.origin
+        assert name.origin is None and len(table) == 0
+        try:
+            del name.origin
+        except AttributeError:
+            pass
+        else:
+            assert False
+    finally:
+        reverse(str, 'origin')
+
+
+def test_side_table_weak_entries():
+    "Entries of objects with weak references should go away with them"
+    from forbiddenfruit.sidetable import SideTable
+
+    class Tagged(object):
+        pass
+
+    # Given an entry for an object supporting weak references
+    table = SideTable()
+    obj = Tagged()
+    table.set(obj, 'tag')
+    assert table.get(obj) == 'tag'
+
+    # When the object is gone
+    del obj
+    gc.collect()
+
+    # Then so is its entry
+    assert len(table) == 0
+
+
+def test_side_table_lifetime():
+    "Entries of objects without weak references should live until dropped"
+    from forbiddenfruit.sidetable import SideTable
+
+    # Given a table
+    table = SideTable()
+    kept = ''.join(['ke', 'pt'])
+    table.set(kept, 1)
+
+    # When entries are set within scopes
+    with table.scope():
+        table.set(kept, 2)
+        with table.scope():
+            table.set(''.join(['sco', 'ped']), 3)
+            assert len(table) == 2
+        # Then the ones a scope added are dropped when it's over
+        assert len(table) == 1
+    assert table.get(kept) == 2
+
+    # And sweeping drops the ones nothing else references
+    table.set(''.join(['lo', 'st']), 4)
+    assert table.sweep() == 1
+    assert list(table._values) == [id(kept)]
+
+
+@skip_legacy
+def test_dunder_buffer():
+    "Cursed __buffer__ should export the memory of the object it returns"
+
+    def payload(self, flags):
+        return self.payload
+
+    for engine in engines():
+        with using(engine):
+            # Given a C type holding its memory in a bytearray
+            curse(ffruit.Blob, '__buffer__', payload)
+            blob = ffruit.Blob(bytearray(b'hello'))
+
+            # When I get a view of it
+            view = memoryview(blob)
+
+            # Then I see the memory of the payload, without a copy
+            assert view.obj is blob.payload
+            view[0] = ord('j')
+            assert blob.payload == bytearray(b'jello')
+            assert bytes(blob) == b'jello'
+            try:
+                blob.payload.extend(b'!')
+            except BufferError:
+                pass
+            else:
+                assert False
+
+            # And the payload is free once the view is released
+            view.release()
+            blob.payload.extend(b'!')
+            assert bytes(blob) == b'jello!'
+
+            # And read-only payloads stay read-only
+            view = memoryview(ffruit.Blob(b'hi'))
+            assert view.readonly and view.tobytes() == b'hi'
+
+            # And the type has no buffer once reversed
+            reverse(ffruit.Blob, '__buffer__')
+            try:
+                memoryview(blob)
+            except TypeError:
+                pass
+            else:
+                assert False
+
+
+@skip_legacy
+def test_dunder_buffer_errors():
+    "Objects without a buffer returned by __buffer__ should raise"
+
+    # Given a cursed __buffer__ returning something without a buffer
+    curse(ffruit.Blob, '__buffer__', lambda self, flags: self.payload)
+    # (ctypes callbacks can't set exceptions)
+    error = TypeError if forbiddenfruit._speedups is not None else SystemError
+    try:
+        # When I get a view of it
+        # Then I see the error of the payload
+        try:
+            memoryview(ffruit.Blob(3))
+        except error:
+            pass
+        else:
+            assert False
+
+        # And writable views of read-only payloads are refused
+        try:
+            ctypes.c_char.from_buffer(ffruit.Blob(b'hi'))
+        except (error, TypeError):
+            pass
+        else:
+            assert False
+    finally:
+        reverse(ffruit.Blob, '__buffer__')
+
+
+@skip_legacy
+def test_trampoline_cache_invalidation():
+    "Trampolines shouldn't call what they looked up before a change"
+
+    class Sub(ffruit.Dummy):
+        pass
+
+    for engine in engines():
+        with using(engine):
+            # Given a subclass calling a curse found on its base
+            curse(ffruit.Dummy, '__neg__', lambda self: 'base', propagate=True)
+            try:
+                sub = Sub()
+                assert -sub == 'base'
+
+                # When the base gets cursed again; Then I see the new one
+                curse(ffruit.Dummy, '__neg__', lambda self: 'again',
+                      propagate=True)
+                assert -sub == 'again'
+
+                # When the subclass gets its own and loses it
+                # Then I see the one of the base again
+                curse(Sub, '__neg__', lambda self: 'own')
+                assert -sub == 'own'
+                reverse(Sub, '__neg__')
+                curse(ffruit.Dummy, '__neg__', lambda self: 'again',
+                      propagate=True)
+                assert -sub == 'again'
+
+                # When a plain curse changes the version tag of the type
+                # (attribute lookups give it a new one)
+                tyobj = forbiddenfruit.PyTypeObject.from_address(id(Sub))
+                sub.args
+                version = tyobj.tp_version_tag
+                with cursed(ffruit.Dummy, 'cache_probe', 1):
+                    # Then I see the same curse looked up again
+                    assert -sub == 'again'
+                    sub.args
+                    assert tyobj.tp_version_tag not in (0, version)
+            finally:
+                reverse(ffruit.Dummy, '__neg__')